@@ -0,0 +1,181 @@
+import json
+import sys
+import numpy as np
+from tf_recorder import read_recording
+
+
+def slerp(q0, q1, t):
+    """
+    Batched spherical linear interpolation of scalar-last quaternions.
+
+    q0, q1: (m, 4), t: (m,) in [0, 1]. Takes the short way round and falls back
+    to normalized linear interpolation for nearly equal quaternions.
+    """
+    q0 = q0 / np.linalg.norm(q0, axis=1, keepdims=True)
+    q1 = q1 / np.linalg.norm(q1, axis=1, keepdims=True)
+    dot = np.einsum('ij,ij->i', q0, q1)
+    q1 = np.where(dot[:, None] < 0, -q1, q1)
+    dot = np.abs(dot)
+
+    theta = np.arccos(np.clip(dot, -1.0, 1.0))
+    sin_theta = np.sin(theta)
+    close = sin_theta < 1e-6
+    safe = np.where(close, 1.0, sin_theta)
+    w0 = np.where(close, 1 - t, np.sin((1 - t) * theta) / safe)
+    w1 = np.where(close, t, np.sin(t * theta) / safe)
+    q = w0[:, None] * q0 + w1[:, None] * q1
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def interpolate_poses(stamps, position, quaternion, query, max_gap=np.inf):
+    """
+    Poses of a sorted stream at query stamps: linear in position, SLERP in rotation.
+
+    Returns (position (m, 3), quaternion (m, 4), valid (m,)); a query is valid
+    when it lies inside the stream and its two neighbours are at most max_gap apart.
+    """
+    query = np.asarray(query, dtype=float)
+    hi = np.clip(np.searchsorted(stamps, query, side='right'), 1, len(stamps) - 1)
+    lo = hi - 1
+    span = stamps[hi] - stamps[lo]
+    t = np.clip((query - stamps[lo]) / np.where(span > 0, span, 1.0), 0.0, 1.0)
+    valid = (query >= stamps[0]) & (query <= stamps[-1]) & (span <= max_gap)
+
+    p = position[lo] + t[:, None] * (position[hi] - position[lo])
+    q = slerp(quaternion[lo], quaternion[hi], t) if quaternion is not None else None
+    return p, q, valid
+
+
+def detect_dwells(stamps, position, speed=2e-3, min_duration=1.0, window=0.2, trim=0.1):
+    """
+    Static segments of a stream: (starts, stops) sample index arrays, stop exclusive.
+
+    A sample is static while the displacement over the next window seconds stays
+    below speed * window (speed in position units per second). Runs of static
+    samples lasting at least min_duration are kept, with trim seconds cut from
+    both ends to drop settling.
+    """
+    ahead = np.minimum(np.searchsorted(stamps, stamps + window), len(stamps) - 1)
+    elapsed = stamps[ahead] - stamps
+    displacement = np.linalg.norm(position[ahead] - position, axis=1)
+    static = (elapsed > 0) & (displacement <= speed * np.maximum(elapsed, window))
+
+    edges = np.diff(static.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+
+    # Trim settling at both ends, then keep segments that are still long enough
+    starts = np.searchsorted(stamps, stamps[starts] + trim)
+    stops = np.searchsorted(stamps, stamps[stops - 1] - trim, side='right')
+    keep = (stops > starts) & (stamps[np.maximum(stops - 1, 0)] - stamps[np.minimum(starts, len(stamps) - 1)] >= min_duration)
+    return starts[keep], stops[keep]
+
+
+def _segment_rows(starts, stops):
+    """Sample indices of all segments back to back, and where each segment begins in them."""
+    lengths = stops - starts
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    rows = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+    return rows, offsets
+
+
+def segment_means(starts, stops, values):
+    """(k, d) mean of values over each [start, stop) segment."""
+    if not len(starts):
+        return np.zeros((0, values.shape[1]))
+    rows, offsets = _segment_rows(starts, stops)
+    return np.add.reduceat(values[rows], offsets, axis=0) / (stops - starts)[:, None]
+
+
+def segment_mean_quaternions(starts, stops, quaternion):
+    """(k, 4) mean orientation per segment, signs aligned to each segment's first quaternion."""
+    if not len(starts):
+        return np.zeros((0, 4))
+    rows, offsets = _segment_rows(starts, stops)
+    q = quaternion[rows]
+    reference = np.repeat(quaternion[starts], stops - starts, axis=0)
+    q = np.where(np.einsum('ij,ij->i', q, reference)[:, None] < 0, -q, q)
+    mean = np.add.reduceat(q, offsets, axis=0)
+    return mean / np.linalg.norm(mean, axis=1, keepdims=True)
+
+
+def associate(tracker, robot, speed=2e-3, min_duration=1.0, window=0.2, trim=0.1, max_gap=0.1, offset=0.0):
+    """
+    Match a tracker stream with a robot stream recorded at other rates.
+
+    tracker, robot: (stamps, position, quaternion) sorted by stamp; quaternion
+    may be None. The robot stream is interpolated at every tracker stamp
+    (robot stamps shifted by offset seconds), dwells are detected on the
+    tracker stream and averaged. Returns a dict of per-dwell arrays:
+    start, stop (seconds), samples, tracker position / quaternion and robot
+    position / quaternion.
+    """
+    t_stamps, t_position, t_quaternion = tracker
+    r_stamps, r_position, r_quaternion = robot
+    r_position, r_quaternion, valid = interpolate_poses(np.asarray(r_stamps) + offset, r_position, r_quaternion,
+                                                        t_stamps, max_gap)
+
+    starts, stops = detect_dwells(t_stamps, t_position, speed, min_duration, window, trim)
+    # Dwells with any tracker sample the robot stream does not cover are dropped
+    invalid = np.concatenate(([0], np.cumsum(~valid)))
+    keep = invalid[stops] == invalid[starts]
+    starts, stops = starts[keep], stops[keep]
+
+    result = {
+        "start": t_stamps[starts], "stop": t_stamps[stops - 1], "samples": stops - starts,
+        "tracker_position": segment_means(starts, stops, t_position),
+        "robot_position": segment_means(starts, stops, r_position),
+        "tracker_quaternion": segment_mean_quaternions(starts, stops, t_quaternion) if t_quaternion is not None else None,
+        "robot_quaternion": segment_mean_quaternions(starts, stops, r_quaternion) if r_quaternion is not None else None,
+    }
+    return result
+
+
+def to_session(dwells, robot_key="link_transforms", prefix="P"):
+    """
+    Dwells in the data.json layout: tracker_points plus the robot poses under
+    robot_key, named P1, P2, ... in time order, ready for solve_aT3_6p and the
+    distance evaluators.
+    """
+    names = [f"{prefix}{k + 1}" for k in range(len(dwells["start"]))]
+    tracker_points = [{"name": name, "pose": p.tolist()} for name, p in zip(names, dwells["tracker_position"])]
+    if robot_key == "link_transforms":
+        if dwells["robot_quaternion"] is None:
+            raise ValueError("link_transforms need robot orientations; the robot stream has none, "
+                             "use a pose key such as wrist3_Link_poses")
+        robot = [{"name": name, "Translation": p.tolist(), "Rotation": q.tolist()}
+                 for name, p, q in zip(names, dwells["robot_position"], dwells["robot_quaternion"])]
+    elif dwells["robot_quaternion"] is not None:
+        robot = [{"name": name, "pose": p.tolist() + q.tolist()}
+                 for name, p, q in zip(names, dwells["robot_position"], dwells["robot_quaternion"])]
+    else:
+        robot = [{"name": name, "pose": p.tolist()} for name, p in zip(names, dwells["robot_position"])]
+    return {"tracker_points": tracker_points, robot_key: robot}
+
+
+def streams_from_recording(path):
+    """{(target, source): (stamps, translation, rotation)} from a TfRecorder file, each sorted by stamp."""
+    records, frame_pairs = read_recording(path)
+    order = np.argsort(records["stamp"], kind='stable')
+    records = records[order]
+    streams = {}
+    for idx, pair in enumerate(frame_pairs):
+        rows = records[records["pair"] == idx]
+        streams[pair] = (np.asarray(rows["stamp"]), np.asarray(rows["translation"]), np.asarray(rows["rotation"]))
+    return streams
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (5, 6):
+        print("Usage: python association.py <tf_recording> <tracker_pair> <robot_pair> <output_json> [robot_key]\n"
+              "       pairs are indices into the recording's frame pairs")
+        sys.exit(1)
+
+    streams = list(streams_from_recording(sys.argv[1]).values())
+    dwells = associate(streams[int(sys.argv[2])], streams[int(sys.argv[3])])
+    session = to_session(dwells, sys.argv[5] if len(sys.argv) == 6 else "link_transforms")
+    with open(sys.argv[4], 'w') as file:
+        json.dump(session, file, indent=1)
+    for name, start, stop, samples in zip((p["name"] for p in session["tracker_points"]),
+                                          dwells["start"], dwells["stop"], dwells["samples"]):
+        print(f"{name}: {start:.3f} - {stop:.3f} s, {samples} tracker samples")
@@ -0,0 +1,112 @@
+import csv
+import os
+import sys
+from multiprocessing import Pool
+import numpy as np
+from pose_store import load_data
+from calibration_cache import calibrate
+from distance_errors import evaluate_all_pairs, evaluate_session
+import evaluate_precision_by_distance
+import evaluate_precision_by_distance_and_repeatability
+
+COLUMNS = ["session", "stage", "method", "count", "mean", "std", "rms", "max", "error"]
+
+
+def find_sessions(root):
+    """JSON files and pose store directories (holding meta.json) below root, sorted."""
+    sessions = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if "meta.json" in filenames:
+            sessions.append(dirpath)
+            dirnames[:] = []
+            continue
+        dirnames.sort()
+        sessions.extend(os.path.join(dirpath, f) for f in sorted(filenames) if f.endswith(".json"))
+    return sessions
+
+
+def _row(session, stage, method, values=None, **stats):
+    row = dict.fromkeys(COLUMNS, "")
+    row.update(session=session, stage=stage, method=method)
+    if values is not None:
+        values = np.abs(np.asarray(values, dtype=float))
+        stats = {"count": len(values), "mean": values.mean(), "std": values.std(),
+                 "rms": np.sqrt(np.mean(values ** 2)), "max": values.max()}
+    row.update(stats)
+    return row
+
+
+def evaluate_session_file(session):
+    """
+    Every evaluation that applies to one session, as table rows.
+
+    Sessions with link transforms are calibrated (per-group 6p spread) and, when
+    wrist3/sensor poses are present, evaluated by distance with that aT3 (from the
+    calibration cache when the session was solved before).
+    Sessions with tracker points and other pose lists get the all-pairs distance
+    errors; tracker-only sessions get precision and repeatability. Files that
+    are not sessions (e.g. aT3_results.json) give no rows; failures give one
+    row carrying the error.
+    """
+    try:
+        data = load_data(session)
+        if not isinstance(data, dict) or "tracker_points" not in data:
+            return []
+
+        rows = []
+        if "link_transforms" in data:
+            results = calibrate(data["tracker_points"], data["link_transforms"])
+            est_6p = np.array([p6[0] for _, p6 in results])
+            i, j = np.triu_indices(len(est_6p), 1)
+            rows.append(_row(session, "calibration", "6p spread", np.linalg.norm(est_6p[i] - est_6p[j], axis=1)))
+
+            if "wrist3_Link_poses" in data and "sensor_poses" in data:
+                names, reference, methods = evaluate_precision_by_distance.method_points(
+                    data, np.array([aT3 for aT3, _ in results]))
+                for method, r in evaluate_all_pairs(names, reference, methods).items():
+                    rows.append(_row(session, "precision", method, **{k: r[k] for k in ("count", "mean", "std", "rms", "max")}))
+
+        elif len(data) > 1:
+            for method, r in evaluate_session(data).items():
+                rows.append(_row(session, "precision", method, **{k: r[k] for k in ("count", "mean", "std", "rms", "max")}))
+
+        else:
+            # Repeatability runs are evaluated in the unit they were recorded in (mm)
+            tracker_points = {p["name"]: p["pose"][:3] for p in data["tracker_points"]}
+            results = evaluate_precision_by_distance_and_repeatability.evaluate(tracker_points)
+            rows.append(_row(session, "repeatability", "precision", results["precision"]))
+            rows.append(_row(session, "repeatability", "repeatability", results["odd"] + results["even"]))
+
+        return rows
+    except Exception as e:
+        return [_row(session, "error", "", error=f"{type(e).__name__}: {e}")]
+
+
+def run_sweep(root, out_csv, processes=None, max_tasks_per_child=50):
+    """
+    Evaluate every session under root in a process pool, streaming rows into out_csv.
+
+    Workers are recycled after max_tasks_per_child sessions to bound their memory;
+    rows are written as each session finishes, in completion order.
+    """
+    sessions = find_sessions(root)
+    counts = {"sessions": len(sessions), "rows": 0, "errors": 0}
+    with open(out_csv, 'w', newline='') as file, \
+            Pool(processes, maxtasksperchild=max_tasks_per_child) as pool:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+        for rows in pool.imap_unordered(evaluate_session_file, sessions):
+            writer.writerows(rows)
+            file.flush()
+            counts["rows"] += len(rows)
+            counts["errors"] += sum(1 for row in rows if row["error"])
+    return counts
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python batch_sweep.py <sessions_dir> <output_csv> [processes]")
+        sys.exit(1)
+
+    counts = run_sweep(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) == 4 else None)
+    print(f"{counts['sessions']} files, {counts['rows']} rows, {counts['errors']} errors -> {sys.argv[2]}")
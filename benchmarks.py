@@ -0,0 +1,307 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import calibration_cache
+from distance_errors import evaluate_all_pairs
+from evaluate_precision_by_distance import calculate_aT6
+from solve_aT3_6p import solve_aT3_6p_batch
+from solve_aT3_6p_json_refactor import solve_aT3_6p
+from solve_aT6 import calculate_link6_transforms
+from transforms import compose, make_transforms
+
+# Next to the calibration cache rather than in the working tree
+HISTORY_FILE = os.environ.get("AT3_BENCH_HISTORY",
+                              os.path.join(os.path.expanduser("~"), ".cache", "aT3_bench", "benchmark_history.json"))
+
+# Sample counts per case; the quick suite stops one size earlier
+SIZES = {
+    "solve_aT3_6p_batch": [5, 1000, 100000, 1000000],
+    "solve_aT3_6p": [5, 1000, 100000],
+    "calculate_aT6": [5, 1000, 100000, 1000000],
+    "calculate_link6_transforms": [5, 1000, 100000],
+    "evaluate_all_pairs": [5, 1000, 10000],
+    "solve_aT3_6p_batch_noisy": [10, 1000, 100000],
+    "solve_aT3_6p_noisy": [10, 1000, 10000],
+}
+
+# Tracker noise (metres) of the *_noisy cases, each run at every level
+NOISE_LEVELS = [1e-5, 1e-4, 1e-3]
+NOISY_POINTS_PER_GROUP = 10
+
+# A case slower than its recent runs on this host by more than this factor -> regression
+REGRESSION_FACTOR = 1.3
+
+
+def random_quaternions(rng, n):
+    q = rng.normal(size=(n, 4))
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def make_session(groups, points_per_group=5, noise=0.0, seed=0):
+    """
+    Synthetic calibration session with known ground truth.
+
+    Every group has its own rigid aT3 and all groups share one 6p; tracker
+    points are aT3 @ Link3TEnd @ 6p plus isotropic noise (metres). Returns
+    arrays: Link3TEnds (G, n, 4, 4), marker_points (G, n, 3), link translation
+    (G, n, 3) and quaternion (G, n, 4), and the true aT3 (G, 4, 4) and 6p (3,).
+    """
+    rng = np.random.default_rng(seed)
+    n = groups * points_per_group
+
+    aT3 = make_transforms(rng.uniform(-3, 3, size=(groups, 3)), random_quaternions(rng, groups))
+    p6 = rng.uniform(-0.2, 0.2, size=3)
+
+    translation = rng.uniform(-0.6, 0.6, size=(n, 3))
+    quaternion = random_quaternions(rng, n)
+    Link3TEnds = make_transforms(translation, quaternion).reshape(groups, points_per_group, 4, 4)
+
+    end_points = Link3TEnds[..., :3, :3] @ p6 + Link3TEnds[..., :3, 3]
+    marker_points = np.einsum('gij,gnj->gni', aT3[:, :3, :3], end_points) + aT3[:, None, :3, 3]
+    marker_points += rng.normal(scale=noise, size=marker_points.shape) if noise else 0.0
+
+    return {
+        "Link3TEnds": Link3TEnds, "marker_points": marker_points,
+        "translation": translation.reshape(groups, points_per_group, 3),
+        "quaternion": quaternion.reshape(groups, points_per_group, 4),
+        "aT3": aT3, "6p": p6,
+    }
+
+
+def to_json_layout(session):
+    """The session as data.json lists, with groups [P1..Pn], [Pn+1..P2n], ..."""
+    G, n = session["marker_points"].shape[:2]
+    names = [f"P{k + 1}" for k in range(G * n)]
+    tracker_points = [{"name": name, "pose": p} for name, p in zip(names, session["marker_points"].reshape(-1, 3).tolist())]
+    link_transforms = [{"name": name, "Translation": t, "Rotation": q} for name, t, q in
+                       zip(names, session["translation"].reshape(-1, 3).tolist(), session["quaternion"].reshape(-1, 4).tolist())]
+    groups = [names[g * n:(g + 1) * n] for g in range(G)]
+    return {"tracker_points": tracker_points, "link_transforms": link_transforms}, groups
+
+
+def measure(fn, repeat=3, budget=2.0):
+    """
+    Best wall time over up to repeat runs (stopping once budget seconds are
+    used), and the peak traced allocation of one extra run, in bytes.
+    """
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times = []
+    spent = time.perf_counter()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+        if time.perf_counter() - spent > budget:
+            break
+    return min(times), peak, result
+
+
+# Each case: (size) -> (function to time, check(result) -> (error, tolerance))
+
+def case_solve_aT3_6p_batch(size):
+    s = make_session(max(size // 5, 1))
+    run = lambda: solve_aT3_6p_batch(s["Link3TEnds"][..., :3, :], s["marker_points"])
+    check = lambda r: (max(np.abs(r[0] - s["aT3"]).max(), np.abs(r[1] - s["6p"]).max()), 1e-6)
+    return run, check
+
+
+def case_solve_aT3_6p(size):
+    s = make_session(max(size // 5, 1))
+    data, groups = to_json_layout(s)
+    run = lambda: solve_aT3_6p(data["tracker_points"], data["link_transforms"], groups)
+    check = lambda r: (max(max(np.abs(aT3 - s["aT3"][g]).max(), np.abs(p6[0] - s["6p"]).max())
+                           for g, (aT3, p6) in enumerate(r)), 1e-6)
+    return run, check
+
+
+def _reconstruction_rms(s, aT3, p6):
+    """RMS distance between the marker points predicted by a solution and the noise-free ones."""
+    def predict(aT3, p6):
+        end_points = np.einsum('gnij,gj->gni', s["Link3TEnds"][..., :3, :3], p6) + s["Link3TEnds"][..., :3, 3]
+        return np.einsum('gij,gnj->gni', aT3[:, :3, :3], end_points) + aT3[:, None, :3, 3]
+
+    G = len(s["aT3"])
+    error = predict(aT3, np.reshape(p6, (G, 3))) - predict(s["aT3"], np.broadcast_to(s["6p"], (G, 3)))
+    return np.sqrt(np.mean(np.sum(error ** 2, axis=-1)))
+
+
+# Noisy cases: the linear solve minimises an algebraic residual in the Link3
+# frame, which with 10 points per group leaves a reconstruction error of about
+# 1.2 noise at every size and level; 2 noise still fails a degraded fit
+
+def case_solve_aT3_6p_batch_noisy(size, noise):
+    s = make_session(max(size // NOISY_POINTS_PER_GROUP, 1), NOISY_POINTS_PER_GROUP, noise)
+    run = lambda: solve_aT3_6p_batch(s["Link3TEnds"][..., :3, :], s["marker_points"])
+    check = lambda r: (_reconstruction_rms(s, *r), 2 * noise)
+    return run, check
+
+
+def case_solve_aT3_6p_noisy(size, noise):
+    s = make_session(max(size // NOISY_POINTS_PER_GROUP, 1), NOISY_POINTS_PER_GROUP, noise)
+    data, groups = to_json_layout(s)
+    run = lambda: solve_aT3_6p(data["tracker_points"], data["link_transforms"], groups)
+    check = lambda r: (_reconstruction_rms(s, np.array([aT3 for aT3, _ in r]), np.array([p6 for _, p6 in r])),
+                       2 * noise)
+    return run, check
+
+
+def case_calculate_aT6(size):
+    s = make_session(max(size // 5, 1))
+    aT3 = np.repeat(s["aT3"], s["translation"].shape[1], axis=0)
+    link = {"Translation": s["translation"].reshape(-1, 3), "Rotation": s["quaternion"].reshape(-1, 4)}
+    expected = aT3 @ s["Link3TEnds"].reshape(-1, 4, 4)
+    run = lambda: calculate_aT6(aT3, link)
+    check = lambda r: (np.abs(r - expected).max(), 1e-12)
+    return run, check
+
+
+def case_calculate_link6_transforms(size, cache_dir):
+    s = make_session(max(size // 5, 1))
+    data, groups = to_json_layout(s)
+    expected = compose(s["aT3"][:, None], s["Link3TEnds"])
+
+    def run():
+        # Cold cache every run, so the solve is part of the timing
+        calibration_cache.clear(cache_dir)
+        return calculate_link6_transforms(data, groups)
+
+    check = lambda r: (np.abs(r - expected).max(), 1e-6)
+    return run, check
+
+
+def case_evaluate_all_pairs(size):
+    rng = np.random.default_rng(size)
+    reference = rng.uniform(-2, 2, size=(size, 3))
+    rotation = make_transforms(np.zeros(3), random_quaternions(rng, 1)[0])[:3, :3]
+    methods = {
+        # A rigid motion keeps every distance: all errors must vanish
+        "rigid": reference @ rotation.T + [0.3, -1.0, 0.5],
+        "noisy": reference + rng.normal(scale=1e-3, size=reference.shape),
+    }
+    names = [f"P{k + 1}" for k in range(size)]
+    run = lambda: evaluate_all_pairs(names, reference, methods)
+
+    def check(r):
+        error = r["rigid"]["max"]
+        if size <= 2000:
+            i, j = np.triu_indices(size, 1)
+            truth = np.abs(np.linalg.norm(methods["noisy"][i] - methods["noisy"][j], axis=1)
+                           - np.linalg.norm(reference[i] - reference[j], axis=1))
+            error = max(error, abs(r["noisy"]["mean"] - truth.mean()), abs(r["noisy"]["max"] - truth.max()))
+        error = max(error, abs(r["noisy"]["count"] - size * (size - 1) // 2))
+        return error, 1e-9
+
+    return run, check
+
+
+def run_suite(quick=False, only=None):
+    # Calibrations solved here go to a throwaway cache, not the user's
+    cache_dir = tempfile.mkdtemp(prefix="aT3_bench_")
+    user_cache_dir, calibration_cache.CACHE_DIR = calibration_cache.CACHE_DIR, cache_dir
+    results = []
+    try:
+        for name, sizes in SIZES.items():
+            if only and name not in only:
+                continue
+            for size in sizes[:-1] if quick else sizes:
+                for noise in NOISE_LEVELS if name.endswith("_noisy") else [0.0]:
+                    if name == "calculate_link6_transforms":
+                        run, check = case_calculate_link6_transforms(size, cache_dir)
+                    elif noise:
+                        run, check = globals()[f"case_{name}"](size, noise)
+                    else:
+                        run, check = globals()[f"case_{name}"](size)
+                    seconds, peak, result = measure(run)
+                    error, tolerance = check(result)
+                    results.append({"name": name, "size": size, "noise": noise, "seconds": seconds,
+                                    "peak_mb": peak / 2**20, "error": float(error), "tolerance": tolerance,
+                                    "ok": bool(error <= tolerance)})
+                    r = results[-1]
+                    label = f"{name}@{noise:g}" if noise else name
+                    print(f"{label:<32} {size:>9} {seconds*1e3:>11.3f} ms {r['peak_mb']:>10.1f} MB "
+                          f"err={error:.2e} {'ok' if r['ok'] else 'FAILED'}", flush=True)
+    finally:
+        calibration_cache.clear(cache_dir)
+        calibration_cache.CACHE_DIR = user_cache_dir
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_history(history_file):
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file, 'r') as file:
+        return json.load(file)
+
+
+def compare(results, history, host, runs=5):
+    """
+    Regressions against the median of the last runs on the same host, which
+    smooths over one noisy run: [(name, size, baseline s, current s)].
+    Cases are keyed by name, size and noise level (0 in runs saved before noise).
+    """
+    key = lambda r: (r["name"], r["size"], r.get("noise", 0.0))
+    before = {}
+    for run in [run for run in history if run["host"] == host][-runs:]:
+        for r in run["results"]:
+            before.setdefault(key(r), []).append(r["seconds"])
+    baseline = {k: float(np.median(seconds)) for k, seconds in before.items()}
+    return [(r["name"], r["size"], baseline[key(r)], r["seconds"]) for r in results
+            if key(r) in baseline and r["seconds"] > REGRESSION_FACTOR * baseline[key(r)]
+            and r["seconds"] > 1e-3]
+
+
+def main(argv):
+    quick = "--quick" in argv
+    save = "--no-save" not in argv
+    argv = [arg for arg in argv if arg not in ("--quick", "--no-save")]
+    history_file = argv[0] if argv else HISTORY_FILE
+
+    print(f"{'Case':<32} {'Samples':>9} {'Best time':>14} {'Peak mem':>13}")
+    results = run_suite(quick)
+
+    host = platform.node()
+    history = load_history(history_file)
+    regressions = compare(results, history, host)
+    for name, size, before, now in regressions:
+        print(f"REGRESSION {name} [{size}]: {before*1e3:.3f} ms -> {now*1e3:.3f} ms ({now / before:.2f}x)")
+
+    if save:
+        history.append({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _git_commit(), "host": host,
+                        "python": platform.python_version(), "numpy": np.__version__, "quick": quick,
+                        "results": results})
+        os.makedirs(os.path.dirname(os.path.abspath(history_file)), exist_ok=True)
+        with open(history_file, 'w') as file:
+            json.dump(history, file, indent=1)
+
+    failed = [r for r in results if not r["ok"]]
+    if failed:
+        print(f"{len(failed)} cases do not match the ground truth")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    if any(arg in ("-h", "--help") for arg in sys.argv[1:]):
+        print("Usage: python benchmarks.py [history_file] [--quick] [--no-save]\n"
+              f"       history_file defaults to $AT3_BENCH_HISTORY or {HISTORY_FILE}")
+        sys.exit(1)
+    main(sys.argv[1:])
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+import numpy as np
+import instrumentation
+from pose_set import PoseSet
+from solve_aT3_6p_json_refactor import GROUPS, solve_aT3_6p
+
+# Bump when the solver changes in a way that changes its results
+SOLVER_VERSION = 1
+
+CACHE_DIR = os.environ.get("AT3_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "aT3"))
+MAX_BYTES = 64 << 20
+# Temporary files older than this are from writers that never finished
+STALE_TMP_SECONDS = 3600
+
+# In-process memo of recent results, keyed by digest
+_memo = OrderedDict()
+_memo_size = 32
+
+
+def digest(tracker_points, link_transforms, groups=GROUPS, rcond=None):
+    """
+    Content key of one calibration: the rows the groups actually use, the
+    grouping itself and the solver options. Row order in the session and any
+    points outside the groups do not change the key.
+    """
+    tracker = PoseSet.from_entries(tracker_points)
+    links = PoseSet.from_link_transforms(link_transforms)
+
+    h = hashlib.sha256()
+    h.update(json.dumps({"version": SOLVER_VERSION, "groups": groups, "rcond": rcond}, sort_keys=True).encode())
+    for group in groups:
+        h.update(np.ascontiguousarray(tracker.positions(group), dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(links.positions(group), dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(links.quaternions(group), dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def _memo_put(key, aT3, p6):
+    _memo[key] = (aT3, p6)
+    _memo.move_to_end(key)
+    while len(_memo) > _memo_size:
+        _memo.popitem(last=False)
+
+
+def _results(aT3, p6):
+    """(G, 4, 4), (G, 3) -> the [(aT3 (4, 4), 6p (1, 3))] list solve_aT3_6p returns."""
+    return [(aT3[k].copy(), p6[k:k + 1].copy()) for k in range(len(aT3))]
+
+
+def _load(path):
+    try:
+        with np.load(path) as stored:
+            aT3, p6 = stored["aT3"], stored["p6"]
+    except (OSError, KeyError, ValueError):
+        return None
+    # Touch on hit so eviction drops the least recently used entries
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return aT3, p6
+
+
+def _store(cache_dir, key, aT3, p6):
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write then rename, so concurrent readers never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            np.savez(file, aT3=aT3, p6=p6)
+        os.replace(tmp, os.path.join(cache_dir, key + ".npz"))
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def evict(cache_dir=None, max_bytes=MAX_BYTES):
+    """Remove least recently used entries until the cache holds at most max_bytes."""
+    cache_dir = cache_dir or CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".npz"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        elif entry.name.endswith(".tmp") and time.time() - entry.stat().st_mtime > STALE_TMP_SECONDS:
+            # Left behind by a writer that was killed mid-write
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def clear(cache_dir=None):
+    """Drop every cached calibration, on disk and in memory."""
+    _memo.clear()
+    evict(cache_dir, 0)
+
+
+def calibrate(tracker_points, link_transforms, groups=GROUPS, rcond=None, cache_dir=None, max_bytes=MAX_BYTES):
+    """
+    solve_aT3_6p, fetched from the cache when the same inputs were solved before.
+
+    Looks in the in-process memo, then in cache_dir (default CACHE_DIR, or
+    $AT3_CACHE_DIR); only on a miss is the solve run and its result stored.
+    Returns [(aT3 (4, 4), 6p (1, 3))] per group, like solve_aT3_6p.
+    """
+    key = digest(tracker_points, link_transforms, groups, rcond)
+    if key in _memo:
+        _memo.move_to_end(key)
+        instrumentation.count("calibration_memo_hits")
+        return _results(*_memo[key])
+
+    cache_dir = cache_dir or CACHE_DIR
+    path = os.path.join(cache_dir, key + ".npz")
+    hit = _load(path) if os.path.exists(path) else None
+    if hit is not None:
+        instrumentation.count("calibration_disk_hits")
+    else:
+        results = solve_aT3_6p(tracker_points, link_transforms, groups, rcond)
+        hit = (np.array([aT3 for aT3, _ in results]), np.array([p6[0] for _, p6 in results]))
+        _store(cache_dir, key, *hit)
+        evict(cache_dir, max_bytes)
+
+    _memo_put(key, *hit)
+    return _results(*hit)
+
+
+def write_aT3_results(results, json_file):
+    """Write aT3 matrices in the aT3_results.json layout evaluate_precision_by_distance reads."""
+    data = {"aT3_mats": [{"group": idx + 1, "aT3": aT3.tolist()} for idx, (aT3, _) in enumerate(results)]}
+    with open(json_file, 'w') as file:
+        json.dump(data, file, indent=1)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2 and sys.argv[1] == "--clear":
+        clear()
+        sys.exit(0)
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python calibration_cache.py <json_file> [aT3_results.json]\n"
+              "       python calibration_cache.py --clear")
+        sys.exit(1)
+
+    from pose_store import load_data
+
+    data = load_data(sys.argv[1])
+    print(f"key {digest(data['tracker_points'], data['link_transforms'])}")
+    results = calibrate(data["tracker_points"], data["link_transforms"])
+    for idx, (est_aT3, est_6p) in enumerate(results):
+        print(f"Group {idx+1}: est_aT3 =\n{est_aT3}\n est_6p =\n{est_6p}\n")
+    if len(sys.argv) == 3:
+        write_aT3_results(results, sys.argv[2])
@@ -0,0 +1,197 @@
+import sys
+import numpy as np
+import instrumentation
+from pose_store import StoreTable, load_data
+from pose_set import PoseSet
+
+
+def iter_pair_errors(reference, methods, chunk_size=1 << 20):
+    """
+    Yield the distance errors of every pair i < j, one block of rows at a time.
+
+    reference: (N, 3) ground-truth points (e.g. tracker points)
+    methods: {label: (N, 3)} points of each method, row-aligned with reference
+    chunk_size: approximate number of pairs per block, bounds peak memory
+
+    Yields (i, j, errors) where i, j are the pair indices of the block and
+    errors maps each label to |d_reference(i, j) - d_method(i, j)|.
+    """
+    reference = np.asarray(reference, dtype=float)[:, :3]
+    methods = {label: np.asarray(points, dtype=float)[:, :3] for label, points in methods.items()}
+    n = len(reference)
+    for points in methods.values():
+        assert points.shape == reference.shape
+
+    i0 = 0
+    while i0 < n - 1:
+        # Rows i0..i1 against columns i0..n, keeping only the upper triangle
+        rows = max(1, min(n - 1 - i0, chunk_size // (n - i0)))
+        i1 = i0 + rows
+        upper = np.arange(i0, n)[None, :] > np.arange(i0, i1)[:, None]
+        ii, jj = np.nonzero(upper)
+        i, j = ii + i0, jj + i0
+
+        ref_dist = _block_distances(reference, i0, i1)[upper]
+        errors = {label: np.abs(ref_dist - _block_distances(points, i0, i1)[upper])
+                  for label, points in methods.items()}
+        yield i, j, errors
+
+        i0 = i1
+
+
+def _block_distances(points, i0, i1):
+    """(i1 - i0, N - i0) distances between rows i0..i1 and rows i0..N."""
+    d2 = np.zeros((i1 - i0, len(points) - i0))
+    for axis in range(3):
+        column = points[i0:, axis]
+        d2 += np.subtract.outer(column[:i1 - i0], column) ** 2
+    return np.sqrt(d2)
+
+
+def pairwise_errors(reference, methods):
+    """All pair indices and errors at once, for small point sets (plots, tables)."""
+    blocks = list(iter_pair_errors(reference, methods))
+    if not blocks:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), {label: np.zeros(0) for label in methods}
+
+    i = np.concatenate([b[0] for b in blocks])
+    j = np.concatenate([b[1] for b in blocks])
+    errors = {label: np.concatenate([b[2][label] for b in blocks]) for label in methods}
+    return i, j, errors
+
+
+def _histogram(errors, edges):
+    """np.histogram for evenly spaced edges, via bincount instead of a sort."""
+    bins = len(edges) - 1
+    scaled = (errors - edges[0]) * (bins / (edges[-1] - edges[0]))
+    inside = (scaled >= 0) & (scaled <= bins)
+    idx = np.minimum(scaled[inside].astype(np.int64), bins - 1)
+    return np.bincount(idx, minlength=bins)
+
+
+def _merge_top_k(top, errors, i, j, k):
+    """Keep the k largest (error, i, j) entries of top plus a new block."""
+    err = np.concatenate((top[0], errors))
+    i = np.concatenate((top[1], i))
+    j = np.concatenate((top[2], j))
+    if len(err) > k:
+        keep = np.argpartition(err, len(err) - k)[len(err) - k:]
+        err, i, j = err[keep], i[keep], j[keep]
+    return err, i, j
+
+
+def evaluate_all_pairs(names, reference, methods, bins=50, bin_range=None, top_k=10, chunk_size=1 << 20):
+    """
+    Summary statistics of the distance errors over all pairs of named points.
+
+    The N x N matrix is never built: errors are streamed block by block into
+    running sums, a fixed-edge histogram and a top-k buffer. When bin_range is
+    not given, a first pass finds the largest error of each method.
+
+    Returns {label: {"count", "mean", "std", "rms", "min", "max",
+                     "hist", "bin_edges", "worst_pairs"}}.
+    """
+    with instrumentation.stage("evaluation"):
+        results = _evaluate_all_pairs(names, reference, methods, bins, bin_range, top_k, chunk_size)
+    instrumentation.count("pairs_evaluated", len(reference) * (len(reference) - 1) // 2 * len(methods))
+    return results
+
+
+def _evaluate_all_pairs(names, reference, methods, bins, bin_range, top_k, chunk_size):
+    names = list(names)
+    if bin_range is None:
+        max_error = dict.fromkeys(methods, 0.0)
+        for _, _, errors in iter_pair_errors(reference, methods, chunk_size):
+            for label, err in errors.items():
+                max_error[label] = max(max_error[label], err.max())
+        edges = {label: np.linspace(0.0, max_error[label] or 1.0, bins + 1) for label in methods}
+    else:
+        edges = {label: np.linspace(bin_range[0], bin_range[1], bins + 1) for label in methods}
+
+    count = 0
+    # Running mean and sum of squared deviations, merged block by block (Chan et al.)
+    mean = dict.fromkeys(methods, 0.0)
+    m2 = dict.fromkeys(methods, 0.0)
+    total_sq = dict.fromkeys(methods, 0.0)
+    lowest = dict.fromkeys(methods, np.inf)
+    highest = dict.fromkeys(methods, 0.0)
+    hist = {label: np.zeros(bins, dtype=np.int64) for label in methods}
+    empty = (np.zeros(0), np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+    top = dict.fromkeys(methods, empty)
+
+    for i, j, errors in iter_pair_errors(reference, methods, chunk_size):
+        n_block = len(i)
+        merged = count + n_block
+        for label, err in errors.items():
+            block_mean = err.mean()
+            delta = block_mean - mean[label]
+            mean[label] += delta * n_block / merged
+            m2[label] += ((err - block_mean) ** 2).sum() + delta ** 2 * count * n_block / merged
+            total_sq[label] += err @ err
+            lowest[label] = min(lowest[label], err.min())
+            highest[label] = max(highest[label], err.max())
+            hist[label] += _histogram(err, edges[label])
+            top[label] = _merge_top_k(top[label], err, i, j, top_k)
+        count = merged
+
+    results = {}
+    for label in methods:
+        err, i, j = top[label]
+        order = np.argsort(err)[::-1]
+        results[label] = {
+            "count": count,
+            "mean": mean[label] if count else np.nan,
+            "std": np.sqrt(m2[label] / count) if count else np.nan,
+            "rms": np.sqrt(total_sq[label] / count) if count else np.nan,
+            "min": lowest[label] if count else np.nan,
+            "max": highest[label] if count else np.nan,
+            "hist": hist[label],
+            "bin_edges": edges[label],
+            "worst_pairs": [(names[i[o]], names[j[o]], err[o]) for o in order],
+        }
+    return results
+
+
+def print_summary(results):
+    """Print the per-method statistics and worst pairs."""
+    print(f"\n{'Method':<45} {'Pairs':>8} {'Mean':>10} {'Std':>10} {'RMS':>10} {'Max':>10}")
+    for label, r in results.items():
+        print(f"{label:<45} {r['count']:>8} {r['mean']:>10.5f} {r['std']:>10.5f} {r['rms']:>10.5f} {r['max']:>10.5f}")
+
+    for label, r in results.items():
+        print(f"\nWorst pairs, {label}:")
+        for name_i, name_j, err in r["worst_pairs"]:
+            print(f"  {name_i}-{name_j}: {err:.5f}")
+
+
+def evaluate_session(data, reference_key="tracker_points"):
+    """All-pairs errors of every {"name", "pose"} list in a session against reference_key."""
+    reference = PoseSet.from_entries(data[reference_key])
+    methods = {key: PoseSet.from_entries(value) for key, value in data.items()
+               if key != reference_key and isinstance(value, (list, StoreTable)) and value and "pose" in value[0]}
+
+    names = reference.common_names(*methods.values())
+    return evaluate_all_pairs(
+        names,
+        reference.positions(names),
+        {key: points.positions(names) for key, points in methods.items()})
+
+
+def main(data_file, reference_key="tracker_points"):
+    # Every other list of {"name", "pose"} entries in the file is a method
+    data = load_data(data_file)
+    print_summary(evaluate_session(data, reference_key))
+
+    # Orientation errors of the lists that carry quaternions, next to the distances
+    from orientation_errors import evaluate_session_orientation, print_orientation_summary
+    orientation_key, orientation_results = evaluate_session_orientation(data, reference_key)
+    if orientation_results:
+        print_orientation_summary(orientation_results, orientation_key)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python distance_errors.py <json_file> [reference_key]")
+        sys.exit(1)
+
+    main(*sys.argv[1:])
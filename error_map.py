@@ -0,0 +1,167 @@
+import sys
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+from pose_store import load_data
+from pose_set import PoseSet
+
+
+def rigid_fit(source, target):
+    """
+    Least-squares rigid transform (R, t) with R @ source + t ~ target (Kabsch).
+
+    source, target: (N, 3) corresponding points.
+    """
+    source_mean, target_mean = source.mean(axis=0), target.mean(axis=0)
+    H = (source - source_mean).T @ (target - target_mean)
+    U, _, Vt = np.linalg.svd(H)
+    D = np.diag([1.0, 1.0, np.sign(np.linalg.det(Vt.T @ U.T))])
+    R = Vt.T @ D @ U.T
+    return R, target_mean - R @ source_mean
+
+
+def session_residuals(data, robot_key="wrist3_Link_poses", reference_key="tracker_points"):
+    """
+    Robot positions and the 3D error vectors measured at them in one session.
+
+    The tracker points are brought into the robot frame by a rigid fit over the
+    session; the error at each point is tracker - robot, i.e. where the robot
+    really went relative to where it reported to be.
+    """
+    tracker = PoseSet.from_entries(data[reference_key])
+    robot = PoseSet.from_entries(data[robot_key])
+    names = tracker.common_names(robot)
+    measured, reported = tracker.positions(names), robot.positions(names)
+    R, t = rigid_fit(measured, reported)
+    return reported, measured @ R.T + t - reported
+
+
+class ErrorMap:
+    """
+    Spatial model of 3D error vectors over the workspace.
+
+    Samples are indexed in a KD-tree; a query interpolates the k nearest error
+    vectors by inverse distance weighting. expected_error() predicts where the
+    robot lands relative to a target, correct() the target to command instead.
+    """
+
+    def __init__(self, positions, errors, k=8, power=2.0):
+        self.positions = np.ascontiguousarray(positions, dtype=float)
+        self.errors = np.ascontiguousarray(errors, dtype=float)
+        self.k = min(k, len(self.positions))
+        self.power = power
+        self.tree = cKDTree(self.positions)
+
+    @classmethod
+    def from_sessions(cls, sessions, robot_key="wrist3_Link_poses", **kwargs):
+        """Build from session files or stores, each registered on its own."""
+        samples = [session_residuals(load_data(path), robot_key) for path in sessions]
+        return cls(np.concatenate([p for p, _ in samples]), np.concatenate([e for _, e in samples]), **kwargs)
+
+    def expected_error(self, targets, return_distance=False, workers=1):
+        """
+        (M, 3) targets -> (M, 3) interpolated error vectors; with return_distance
+        also the distance to the nearest sample, as a measure of support.
+        """
+        targets = np.atleast_2d(np.asarray(targets, dtype=float))
+        distance, index = self.tree.query(targets, k=self.k, workers=workers)
+        if self.k == 1:
+            distance, index = distance[:, None], index[:, None]
+
+        exact = distance[:, 0] == 0
+        weights = 1.0 / np.where(exact[:, None], 1.0, distance) ** self.power
+        # A target on a sample takes that sample's error
+        weights[exact] = 0.0
+        weights[exact, 0] = 1.0
+        weights /= weights.sum(axis=1, keepdims=True)
+        error = np.einsum('mk,mkd->md', weights, self.errors[index])
+        return (error, distance[:, 0]) if return_distance else error
+
+    def correct(self, targets, workers=1):
+        """Targets to command so that the robot lands on the given ones."""
+        targets = np.atleast_2d(np.asarray(targets, dtype=float))
+        return targets - self.expected_error(targets, workers=workers)
+
+    def to_grid(self, spacing, margin=0.0):
+        """Sample the map on a regular grid over the data's bounding box, for constant-time lookups."""
+        lower = self.positions.min(axis=0) - margin
+        upper = self.positions.max(axis=0) + margin
+        shape = np.maximum(np.ceil((upper - lower) / spacing).astype(int) + 1, 2)
+        axes = [lower[d] + spacing * np.arange(shape[d]) for d in range(3)]
+        nodes = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+        return GridErrorMap(lower, spacing, self.expected_error(nodes, workers=-1).reshape(*shape, 3))
+
+    def cross_validate(self, fraction=0.1, seed=0):
+        """RMS of predicted minus measured error on a held-out fraction of the samples."""
+        rng = np.random.default_rng(seed)
+        held = rng.random(len(self.positions)) < fraction
+        model = ErrorMap(self.positions[~held], self.errors[~held], self.k, self.power)
+        residual = model.expected_error(self.positions[held]) - self.errors[held]
+        return np.sqrt(np.mean(np.sum(residual ** 2, axis=1)))
+
+
+class GridErrorMap:
+    """
+    Error vectors on a regular grid with trilinear interpolation; targets
+    outside the grid are clamped to its boundary.
+    """
+
+    def __init__(self, lower, spacing, values):
+        self.lower = np.asarray(lower, dtype=float)
+        self.spacing = float(spacing)
+        self.values = np.asarray(values, dtype=float)
+
+    def expected_error(self, targets):
+        targets = np.atleast_2d(np.asarray(targets, dtype=float))
+        shape = np.array(self.values.shape[:3])
+        u = np.clip((targets - self.lower) / self.spacing, 0, shape - 1)
+        i0 = np.minimum(u.astype(int), shape - 2)
+        f = u - i0
+
+        error = np.zeros((len(targets), 3))
+        for corner in range(8):
+            offset = np.array([(corner >> 2) & 1, (corner >> 1) & 1, corner & 1])
+            weight = np.prod(np.where(offset, f, 1 - f), axis=1)
+            idx = i0 + offset
+            error += weight[:, None] * self.values[idx[:, 0], idx[:, 1], idx[:, 2]]
+        return error
+
+    def correct(self, targets):
+        targets = np.atleast_2d(np.asarray(targets, dtype=float))
+        return targets - self.expected_error(targets)
+
+    def save(self, path):
+        np.savez(path, lower=self.lower, spacing=self.spacing, values=self.values)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            return cls(stored["lower"], stored["spacing"], stored["values"])
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {"--robot-key": "wrist3_Link_poses", "--spacing": "0.05"}
+    for flag in list(options):
+        if flag in args:
+            idx = args.index(flag)
+            options[flag] = args[idx + 1]
+            del args[idx:idx + 2]
+    if len(args) < 2:
+        print("Usage: python error_map.py <grid_out.npz> <session> [<session> ...] "
+              "[--robot-key wrist3_Link_poses] [--spacing 0.05]")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    error_map = ErrorMap.from_sessions(args[1:], options["--robot-key"])
+    build = time.perf_counter() - start
+    magnitude = np.linalg.norm(error_map.errors, axis=1)
+    print(f"{len(error_map.positions)} samples, error mean={magnitude.mean():.6f} max={magnitude.max():.6f}, "
+          f"index built in {build*1e3:.1f} ms")
+    if len(error_map.positions) >= 20:
+        print(f"held-out prediction rms: {error_map.cross_validate():.6f}")
+
+    start = time.perf_counter()
+    grid = error_map.to_grid(float(options["--spacing"]))
+    grid.save(args[0])
+    print(f"grid {grid.values.shape[:3]} written to {args[0]} in {(time.perf_counter() - start)*1e3:.1f} ms")
@@ -0,0 +1,137 @@
+import json
+import os
+import socket
+import stat
+import sys
+
+# Only the stdlib is imported at module level: the client side of this file has
+# to start fast. numpy, scipy and the solver/evaluation modules are imported
+# once by serve() and then stay warm for every job.
+
+# Scripts whose main() can be run as a job, with the keyword arguments that keep them headless
+SCRIPTS = {
+    "evaluate_precision_by_distance": {"plot": False},
+    "evaluate_precision_by_distance_no_aT6": {"plot": False},
+    "evaluate_precision_by_distance_and_repeatability": {},
+    "solve_aT3_6p_json_refactor": {},
+    "solve_aT6": {},
+    "distance_errors": {},
+}
+
+
+def request(socket_path, job, **params):
+    """Send one job to a running service and return its decoded reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.connect(socket_path)
+        conn.sendall(json.dumps(dict(params, job=job)).encode() + b"\n")
+        reply = conn.makefile('rb').readline()
+    return json.loads(reply)
+
+
+def _to_json(value):
+    """numpy arrays and scalars -> plain lists and numbers."""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"cannot encode {type(value).__name__}")
+
+
+def serve(socket_path, cache_size=8):
+    """Listen on a Unix socket and answer newline-delimited JSON jobs until a shutdown job."""
+    import contextlib
+    import importlib
+    import io
+    import socketserver
+    import threading
+    import traceback
+    import numpy as np
+    import scipy.spatial.transform  # noqa: F401  (kept warm for the refinement/uncertainty modules)
+    import calibration_cache
+    import pose_store
+
+    pose_store.set_cache_size(cache_size)
+    modules = {name: importlib.import_module(name) for name in SCRIPTS}
+    # Jobs capture stdout, which is process-wide, so they run one at a time
+    lock = threading.Lock()
+
+    def run_job(job):
+        kind = job["job"]
+        if kind == "ping":
+            return {"pid": os.getpid()}
+        if kind == "run":
+            script = job["script"]
+            if script not in SCRIPTS:
+                raise ValueError(f"unknown script {script}")
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                modules[script].main(*job.get("args", []), **SCRIPTS[script])
+            return {"output": output.getvalue()}
+        if kind == "solve_aT3_6p":
+            data = pose_store.load_data(job["data"])
+            results = calibration_cache.calibrate(data["tracker_points"], data["link_transforms"])
+            return {"aT3": [aT3 for aT3, _ in results], "6p": [p6[0] for _, p6 in results]}
+        if kind == "solve_aT6":
+            data = pose_store.load_data(job["data"])
+            return {"aT6": modules["solve_aT6"].calculate_link6_transforms(data)}
+        if kind == "distance_errors":
+            data = pose_store.load_data(job["data"])
+            results = modules["distance_errors"].evaluate_session(data, job.get("reference_key", "tracker_points"))
+            return {"results": results}
+        raise ValueError(f"unknown job {kind}")
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    job = json.loads(line)
+                    if job.get("job") == "shutdown":
+                        reply = {"ok": True}
+                        threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    else:
+                        with lock:
+                            reply = dict(run_job(job), ok=True)
+                except Exception as e:
+                    reply = {"ok": False, "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+                self.wfile.write(json.dumps(reply, default=_to_json).encode() + b"\n")
+                self.wfile.flush()
+
+    # Only a stale socket is removed; anything else at the path is left alone
+    if os.path.exists(socket_path):
+        if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            raise FileExistsError(f"{socket_path} exists and is not a socket")
+        os.unlink(socket_path)
+    with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as server:
+        server.daemon_threads = True
+        print(f"Serving on {socket_path} (numpy {np.__version__})", flush=True)
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+
+def main(argv):
+    if len(argv) >= 2 and argv[0] == "serve":
+        serve(argv[1], int(argv[2]) if len(argv) > 2 else 8)
+        return
+
+    if len(argv) >= 3 and argv[1] == "run":
+        reply = request(argv[0], "run", script=argv[2], args=argv[3:])
+    elif len(argv) >= 2:
+        params = {"data": argv[2]} if len(argv) > 2 else {}
+        reply = request(argv[0], argv[1], **params)
+    else:
+        print("Usage: python eval_service.py serve <socket> [cache_size]\n"
+              "       python eval_service.py <socket> run <script> [args ...]\n"
+              "       python eval_service.py <socket> <ping|solve_aT3_6p|solve_aT6|distance_errors|shutdown> [data]")
+        sys.exit(1)
+
+    if not reply["ok"]:
+        print(reply["error"], file=sys.stderr)
+        sys.exit(1)
+    if "output" in reply:
+        print(reply["output"], end="")
+    else:
+        print(json.dumps({k: v for k, v in reply.items() if k != "ok"}, indent=1))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
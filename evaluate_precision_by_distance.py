@@ -1,26 +1,20 @@
 import numpy as np
-from scipy.spatial.transform import Rotation as R
 import json
-import matplotlib.pyplot as plt
-
-
-def quaternion_to_rotation_matrix(q):
-    """Convert quaternion to rotation matrix."""
-    r = R.from_quat([q[0], q[1], q[2], q[3]])  # Scalar-last order
-    return r.as_matrix()
-
-
-def calculate_distance(pose1, pose2):
-    """Calculate Euclidean distance between two poses."""
-    return np.linalg.norm(np.array(pose1) - np.array(pose2))
+import os
+import sys
+import instrumentation
+from calibration_cache import calibrate
+from distance_errors import evaluate_all_pairs, pairwise_errors
+from pose_store import load_data
+from pose_set import PoseSet
+from solve_aT3_6p_json_refactor import GROUPS
+from transforms import compose, make_transforms, positions
 
 
 def calculate_aT6(aT3, link_transform):
     """Calculate aT6 using aT3 and the link transform."""
-    r = quaternion_to_rotation_matrix(link_transform["Rotation"])
-    t = np.array(link_transform["Translation"]).reshape(3, 1)
-    link3ToLink6 = np.vstack((np.hstack((r, t)), [0, 0, 0, 1]))
-    return np.dot(aT3, link3ToLink6)
+    link3ToLink6 = make_transforms(link_transform["Translation"], link_transform["Rotation"])
+    return compose(aT3, link3ToLink6)
 
 
 def load_aT3_results(aT3_json_file):
@@ -34,103 +28,98 @@ def load_aT3_results(aT3_json_file):
     return aT3_results
 
 
-def main(data_file, aT3_json_file):
-    # Load data
-    with open(data_file, 'r') as file:
-        data = json.load(file)
-
-    tracker_points = {p["name"]: p["pose"][:3] for p in data["tracker_points"]}
-    link_transforms = {t["name"]: t for t in data["link_transforms"]}
-    wrist3_Link_poses = {p["name"]: p["pose"][:3] for p in data["wrist3_Link_poses"]}
-    sensor_poses = {p["name"]: p["pose"][:3] for p in data["sensor_poses"]}
+def method_points(data, aT3_results, groups=GROUPS):
+    """
+    Point names, tracker ground truth and the positions of every other method.
 
-    # Load aT3 results from JSON
-    aT3_results = load_aT3_results(aT3_json_file)
+    Every point of every calibration group that all methods recorded, each
+    composed with its own group's aT3 (as in solve_aT6.calculate_link6_transforms).
+    """
+    tracker_points = PoseSet.from_entries(data["tracker_points"])
+    link_transforms = PoseSet.from_link_transforms(data["link_transforms"])
+    wrist3_Link_poses = PoseSet.from_entries(data["wrist3_Link_poses"])
+    sensor_poses = PoseSet.from_entries(data["sensor_poses"])
 
-    # Ground truth distances (Method 1)
-    a1 = calculate_distance(tracker_points["P1"], tracker_points["P6"])
-    a2 = calculate_distance(tracker_points["P6"], tracker_points["P11"])
-    a3 = calculate_distance(tracker_points["P1"], tracker_points["P11"])
-
-    # Method 2: Calculate aT6 for P1, P6, P11 and compute distances
-    aT3_P1, aT3_P6, aT3_P11 = aT3_results
-    aT6_P1 = calculate_aT6(aT3_P1, link_transforms["P1"])
-    aT6_P6 = calculate_aT6(aT3_P6, link_transforms["P6"])
-    aT6_P11 = calculate_aT6(aT3_P11, link_transforms["P11"])
-
-    b1 = calculate_distance(aT6_P1[:3, 3], aT6_P6[:3, 3])
-    b2 = calculate_distance(aT6_P6[:3, 3], aT6_P11[:3, 3])
-    b3 = calculate_distance(aT6_P1[:3, 3], aT6_P11[:3, 3])
-
-    # Method 3: Distances from wrist3_Link poses
-    c1 = calculate_distance(wrist3_Link_poses["P1"], wrist3_Link_poses["P6"])
-    c2 = calculate_distance(wrist3_Link_poses["P6"], wrist3_Link_poses["P11"])
-    c3 = calculate_distance(wrist3_Link_poses["P1"], wrist3_Link_poses["P11"])
-
-    # Method 4: Distances from sensor poses
-    d1 = calculate_distance(sensor_poses["P1"], sensor_poses["P6"])
-    d2 = calculate_distance(sensor_poses["P6"], sensor_poses["P11"])
-    d3 = calculate_distance(sensor_poses["P1"], sensor_poses["P11"])
-
-    # Print results
     method_label_2="Method 2 (calib_link3+last3_kinematics)"
     method_label_3="Method 3 (aubo_kinematics)"
     method_label_4="Method 4 (handeye)"
-    
-    print(f"Ground Truth (Method 1): a1={a1}, a2={a2}, a3={a3}")
-    print(method_label_2 + f": b1={b1}, b2={b2}, b3={b3}")
-    print(method_label_3 + f": c1={c1}, c2={c2}, c3={c3}")
-    print(method_label_4 + f": d1={d1}, d2={d2}, d3={d3}")
 
-    # Error Calculations
-    errors_method2 = [abs(a1 - b1), abs(a2 - b2), abs(a3 - b3)]
-    errors_method3 = [abs(a1 - c1), abs(a2 - c2), abs(a3 - c3)]
-    errors_method4 = [abs(a1 - d1), abs(a2 - d2), abs(a3 - d3)]
+    recorded = (tracker_points, link_transforms, wrist3_Link_poses, sensor_poses)
+    members = [(name, g) for g, group in enumerate(groups) for name in group
+               if all(name in poses for poses in recorded)]
+    names = [name for name, _ in members]
+    point_group = np.array([g for _, g in members], dtype=np.intp)
+    with instrumentation.stage("aT6_composition"):
+        aT6_poses = compose(np.asarray(aT3_results)[point_group], link_transforms.matrices(names))
+
+    reference = tracker_points.positions(names)
+    methods = {
+        method_label_2: positions(aT6_poses),
+        method_label_3: wrist3_Link_poses.positions(names),
+        method_label_4: sensor_poses.positions(names),
+    }
+    return names, reference, methods
+
+
+def main(data_file, aT3_json_file=None, plot=True, report_prefix=None, out_dir=None):
+    # Load data
+    data = load_data(data_file)
+
+    # Load aT3 results from JSON, or fetch them from the calibration cache
+    if aT3_json_file:
+        aT3_results = load_aT3_results(aT3_json_file)
+    else:
+        aT3_results = np.array([aT3 for aT3, _ in calibrate(data["tracker_points"], data["link_transforms"])])
+
+    # Ground truth (Method 1) against every other method, over all pairs of points
+    names, reference, methods = method_points(data, aT3_results)
+    pair_i, pair_j, errors = pairwise_errors(reference, methods)
+    labels = [f"{names[i]}-{names[j]}" for i, j in zip(pair_i, pair_j)]
+
+    # Ground truth distances (Method 1)
+    ground_truth = np.linalg.norm(reference[pair_i] - reference[pair_j], axis=1)
+    print("Ground Truth (Method 1): " + ", ".join(f"{label}={d}" for label, d in zip(labels, ground_truth)))
+    # Distances of every other method, as the ground truth above
+    for method, points in methods.items():
+        distances = np.linalg.norm(points[pair_i] - points[pair_j], axis=1)
+        print(method + ": " + ", ".join(f"{label}={d}" for label, d in zip(labels, distances)))
 
     # Mean Errors
-    mean_error_method2 = np.mean(errors_method2)
-    mean_error_method3 = np.mean(errors_method3)
-    mean_error_method4 = np.mean(errors_method4)
+    results = evaluate_all_pairs(names, reference, methods)
 
     # Print Mean Errors
     print("\nMean Errors:")
-    print(method_label_2 + f": {mean_error_method2}")
-    print(method_label_3 + f": {mean_error_method3}")
-    print(method_label_4 + f": {mean_error_method4}")
+    for method, result in results.items():
+        print(method + f": {result['mean']}")
 
     # Create Table of Mean Errors
-    methods = [method_label_2, method_label_3, method_label_4]
-    mean_errors = [mean_error_method2, mean_error_method3, mean_error_method4]
-
     print("\nSummary Table:")
     print(f"{'Method':<25} {'Mean Error':<10}")
-    for method, mean_error in zip(methods, mean_errors):
-        print(f"{method:<25} {mean_error:<10.5f}")
-
-    # Plot Errors
-    labels = ['d1', 'd2', 'd3']
-    x = np.arange(len(labels))
-    width = 0.25
-
-    fig, ax = plt.subplots()
-    ax.bar(x - width, errors_method2, width, label=method_label_2)
-    ax.bar(x, errors_method3, width, label=method_label_3)
-    ax.bar(x + width, errors_method4, width, label=method_label_4)
+    for method, result in results.items():
+        print(f"{method:<25} {result['mean']:<10.5f}")
 
-    # Add labels, title, legend
-    ax.set_xlabel("Distances")
-    ax.set_ylabel("Error")
-    ax.set_title("Comparison of Errors Across Methods")
-    ax.set_xticks(x)
-    ax.set_xticklabels(labels)
-    ax.legend()
+    # Report files (PNG/SVG/HTML) on a headless backend instead of a blocking window
+    if not plot:
+        return
+    from report import render_report, summarize
 
-    # Show plot
-    plt.tight_layout()
-    plt.show()
+    name = os.path.splitext(os.path.basename(data_file.rstrip(os.sep)))[0] + "_report"
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    prefix = report_prefix or os.path.join(out_dir or os.path.dirname(data_file.rstrip(os.sep)), name)
+    paths = render_report(summarize(errors, labels), prefix, "Comparison of Errors Across Methods")
+    print("\nReport: " + ", ".join(paths))
 
 
 if __name__ == '__main__':
     # Example usage:
-    # Pass the `aT3_results.json` file and the main data file.
-    main("data.json", "aT3_results.json")
\ No newline at end of file
+    # python evaluate_precision_by_distance.py [data.json] [aT3_results.json] [--out-dir reports]
+    # Without an aT3 file the calibration comes from the cache (solved on first use).
+    # Reports go next to the data file unless --out-dir is given.
+    args = sys.argv[1:]
+    out_dir = None
+    if "--out-dir" in args:
+        idx = args.index("--out-dir")
+        out_dir = args[idx + 1]
+        del args[idx:idx + 2]
+    main(*(args[:2] or ["data.json"]), out_dir=out_dir)
\ No newline at end of file
@@ -1,69 +1,92 @@
 import numpy as np
-from scipy.spatial.transform import Rotation as R
-import json
-import matplotlib.pyplot as plt
-
-
-def calculate_distance(pose1, pose2):
-    """Calculate Euclidean distance between two poses."""
-    return np.linalg.norm(np.array(pose1) - np.array(pose2))
-
-
-def main(data_file):
-    # Load data
-    with open(data_file, 'r') as file:
-        data = json.load(file)
-
-    tracker_points = {p["name"]: p["pose"][:3] for p in data["tracker_points"]}
-    # ee_poses = {p["name"]: p["pose"][:3] for p in data["ee_poses"]}
-    # sensor_poses = {p["name"]: p["pose"][:3] for p in data["sensor_poses"]}
-
-    # The distance of 2 nearby points in the robot task plan is 500mm
-    # Evaluate precision by comparison robot planned distance and Euclidean distance of 2 nearby points
-    p1 = calculate_distance(tracker_points["P1"], tracker_points["P2"])
-    p2 = calculate_distance(tracker_points["P2"], tracker_points["P3"])
-    p3 = calculate_distance(tracker_points["P3"], tracker_points["P4"])
-    p4 = calculate_distance(tracker_points["P4"], tracker_points["P5"])
-    p5 = calculate_distance(tracker_points["P5"], tracker_points["P6"])
-    p6 = calculate_distance(tracker_points["P6"], tracker_points["P7"])
-    p7 = calculate_distance(tracker_points["P7"], tracker_points["P8"])
-    p8 = calculate_distance(tracker_points["P8"], tracker_points["P9"])
-    p9 = calculate_distance(tracker_points["P9"], tracker_points["P10"])
-    p10 = calculate_distance(tracker_points["P10"], tracker_points["P11"])
-
-    # Evaluate repeatability by comparison 2 odd & even points position differences
-    o1 = calculate_distance(tracker_points["P1"], tracker_points["P3"])
-    o2 = calculate_distance(tracker_points["P3"], tracker_points["P5"])
-    o3 = calculate_distance(tracker_points["P5"], tracker_points["P7"])
-    o4 = calculate_distance(tracker_points["P7"], tracker_points["P9"])
-    o5 = calculate_distance(tracker_points["P9"], tracker_points["P11"])
-    e1 = calculate_distance(tracker_points["P2"], tracker_points["P4"])
-    e2 = calculate_distance(tracker_points["P4"], tracker_points["P6"])
-    e3 = calculate_distance(tracker_points["P6"], tracker_points["P8"])
-    e4 = calculate_distance(tracker_points["P8"], tracker_points["P10"])
-    e5 = calculate_distance(tracker_points["P10"], tracker_points["P12"])
+import sys
+from orientation_errors import orientation_repeatability
+from repeatability import DEFAULT_PLAN, evaluate_stream, iter_session_chunks, load_plan, planned_distance, print_results
+
+
+def evaluate(targets, position, quaternion=None, plan=None):
+    """
+    Precision and repeatability of a repeatability run, reading by reading.
+
+    targets: (n,) commanded target of each reading, position: (n, 3),
+    quaternion: optional (n, 4). Returns
+      "precision":   distance between consecutive readings at different targets
+                     minus the planned distance of that leg, with "legs" (a, b)
+      "revisits":    (m, 2) reading pairs of consecutive visits to the same target,
+                     grouped by target, with their "repeatability" distances and,
+                     where every reading has a quaternion, "orientation" angles (deg)
+    """
+    plan = plan or DEFAULT_PLAN
+    targets = np.asarray(targets, dtype=str)
+    position = np.asarray(position, dtype=float)
+
+    # Evaluate precision by comparison of the planned and the measured distance of each leg
+    moved = np.flatnonzero(targets[1:] != targets[:-1])
+    legs = np.stack((moved, moved + 1), axis=1)
+    planned = {leg: planned_distance(plan, *leg) for leg in set(zip(targets[moved], targets[moved + 1]))}
+    planned = np.array([planned[leg] for leg in zip(targets[moved], targets[moved + 1])], dtype=float)
+    measured = np.linalg.norm(position[legs[:, 1]] - position[legs[:, 0]], axis=1)
+
+    # Evaluate repeatability by the position differences of consecutive visits to a target
+    order = np.argsort(targets, kind='stable')
+    same = targets[order][1:] == targets[order][:-1]
+    revisits = np.stack((order[:-1][same], order[1:][same]), axis=1)
+
+    results = {
+        "legs": legs,
+        "precision": measured - planned,
+        "revisits": revisits,
+        "repeatability": np.linalg.norm(position[revisits[:, 1]] - position[revisits[:, 0]], axis=1),
+    }
+    if quaternion is not None and not np.isnan(quaternion).any():
+        results["orientation"] = orientation_repeatability(quaternion, revisits)
+    return results
+
+
+def main(data_file, plan_file=None):
+    # Planned distances come from the robot task plan
+    plan = load_plan(plan_file) if plan_file else DEFAULT_PLAN
+
+    # Readings labelled by commanded target, as the ISO 9283 engine sees them
+    # Positions in mm, as in data_repeatability_16w.json (and a store ingested from it)
+    chunks = list(iter_session_chunks(data_file, plan))
+    targets, position, quaternion = (np.concatenate(column) for column in zip(*chunks))
+
+    results = evaluate(targets, position, quaternion, plan)
 
     # Print results
     precision_label="Calculate Precision"
     repeatability_label="Compute Repeatability"
-    
-    print(f"Robot Task Planned Distance = 500mm")
-    print(precision_label + f"[Unit/mm]:\n p1={p1-500}\n p2={p2-500}\n p3={p3-500}\n p4={p4-500}\n p5={p5-500}\n p6={p6-500}\n p7={p7-500}\n p8={p8-500}\n p9={p9-500}\n p10={p10-500}")
-    print(repeatability_label + f"[Unit/mm]:\n o1={o1}\n o2={o2}\n o3={o3}\n o4={o4}\n o5={o5}\n e1={e1}\n e2={e2}\n e3={e3}\n e4={e4}\n e5={e5}")
 
-    # Error Calculations& Struct
-    errors_precision = [abs(p1 - 500), abs(p2 - 500), abs(p3 - 500), abs(p4 - 500), abs(p5 - 500), abs(p6 - 500), abs(p7 - 500), abs(p8 - 500), abs(p9 - 500), abs(p10 - 500)]
-    errors_repeatability = [abs(o1), abs(o2), abs(o3), abs(o4), abs(o5), abs(e1), abs(e2), abs(e3), abs(e4), abs(e5)]
+    legs = sorted(set(zip(targets[results["legs"][:, 0]], targets[results["legs"][:, 1]])))
+    print("Robot Task Planned Distance: " + ", ".join(f"{a}-{b}={planned_distance(plan, a, b):g}mm" for a, b in legs))
+    print(precision_label + "[Unit/mm]:\n" + "\n".join(f" p{k + 1}={p}" for k, p in enumerate(results["precision"])))
+
+    # Readings of each revisit are labelled by target and visit, e.g. A1 = 1st to 2nd visit of A
+    revisited = targets[results["revisits"][:, 0]]
+    visit = np.arange(len(revisited)) - np.searchsorted(revisited, revisited)
+    labels = [f"{target}{k + 1}" for target, k in zip(revisited, visit)]
+    print(repeatability_label + "[Unit/mm]:\n" + "\n".join(f" {label}={r}" for label, r in zip(labels, results["repeatability"])))
 
     # Mean Errors
-    mean_error_precision = np.mean(errors_precision)
-    mean_error_repeatability = np.mean(errors_repeatability)
+    mean_error_precision = np.mean(np.abs(results["precision"]))
+    mean_error_repeatability = np.mean(results["repeatability"])
 
     # Print Mean Errors
     print("\nMean Errors:")
     print(precision_label + f": {mean_error_precision} mm")
     print(repeatability_label + f": {mean_error_repeatability} mm")
 
+    # Orientation repeatability of the same revisits, where the tracker recorded it
+    if "orientation" in results:
+        print(repeatability_label + "[Unit/deg]:\n" + "\n".join(f" {label}={a}" for label, a in zip(labels, results["orientation"])))
+        print(repeatability_label + f" (orientation): {np.mean(results['orientation'])} deg")
+
+    # ISO 9283 pose repeatability per target and distance accuracy per leg
+    print("\nISO 9283:")
+    print_results(evaluate_stream(chunks, plan))
+
 
-if __name__ == '__main__':        
-    main("data_repeatability_16w.json")
\ No newline at end of file
+if __name__ == '__main__':
+    # python evaluate_precision_by_distance_and_repeatability.py [data_file] [plan.json]
+    main(*(sys.argv[1:3] or ["data_repeatability_16w.json"]))
\ No newline at end of file
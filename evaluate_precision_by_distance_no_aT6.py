@@ -1,104 +1,74 @@
 import numpy as np
-from scipy.spatial.transform import Rotation as R
-import json
-import matplotlib.pyplot as plt
+import os
+import sys
+from distance_errors import evaluate_all_pairs, pairwise_errors
+from pose_store import load_data
+from pose_set import PoseSet
 
 
-def quaternion_to_rotation_matrix(q):
-    """Convert quaternion to rotation matrix."""
-    r = R.from_quat([q[0], q[1], q[2], q[3]])  # Scalar-last order
-    return r.as_matrix()
-
-
-def calculate_distance(pose1, pose2):
-    """Calculate Euclidean distance between two poses."""
-    return np.linalg.norm(np.array(pose1) - np.array(pose2))
-
-
-def main(data_file):
+def main(data_file, plot=True, report_prefix=None, out_dir=None):
     # Load data
-    with open(data_file, 'r') as file:
-        data = json.load(file)
+    data = load_data(data_file)
 
-    tracker_points = {p["name"]: p["pose"][:3] for p in data["tracker_points"]}
-    ee_poses = {p["name"]: p["pose"][:3] for p in data["ee_poses"]}
-    sensor_poses = {p["name"]: p["pose"][:3] for p in data["sensor_poses"]}
-
-    # Ground truth distances (Method 1)
-    a1 = calculate_distance(tracker_points["P1"], tracker_points["P2"])
-    a2 = calculate_distance(tracker_points["P2"], tracker_points["P3"])
-    a3 = calculate_distance(tracker_points["P3"], tracker_points["P4"])
-    a4 = calculate_distance(tracker_points["P1"], tracker_points["P3"])
-    a5 = calculate_distance(tracker_points["P2"], tracker_points["P4"])
-    a6 = calculate_distance(tracker_points["P1"], tracker_points["P4"])
-
-    # Method 3: Distances from wrist3_Link poses
-    c1 = calculate_distance(ee_poses["P1"], ee_poses["P2"])
-    c2 = calculate_distance(ee_poses["P2"], ee_poses["P3"])
-    c3 = calculate_distance(ee_poses["P3"], ee_poses["P4"])
-    c4 = calculate_distance(ee_poses["P1"], ee_poses["P3"])
-    c5 = calculate_distance(ee_poses["P2"], ee_poses["P4"])
-    c6 = calculate_distance(ee_poses["P1"], ee_poses["P4"])
-
-    # Method 4: Distances from sensor poses
-    d1 = calculate_distance(sensor_poses["P1"], sensor_poses["P2"])
-    d2 = calculate_distance(sensor_poses["P2"], sensor_poses["P3"])
-    d3 = calculate_distance(sensor_poses["P3"], sensor_poses["P4"])
-    d4 = calculate_distance(sensor_poses["P1"], sensor_poses["P3"])
-    d5 = calculate_distance(sensor_poses["P2"], sensor_poses["P4"])
-    d6 = calculate_distance(sensor_poses["P1"], sensor_poses["P4"])
+    tracker_points = PoseSet.from_entries(data["tracker_points"])
+    ee_poses = PoseSet.from_entries(data["ee_poses"])
+    sensor_poses = PoseSet.from_entries(data["sensor_poses"])
 
     # Print results
     method_label_3="Method 3 (nachi_kinematics)"
     method_label_4="Method 4 (handeye)"
-    
-    print(f"Ground Truth (Method 1): a1={a1}, a2={a2}, a3={a3}, a4={a4}, a5={a5}, a6={a6}")
-    print(method_label_3 + f": c1={c1}, c2={c2}, c3={c3}, c4={c4}, c5={c5}, c6={c6}")
-    print(method_label_4 + f": d1={d1}, d2={d2}, d3={d3}, d4={d4}, d5={d5}, d6={d6}")
 
-    # Error Calculations
-    errors_method3 = [abs(a1 - c1), abs(a2 - c2), abs(a3 - c3), abs(a4 - c4), abs(a5 - c5), abs(a6 - c6)]
-    errors_method4 = [abs(a1 - d1), abs(a2 - d2), abs(a3 - d3), abs(a4 - d4), abs(a5 - d5), abs(a6 - d6)]
+    # Ground truth (Method 1) against every other method, over all pairs of points
+    names = tracker_points.common_names(ee_poses, sensor_poses)
+    reference = tracker_points.positions(names)
+    methods = {
+        method_label_3: ee_poses.positions(names),
+        method_label_4: sensor_poses.positions(names),
+    }
+    pair_i, pair_j, errors = pairwise_errors(reference, methods)
+    labels = [f"{names[i]}-{names[j]}" for i, j in zip(pair_i, pair_j)]
+
+    # Ground truth distances (Method 1)
+    ground_truth = np.linalg.norm(reference[pair_i] - reference[pair_j], axis=1)
+    print("Ground Truth (Method 1): " + ", ".join(f"{label}={d}" for label, d in zip(labels, ground_truth)))
+    # Distances of every other method, as the ground truth above
+    for method, points in methods.items():
+        distances = np.linalg.norm(points[pair_i] - points[pair_j], axis=1)
+        print(method + ": " + ", ".join(f"{label}={d}" for label, d in zip(labels, distances)))
 
     # Mean Errors
-    mean_error_method3 = np.mean(errors_method3)
-    mean_error_method4 = np.mean(errors_method4)
+    results = evaluate_all_pairs(names, reference, methods)
 
     # Print Mean Errors
     print("\nMean Errors:")
-    print(method_label_3 + f": {mean_error_method3}")
-    print(method_label_4 + f": {mean_error_method4}")
+    for method, result in results.items():
+        print(method + f": {result['mean']}")
 
     # Create Table of Mean Errors
-    methods = [method_label_3, method_label_4]
-    mean_errors = [mean_error_method3, mean_error_method4]
-
     print("\nSummary Table:")
     print(f"{'Method':<25} {'Mean Error':<10}")
-    for method, mean_error in zip(methods, mean_errors):
-        print(f"{method:<25} {mean_error:<10.5f}")
-
-    # Plot Errors
-    labels = ['d1', 'd2', 'd3', 'd4', 'd5', 'd6']
-    x = np.arange(len(labels))
-    width = 0.25
-
-    fig, ax = plt.subplots()
-    ax.bar(x, errors_method3, width, label=method_label_3)
-    ax.bar(x + width, errors_method4, width, label=method_label_4)
-
-    # Add labels, title, legend
-    ax.set_xlabel("Distances")
-    ax.set_ylabel("Error")
-    ax.set_title("Comparison of Errors Across Methods")
-    ax.set_xticks(x)
-    ax.set_xticklabels(labels)
-    ax.legend()
-
-    # Show plot
-    plt.tight_layout()
-    plt.show()
-
-
-if __name__ == '__main__':        
-    main("data_dist_16w.json")
\ No newline at end of file
+    for method, result in results.items():
+        print(f"{method:<25} {result['mean']:<10.5f}")
+
+    # Report files (PNG/SVG/HTML) on a headless backend instead of a blocking window
+    if not plot:
+        return
+    from report import render_report, summarize
+
+    name = os.path.splitext(os.path.basename(data_file.rstrip(os.sep)))[0] + "_report"
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    prefix = report_prefix or os.path.join(out_dir or os.path.dirname(data_file.rstrip(os.sep)), name)
+    paths = render_report(summarize(errors, labels), prefix, "Comparison of Errors Across Methods")
+    print("\nReport: " + ", ".join(paths))
+
+
+if __name__ == '__main__':
+    # python evaluate_precision_by_distance_no_aT6.py [data_dist_16w.json] [--out-dir reports]
+    args = sys.argv[1:]
+    out_dir = None
+    if "--out-dir" in args:
+        idx = args.index("--out-dir")
+        out_dir = args[idx + 1]
+        del args[idx:idx + 2]
+    main(*(args[:1] or ["data_dist_16w.json"]), out_dir=out_dir)
\ No newline at end of file
@@ -0,0 +1,218 @@
+import json
+import sys
+import numpy as np
+from pose_store import load_data
+from pose_set import PoseSet
+from transforms import (compose, make_transforms, quaternion_block_products, quaternion_conjugate,
+                        quaternion_left_maps, quaternion_multiply, quaternion_to_rotation_matrix, quaternion_to_rotvec,
+                        rotation_matrix_to_quaternion)
+
+
+def _procrustes(H):
+    """Rotation R maximizing trace(R H), i.e. the least-squares fit alpha ~ R beta for H = sum beta alpha^T."""
+    U, _, Vt = np.linalg.svd(H)
+    D = np.diag([1.0, 1.0, np.sign(np.linalg.det(Vt.T @ U.T))])
+    return Vt.T @ D @ U.T
+
+
+def iter_motion_pairs(robot, sensor, chunk_size=1 << 18):
+    """
+    Yield the relative motions of every pose pair i < j, one block of rows at a time.
+
+    robot, sensor: PoseSets of the same poses (base -> flange, reference -> sensor).
+    Yields (RA (m, 3, 3), alpha (m, 3), tA (m, 3), beta (m, 3), tB (m, 3)) for
+    A = T_i^-1 T_j and B = S_i^-1 S_j; alpha and beta are the rotation vectors.
+    """
+    q_robot = robot.quaternion / np.linalg.norm(robot.quaternion, axis=1, keepdims=True)
+    q_sensor = sensor.quaternion / np.linalg.norm(sensor.quaternion, axis=1, keepdims=True)
+    # conj(q_i) q_j and R_i^T (t_j - t_i) are bilinear in the per-pose arrays,
+    # so a block of pairs is a few dense matrix products on per-pose maps
+    maps = {"A": (quaternion_left_maps(q_robot), q_robot), "B": (quaternion_left_maps(q_sensor), q_sensor)}
+    frames = {}
+    for key, poses, q in (("A", robot, q_robot), ("B", sensor, q_sensor)):
+        R_t = quaternion_to_rotation_matrix(q).swapaxes(1, 2)
+        frames[key] = (R_t, (R_t @ poses.position[..., None])[..., 0], poses.position)
+    n = len(robot)
+
+    i0 = 0
+    while i0 < n - 1:
+        rows = max(1, min(n - 1 - i0, chunk_size // (n - i0)))
+        i1 = i0 + rows
+        upper = np.arange(i0, n)[None, :] > np.arange(i0, i1)[:, None]
+        motion = {}
+        for key in ("A", "B"):
+            left, q = maps[key]
+            R_t, origin, position = frames[key]
+            t = (R_t[i0:i1].reshape(-1, 3) @ position[i0:].T).reshape(rows, 3, -1) - origin[i0:i1, :, None]
+            motion[key] = (quaternion_block_products(left, i0, i1, q)[upper], t.swapaxes(1, 2)[upper])
+        (qA, tA), (qB, tB) = motion["A"], motion["B"]
+        yield quaternion_to_rotation_matrix(qA), quaternion_to_rotvec(qA), tA, quaternion_to_rotvec(qB), tB
+        i0 = i1
+
+
+def solve_ax_xb(robot, sensor, chunk_size=1 << 18):
+    """
+    Closed-form hand-eye X (4, 4), flange -> sensor, from A X = X B over all pose pairs.
+
+    Rotation (Park and Martin): alpha = R_X beta for every pair, solved as the
+    orthogonal Procrustes problem of M = sum beta alpha^T, which equals
+    (M^T M)^-1/2 M^T when M has full rank.
+    Translation: (R_A - I) t_X = R_X t_B - t_A in least squares.
+
+    Both need only 3 x 3 (x 3) sums, so the pairs are streamed block by block
+    and the normal equations accumulated in one pass: the translation's right
+    hand side is kept as a tensor K that R_X contracts once it is known.
+    Returns (X, diagnostics).
+    """
+    M = np.zeros((3, 3))
+    C = np.zeros((3, 3))
+    e = np.zeros(3)
+    K = np.zeros((3, 3, 3))
+    pairs = 0
+    for RA, alpha, tA, beta, tB in iter_motion_pairs(robot, sensor, chunk_size):
+        D = RA - np.eye(3)
+        M += beta.T @ alpha
+        for a in range(3):
+            # Row a of every R_A - I: its outer products, one matrix product each
+            C += D[:, a].T @ D[:, a]
+            e += D[:, a].T @ tA[:, a]
+            K[:, a] += D[:, a].T @ tB
+        pairs += len(alpha)
+
+    R_X = _procrustes(M)
+    t_X, _, rank, _ = np.linalg.lstsq(C, np.einsum('cab,ab->c', K, R_X) - e, rcond=None)
+    X = np.eye(4)
+    X[:3, :3], X[:3, 3] = R_X, t_X
+    return X, {
+        "pairs": pairs,
+        # A second singular value near 0: rotation axes all parallel, R_X not observable
+        "rotation_singular_values": np.linalg.svd(M, compute_uv=False),
+        "translation_rank": int(rank),
+    }
+
+
+def solve_y(robot, sensor, X):
+    """Y (4, 4), reference -> base, with S_i = Y T_i X, as the least-squares average over the poses."""
+    TX = compose(robot.matrix, X)
+    R_Y = _procrustes(np.einsum('nab,ncb->ac', TX[:, :3, :3], sensor.matrix[:, :3, :3]))
+    Y = np.eye(4)
+    Y[:3, :3] = R_Y
+    Y[:3, 3] = np.mean(sensor.position - TX[:, :3, 3] @ R_Y.T, axis=0)
+    return Y
+
+
+def pose_residuals(robot, sensor, X, Y):
+    """Per-pose rotation (degrees) and translation errors of S_i against Y T_i X."""
+    predicted = compose(compose(Y, robot.matrix), X)
+    dR = np.swapaxes(predicted[:, :3, :3], 1, 2) @ sensor.matrix[:, :3, :3]
+    angle = np.degrees(np.arccos(np.clip((np.trace(dR, axis1=1, axis2=2) - 1) / 2, -1, 1)))
+    return angle, np.linalg.norm(predicted[:, :3, 3] - sensor.position, axis=1)
+
+
+def _from_params(params):
+    """12 parameters (rotation vector, translation of X, then of Y) -> X, Y."""
+    transforms = []
+    for p in params.reshape(2, 6):
+        angle = np.linalg.norm(p[:3])
+        axis = p[:3] / angle if angle > 0 else np.zeros(3)
+        q = np.append(axis * np.sin(angle / 2), np.cos(angle / 2))
+        transforms.append(make_transforms(p[3:], q))
+    return transforms
+
+
+def refine(robot, sensor, X, Y, rotation_weight=1.0):
+    """
+    Joint least-squares refinement of X and Y on S_i = Y T_i X over all poses.
+
+    The residuals of all poses are one stacked array: per pose the rotation
+    vector of (Y T_i X)^-1 S_i, scaled by rotation_weight (length per radian),
+    and the position difference. Returns refined (X, Y).
+    """
+    from scipy.optimize import least_squares
+
+    q_sensor = sensor.quaternion / np.linalg.norm(sensor.quaternion, axis=1, keepdims=True)
+
+    def residuals(params):
+        X_, Y_ = _from_params(params)
+        predicted = compose(compose(Y_, robot.matrix), X_)
+        q_predicted = rotation_matrix_to_quaternion(predicted[:, :3, :3])
+        rotation = quaternion_to_rotvec(quaternion_multiply(quaternion_conjugate(q_predicted), q_sensor))
+        return np.concatenate(((rotation * rotation_weight).ravel(), (predicted[:, :3, 3] - sensor.position).ravel()))
+
+    def params(T):
+        rotvec = quaternion_to_rotvec(rotation_matrix_to_quaternion(T[:3, :3]))
+        return np.concatenate((rotvec, T[:3, 3]))
+
+    result = least_squares(residuals, np.concatenate((params(X), params(Y))), method='lm')
+    return tuple(_from_params(result.x))
+
+
+def calibrate_handeye(robot, sensor, refine_solution=False, chunk_size=1 << 18):
+    """
+    Hand-eye X and robot-world Y for sensor poses S_i = Y T_i X.
+
+    X comes from A X = X B over all pose pairs, Y then from the poses; with
+    refine_solution both are refined jointly. Returns (X, Y, diagnostics).
+    """
+    names = robot.common_names(sensor)
+    robot, sensor = robot.select(names), sensor.select(names)
+    X, diagnostics = solve_ax_xb(robot, sensor, chunk_size)
+    Y = solve_y(robot, sensor, X)
+    if refine_solution:
+        X, Y = refine(robot, sensor, X, Y)
+    angle, distance = pose_residuals(robot, sensor, X, Y)
+    diagnostics.update(poses=len(names), rotation_residual_deg=angle, translation_residual=distance)
+    return X, Y, diagnostics
+
+
+def sensor_poses(robot, X):
+    """Sensor poses T_i X in the robot base frame, as {"name", "pose"} entries (Method 4 input)."""
+    T = compose(robot.matrix, X)
+    q = rotation_matrix_to_quaternion(T[:, :3, :3])
+    return [{"name": name, "pose": np.concatenate((t, qi)).tolist()}
+            for name, t, qi in zip(robot.names.tolist(), T[:, :3, 3], q)]
+
+
+def main(data_file, robot_key="wrist3_Link_poses", sensor_key="sensor_poses", refine_solution=False, out_file=None):
+    data = load_data(data_file)
+    robot = PoseSet.from_entries(data[robot_key])
+    sensor = PoseSet.from_entries(data[sensor_key])
+    if np.isnan(robot.quaternion).any() or np.isnan(sensor.quaternion).any():
+        print(f"{robot_key} and {sensor_key} both need orientations")
+        sys.exit(1)
+
+    X, Y, diagnostics = calibrate_handeye(robot, sensor, refine_solution)
+    angle, distance = diagnostics["rotation_residual_deg"], diagnostics["translation_residual"]
+    np.set_printoptions(precision=6, suppress=True)
+    print(f"{diagnostics['poses']} poses, {diagnostics['pairs']} motion pairs, rotation singular values "
+          f"{diagnostics['rotation_singular_values']}, translation rank {diagnostics['translation_rank']}")
+    print(f"X ({robot_key} -> {sensor_key}):\n{X}")
+    print(f"Y ({sensor_key} reference -> base):\n{Y}")
+    print(f"Residuals: rotation mean={angle.mean():.5f} max={angle.max():.5f} deg, "
+          f"translation mean={distance.mean():.6f} max={distance.max():.6f}")
+
+    if out_file:
+        # The session with recomputed "Method 4" sensor poses, ready for the distance evaluators
+        out = {key: value for key, value in data.items() if key != "sensor_poses"}
+        out = json.loads(json.dumps(out, default=lambda value: np.asarray(value).tolist()))
+        out["sensor_poses"] = sensor_poses(robot, X)
+        out["handeye"] = {"X": X.tolist(), "Y": Y.tolist(), "robot_key": robot_key, "sensor_key": sensor_key}
+        with open(out_file, 'w') as file:
+            json.dump(out, file, indent=1)
+        print(f"Sensor poses written to {out_file}")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    refine_solution = "--refine" in args
+    args = [arg for arg in args if arg != "--refine"]
+    out_file = None
+    if "--out" in args:
+        idx = args.index("--out")
+        out_file = args[idx + 1]
+        del args[idx:idx + 2]
+    if len(args) not in (1, 2, 3):
+        print("Usage: python handeye.py <data_file|store_dir> [robot_key] [sensor_key] [--refine] [--out session.json]")
+        sys.exit(1)
+
+    main(*args, refine_solution=refine_solution, out_file=out_file)
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
+import sys
 import rclpy
 from rclpy.node import Node
 from tf2_ros import TransformListener, Buffer
 from geometry_msgs.msg import TransformStamped
+from tf_recorder import TfRecorder
 
 class HighPrecisionTfEcho(Node):
 
@@ -48,6 +50,33 @@ class HighPrecisionTfEcho(Node):
             self.get_logger().warn(f"Could not get transform: {str(e)}")
 
 
+class HighPrecisionTfRecorder(Node):
+    """Recorder mode: binary capture of many frame pairs at a high polling rate."""
+
+    def __init__(self, frame_pairs, path, rate=1000.0):
+        super().__init__('high_precision_tf_recorder')
+
+        # Create a TF2 buffer and listener
+        self.tf_buffer = Buffer()
+        self.tf_listener = TransformListener(self.tf_buffer, self)
+
+        # Lookups go to a ring buffer, a background thread writes it to path
+        self.recorder = TfRecorder(self.tf_buffer, frame_pairs, path, latest=rclpy.time.Time())
+        self.timer = self.create_timer(1.0 / rate, self.recorder.poll)
+        self.stats_timer = self.create_timer(5.0, self.report_stats)
+
+    def report_stats(self):
+        stats = self.recorder.stats()
+        self.get_logger().info(
+            f"recorded={stats['recorded']} written={stats['written']} dropped={stats['dropped']} "
+            f"(failed={stats['failed']}, overruns={stats['overruns']}) "
+            f"latency mean={stats['latency_mean']*1e6:.1f}us max={stats['latency_max']*1e6:.1f}us")
+
+    def destroy_node(self):
+        self.recorder.close()
+        super().destroy_node()
+
+
 def main(args=None):
     rclpy.init(args=args)
 
@@ -55,8 +84,14 @@ def main(args=None):
     source_frame = 'source_frame_name'
     target_frame = 'target_frame_name'
 
-    # Create and spin the node
-    node = HighPrecisionTfEcho(source_frame, target_frame)
+    # Create and spin the node; "--record <file> [rate_hz]" switches to recorder mode
+    argv = rclpy.utilities.remove_ros_args(sys.argv if args is None else args)
+    if "--record" in argv:
+        idx = argv.index("--record")
+        rate = float(argv[idx + 2]) if len(argv) > idx + 2 else 1000.0
+        node = HighPrecisionTfRecorder([(target_frame, source_frame)], argv[idx + 1], rate)
+    else:
+        node = HighPrecisionTfEcho(source_frame, target_frame)
     try:
         rclpy.spin(node)
     except KeyboardInterrupt:
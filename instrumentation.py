@@ -0,0 +1,202 @@
+import contextlib
+import json
+import os
+import runpy
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+# Off by default: stage() then hands out one shared no-op context and
+# callers skip diagnostics behind enabled(), so the hooks cost a function call
+_enabled = False
+_NULL = contextlib.nullcontext()
+
+_stages = {}
+_counters = {}
+_records = {}
+_peaks = []
+
+
+def enable(trace_memory=False):
+    """Start collecting; trace_memory adds tracemalloc peaks per stage (slow)."""
+    global _enabled
+    _enabled = True
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    _stages.clear()
+    _counters.clear()
+    _records.clear()
+
+
+def _rss_peak_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            if _peaks:
+                # Bank the enclosing stage's peak so far before resetting the tracer's
+                _peaks[-1] = max(_peaks[-1], tracemalloc.get_traced_memory()[1])
+            _peaks.append(0)
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stats = _stages.get(self.name)
+        if stats is None:
+            stats = _stages[self.name] = {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+        stats["calls"] += 1
+        stats["seconds"] += elapsed
+        stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+        stats["rss_peak_mb"] = _rss_peak_mb()
+
+        if tracemalloc.is_tracing() and _peaks:
+            # A nested stage resets the tracer's peak, so it hands its own peak up
+            peak = max(tracemalloc.get_traced_memory()[1], _peaks.pop())
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], peak)
+            stats["traced_peak_mb"] = max(stats.get("traced_peak_mb", 0.0), peak / 2**20)
+        return False
+
+
+def stage(name):
+    """Context manager timing one stage; a no-op while disabled."""
+    if not _enabled:
+        return _NULL
+    return _Stage(name)
+
+
+def count(name, n=1):
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def record(name, value):
+    """Keep a diagnostic value (scalar or array); every call appends one entry."""
+    if _enabled:
+        _records.setdefault(name, []).append(np.asarray(value))
+
+
+def snapshot():
+    """Everything collected so far as plain JSON-ready data."""
+    return {
+        "stages": {name: dict(stats) for name, stats in _stages.items()},
+        "counters": dict(_counters),
+        "records": {name: [value.tolist() for value in values] for name, values in _records.items()},
+    }
+
+
+def export_json(path):
+    with open(path, 'w') as file:
+        json.dump(snapshot(), file, indent=1)
+
+
+def _metric(name):
+    return "aT3_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_text():
+    """
+    Prometheus text exposition of the stages, counters and records.
+
+    Records of shape (G,) give one sample per group; larger arrays (per-sample
+    residuals, singular values) only give their per-call max and mean.
+    """
+    lines = [
+        "# HELP aT3_stage_seconds_total Wall time spent in each stage.",
+        "# TYPE aT3_stage_seconds_total counter",
+    ]
+    lines += [f'aT3_stage_seconds_total{{stage="{name}"}} {s["seconds"]:.9g}' for name, s in _stages.items()]
+    lines += ["# TYPE aT3_stage_calls_total counter"]
+    lines += [f'aT3_stage_calls_total{{stage="{name}"}} {s["calls"]}' for name, s in _stages.items()]
+    lines += ["# TYPE aT3_stage_max_seconds gauge"]
+    lines += [f'aT3_stage_max_seconds{{stage="{name}"}} {s["max_seconds"]:.9g}' for name, s in _stages.items()]
+    rss = [(name, s["rss_peak_mb"]) for name, s in _stages.items() if s.get("rss_peak_mb") is not None]
+    if rss:
+        lines += ["# TYPE aT3_stage_rss_peak_megabytes gauge"]
+        lines += [f'aT3_stage_rss_peak_megabytes{{stage="{name}"}} {value:.6g}' for name, value in rss]
+    traced = [(name, s["traced_peak_mb"]) for name, s in _stages.items() if "traced_peak_mb" in s]
+    if traced:
+        lines += ["# TYPE aT3_stage_traced_peak_megabytes gauge"]
+        lines += [f'aT3_stage_traced_peak_megabytes{{stage="{name}"}} {value:.6g}' for name, value in traced]
+
+    for name, value in _counters.items():
+        lines += [f"# TYPE {_metric(name)}_total counter", f"{_metric(name)}_total {value}"]
+
+    for name, values in _records.items():
+        metric = _metric(name)
+        lines.append(f"# TYPE {metric} gauge")
+        for call, value in enumerate(values):
+            if value.ndim == 0:
+                lines.append(f'{metric}{{call="{call}"}} {float(value):.9g}')
+            elif value.ndim == 1:
+                lines += [f'{metric}{{call="{call}",group="{g}"}} {float(v):.9g}' for g, v in enumerate(value)]
+            else:
+                flat = value.reshape(len(value), -1)
+                lines += [f'{metric}{{call="{call}",group="{g}",stat="max"}} {v:.9g}' for g, v in enumerate(flat.max(axis=1))]
+                lines += [f'{metric}{{call="{call}",group="{g}",stat="mean"}} {v:.9g}' for g, v in enumerate(flat.mean(axis=1))]
+    return "\n".join(lines) + "\n"
+
+
+def export_prometheus(path):
+    """Write a node_exporter text-file collector file, atomically."""
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as file:
+        file.write(prometheus_text())
+    os.replace(tmp, path)
+
+
+if __name__ == '__main__':
+    # Run any script of the repo with instrumentation on, then export what it recorded
+    args = sys.argv[1:]
+    trace_memory = "--trace-memory" in args
+    args = [arg for arg in args if arg != "--trace-memory"]
+    if len(args) < 2:
+        print("Usage: python instrumentation.py <output_prefix> <script.py> [script args ...] [--trace-memory]\n"
+              "       writes <output_prefix>.json and <output_prefix>.prom")
+        sys.exit(1)
+
+    # The scripts import this file as a module; collect there, not in __main__
+    import instrumentation
+
+    prefix, script = args[0], args[1]
+    instrumentation.enable(trace_memory)
+    sys.argv = [script] + args[2:]
+    try:
+        with instrumentation.stage("total"):
+            runpy.run_path(script, run_name="__main__")
+    finally:
+        instrumentation.export_json(prefix + ".json")
+        instrumentation.export_prometheus(prefix + ".prom")
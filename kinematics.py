@@ -0,0 +1,177 @@
+import json
+import sys
+import numpy as np
+from transforms import compose, positions
+
+
+def _rpy_matrix(rpy):
+    """URDF roll-pitch-yaw (fixed axes x, y, z) -> 3x3 rotation."""
+    r, p, y = rpy
+    cr, sr, cp, sp, cy, sy = np.cos(r), np.sin(r), np.cos(p), np.sin(p), np.cos(y), np.sin(y)
+    return np.array([[cy * cp, cy * sp * sr - sy * cr, cy * sp * cr + sy * sr],
+                     [sy * cp, sy * sp * sr + cy * cr, sy * sp * cr - cy * sr],
+                     [-sp, cp * sr, cp * cr]])
+
+
+class Chain:
+    """
+    Serial chain of revolute joints, evaluated for many configurations at once.
+
+    Joint k maps frame k to frame k + 1. forward(q, start, stop) is the product
+    of joints start .. stop - 1, so forward(q) is base -> flange and
+    forward(q, 3, 6) the link3 -> link6 part the calibration uses.
+
+    convention "dh":   T_k = Rz(theta) Tz(d) Tx(a) Rx(alpha)     (standard)
+               "mdh":  T_k = Rx(alpha) Tx(a) Rz(theta) Tz(d)     (modified, Craig)
+               "urdf": T_k = origin(xyz, rpy) Rot(axis, theta)
+    with theta = q_k + offset_k.
+    """
+
+    def __init__(self, convention, a=None, alpha=None, d=None, offset=None, origins=None, axes=None,
+                 base=None, tool=None):
+        self.convention = convention
+        if convention in ("dh", "mdh"):
+            self.a, self.alpha, self.d = (np.asarray(v, dtype=float) for v in (a, alpha, d))
+            self.dof = len(self.a)
+        elif convention == "urdf":
+            self.origins = np.asarray(origins, dtype=float)
+            self.axes = np.asarray(axes, dtype=float)
+            self.axes = self.axes / np.linalg.norm(self.axes, axis=1, keepdims=True)
+            self.dof = len(self.origins)
+        else:
+            raise ValueError(f"unknown convention {convention}")
+        self.offset = np.zeros(self.dof) if offset is None else np.asarray(offset, dtype=float)
+        self.base = None if base is None else np.asarray(base, dtype=float)
+        self.tool = None if tool is None else np.asarray(tool, dtype=float)
+
+    @classmethod
+    def from_json(cls, path):
+        """
+        {"convention": "dh" | "mdh", "a": [...], "alpha": [...], "d": [...], "offset": [...]}
+        or {"convention": "urdf", "joints": [{"xyz", "rpy", "axis"}, ...]};
+        optional 4x4 "base" and "tool". Lengths in metres, angles in radians.
+        """
+        with open(path, 'r') as file:
+            params = json.load(file)
+        convention = params["convention"]
+        if convention == "urdf":
+            joints = params["joints"]
+            origins = np.zeros((len(joints), 4, 4))
+            for k, joint in enumerate(joints):
+                origins[k, :3, :3] = _rpy_matrix(joint.get("rpy", [0, 0, 0]))
+                origins[k, :3, 3] = joint.get("xyz", [0, 0, 0])
+                origins[k, 3, 3] = 1
+            return cls("urdf", origins=origins, axes=[joint.get("axis", [0, 0, 1]) for joint in joints],
+                       offset=params.get("offset"), base=params.get("base"), tool=params.get("tool"))
+        return cls(convention, params["a"], params["alpha"], params["d"], params.get("offset"),
+                   base=params.get("base"), tool=params.get("tool"))
+
+    def joint_transforms(self, k, theta):
+        """(N,) joint angles of joint k (offset already added) -> (N, 4, 4)."""
+        c, s = np.cos(theta), np.sin(theta)
+        T = np.zeros(theta.shape + (4, 4))
+        T[..., 3, 3] = 1
+        if self.convention == "dh":
+            ca, sa = np.cos(self.alpha[k]), np.sin(self.alpha[k])
+            T[..., 0, 0], T[..., 0, 1], T[..., 0, 2], T[..., 0, 3] = c, -s * ca, s * sa, self.a[k] * c
+            T[..., 1, 0], T[..., 1, 1], T[..., 1, 2], T[..., 1, 3] = s, c * ca, -c * sa, self.a[k] * s
+            T[..., 2, 1], T[..., 2, 2], T[..., 2, 3] = sa, ca, self.d[k]
+        elif self.convention == "mdh":
+            ca, sa = np.cos(self.alpha[k]), np.sin(self.alpha[k])
+            T[..., 0, 0], T[..., 0, 1], T[..., 0, 3] = c, -s, self.a[k]
+            T[..., 1, 0], T[..., 1, 1], T[..., 1, 2], T[..., 1, 3] = s * ca, c * ca, -sa, -sa * self.d[k]
+            T[..., 2, 0], T[..., 2, 1], T[..., 2, 2], T[..., 2, 3] = s * sa, c * sa, ca, ca * self.d[k]
+        else:
+            # Rodrigues rotation about the joint axis, then the fixed origin in front
+            x, y, z = self.axes[k]
+            K = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+            T[..., :3, :3] = np.eye(3) + s[..., None, None] * K + (1 - c)[..., None, None] * (K @ K)
+            T = self.origins[k] @ T
+        return T
+
+    def forward(self, q, start=0, stop=None, with_base=None, with_tool=None, chunk=1 << 16):
+        """
+        (N, dof) joint angles -> (N, 4, 4) transform of joints start .. stop - 1.
+
+        The base transform is applied when the chain starts at joint 0 and the
+        tool when it ends at the last joint, unless with_base / with_tool say
+        otherwise. Configurations are processed chunk at a time to bound the
+        temporaries.
+        """
+        q = np.atleast_2d(np.asarray(q, dtype=float))
+        stop = self.dof if stop is None else stop
+        with_base = (start == 0) if with_base is None else with_base
+        with_tool = (stop == self.dof) if with_tool is None else with_tool
+
+        out = np.empty((len(q), 4, 4))
+        for begin in range(0, len(q), chunk):
+            theta = q[begin:begin + chunk] + self.offset
+            T = np.tile(self.base if with_base and self.base is not None else np.eye(4), (len(theta), 1, 1))
+            for k in range(start, stop):
+                T = T @ self.joint_transforms(k, theta[:, k])
+            if with_tool and self.tool is not None:
+                T = T @ self.tool
+            out[begin:begin + chunk] = T
+        return out
+
+    def frames(self, q):
+        """(N, dof + 1, 4, 4) base-relative transform of every link frame, base first."""
+        q = np.atleast_2d(np.asarray(q, dtype=float))
+        theta = q + self.offset
+        out = np.empty((len(q), self.dof + 1, 4, 4))
+        out[:, 0] = np.eye(4) if self.base is None else self.base
+        for k in range(self.dof):
+            out[:, k + 1] = out[:, k] @ self.joint_transforms(k, theta[:, k])
+        return out
+
+
+def method_poses(chain, q, aT3=None, link=3):
+    """
+    Recomputed method poses from joint angles.
+
+    Method 3 (robot kinematics): the full chain, base -> flange (-> tool).
+    Method 2 (calibrated link3 + last joints): aT3 @ link3 -> link6 (-> tool),
+    when an aT3 (4, 4) or per-configuration (N, 4, 4) is given.
+    """
+    poses = {"method3": chain.forward(q)}
+    if aT3 is not None:
+        poses["method2"] = compose(aT3, chain.forward(q, start=link))
+    return poses
+
+
+def compare(nominal, calibrated, q):
+    """Per-configuration flange position difference (N,) between two parameter sets."""
+    return np.linalg.norm(positions(nominal.forward(q)) - positions(calibrated.forward(q)), axis=1)
+
+
+def load_joints(path, degrees=False):
+    """(N, dof) joint angles from a .npy file or a whitespace/comma separated text file."""
+    if path.endswith(".npy"):
+        q = np.load(path, mmap_mode='r')
+    else:
+        with open(path, 'r') as file:
+            delimiter = "," if "," in file.readline() else None
+            file.seek(0)
+            q = np.loadtxt(file, delimiter=delimiter, ndmin=2)
+    return np.radians(q) if degrees else np.asarray(q, dtype=float)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    degrees = "--degrees" in args
+    args = [arg for arg in args if arg != "--degrees"]
+    if len(args) not in (2, 3):
+        print("Usage: python kinematics.py <params.json> <joints.npy|joints.csv> [calibrated_params.json] [--degrees]")
+        sys.exit(1)
+
+    chain = Chain.from_json(args[0])
+    q = load_joints(args[1], degrees)
+    flange = positions(chain.forward(q))
+    print(f"{len(q)} configurations, flange x/y/z range:")
+    for axis, lo, hi in zip("xyz", flange.min(axis=0), flange.max(axis=0)):
+        print(f"  {axis}: {lo:.6f} .. {hi:.6f}")
+
+    if len(args) == 3:
+        diff = compare(chain, Chain.from_json(args[2]), q)
+        print(f"nominal vs calibrated flange position: mean={diff.mean():.6f} rms={np.sqrt(np.mean(diff**2)):.6f} "
+              f"max={diff.max():.6f}")
@@ -0,0 +1,252 @@
+import sys
+import numpy as np
+import instrumentation
+from distance_errors import _merge_top_k
+from pose_store import StoreTable, load_data
+from pose_set import PoseSet
+from transforms import (quaternion_angle, quaternion_block_products, quaternion_conjugate, quaternion_left_maps,
+                        quaternion_multiply, quaternion_to_rotvec, rotation_matrix_to_quaternion)
+
+# Per-pair orientation errors, all in degrees
+METRICS = ("geodesic", "magnitude", "axis", "x", "y", "z")
+
+
+def _unit(quaternions):
+    q = np.asarray(quaternions, dtype=float).reshape(-1, 4)
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def _error_maps(reference, method):
+    """(N, 4, 4) matrices G with G[j] @ d = conj(q_j) d p_j, for reference q and method p."""
+    inner = quaternion_multiply(quaternion_conjugate(reference)[:, None, :], np.eye(4)[None])
+    return quaternion_multiply(inner, method[:, None, :]).swapaxes(1, 2)
+
+
+def iter_relative_rotations(reference, methods, chunk_size=1 << 18):
+    """
+    Yield the relative rotations of every pair i < j, one block of rows at a time.
+
+    reference: (N, 4) scalar-last ground-truth orientations (e.g. tracker)
+    methods: {label: (N, 4)} orientations of each method, row-aligned with reference
+
+    Yields (i, j, B, {label: (A, E)}) with B = conj(q_i) q_j of the reference,
+    A the same for the method, i.e. the rotation from pose i to pose j in the
+    body frame of pose i, and E = conj(B) A. All three are bilinear in the
+    per-pose quaternions, so each block is a few dense matrix products:
+    E = conj(q_j) D_i p_j with D_i = q_i conj(p_i).
+    """
+    reference = _unit(reference)
+    methods = {label: _unit(q) for label, q in methods.items()}
+    n = len(reference)
+    for q in methods.values():
+        assert q.shape == reference.shape
+
+    reference_maps = quaternion_left_maps(reference)
+    method_maps = {label: quaternion_left_maps(q) for label, q in methods.items()}
+    error_maps = {label: _error_maps(reference, q) for label, q in methods.items()}
+    discrepancy = {label: quaternion_multiply(reference, quaternion_conjugate(q)) for label, q in methods.items()}
+
+    i0 = 0
+    while i0 < n - 1:
+        rows = max(1, min(n - 1 - i0, chunk_size // (n - i0)))
+        i1 = i0 + rows
+        upper = np.arange(i0, n)[None, :] > np.arange(i0, i1)[:, None]
+        ii, jj = np.nonzero(upper)
+        B = quaternion_block_products(reference_maps, i0, i1, reference)[upper]
+        pairs = {}
+        for label, q in methods.items():
+            A = quaternion_block_products(method_maps[label], i0, i1, q)[upper]
+            # E[i, j] = G_j D_i: the maps belong to the columns here
+            E = (error_maps[label][i0:].reshape(-1, 4) @ discrepancy[label][i0:i1].T).reshape(n - i0, 4, rows)
+            pairs[label] = (A, E.transpose(2, 0, 1)[upper])
+        yield ii + i0, jj + i0, B, pairs
+        i0 = i1
+
+
+def fit_body_offsets(reference, methods, max_pairs=1 << 20, seed=0):
+    """
+    Constant body-frame rotation X (3, 3) per method with B ~ X^T A X.
+
+    Tracker marker and robot flange frames differ by a fixed rotation, which
+    conjugates every relative rotation; the rotation vectors then satisfy
+    rotvec(B) = X^T rotvec(A), so X follows from a Kabsch fit over the pairs.
+    Beyond max_pairs pairs a fixed random sample of them is used, as three
+    unknowns need nowhere near N^2 / 2 equations. Returns {label: X}.
+    """
+    reference = _unit(reference)
+    n = len(reference)
+    if n * (n - 1) // 2 <= max_pairs:
+        i, j = np.triu_indices(n, 1)
+    else:
+        rng = np.random.default_rng(seed)
+        i, j = rng.integers(0, n, size=(2, max_pairs))
+
+    beta = quaternion_to_rotvec(quaternion_multiply(quaternion_conjugate(reference[i]), reference[j]))
+    offsets = {}
+    for label, q in methods.items():
+        q = _unit(q)
+        alpha = quaternion_to_rotvec(quaternion_multiply(quaternion_conjugate(q[i]), q[j]))
+        U, _, Vt = np.linalg.svd(alpha.T @ beta)
+        D = np.diag([1.0, 1.0, np.sign(np.linalg.det(Vt.T @ U.T))])
+        # Kabsch gives R with beta ~ R alpha, i.e. R = X^T
+        offsets[label] = (Vt.T @ D @ U.T).T
+    return offsets
+
+
+def _angle_axis(q):
+    """Rotation angle (radians) and unit axis of (m, 4) quaternions, from the vector part alone."""
+    v = q[:, :3] * np.where(q[:, 3] < 0, -1.0, 1.0)[:, None]
+    norm = np.linalg.norm(v, axis=1)
+    return 2 * np.arctan2(norm, np.abs(q[:, 3])), v / np.maximum(norm, 1e-300)[:, None], norm
+
+
+def pair_orientation_errors(B, A, E=None):
+    """
+    Orientation errors of a block of pairs, (m,) arrays in degrees:
+
+    geodesic  angle of conj(B) A, the full relative-rotation error
+    magnitude |angle(A) - angle(B)|, independent of any frame offset
+    axis      angle between the rotation axes of A and B
+    x, y, z   components of the rotation vector of the error (signed)
+    """
+    if E is None:
+        E = quaternion_multiply(quaternion_conjugate(B), A)
+    error_vector = np.degrees(quaternion_to_rotvec(E))
+    angle_a, axis_a, sin_a = _angle_axis(A)
+    angle_b, axis_b, sin_b = _angle_axis(B)
+    cos_axis = np.clip(np.einsum('ij,ij->i', axis_a, axis_b), -1, 1)
+    return {
+        "geodesic": np.linalg.norm(error_vector, axis=1),
+        "magnitude": np.degrees(np.abs(angle_a - angle_b)),
+        # Pairs that barely rotate have no meaningful axis: angle 0
+        "axis": np.where(np.minimum(sin_a, sin_b) > 1e-12, np.degrees(np.arccos(cos_axis)), 0.0),
+        "x": error_vector[:, 0], "y": error_vector[:, 1], "z": error_vector[:, 2],
+    }
+
+
+def evaluate_orientation_pairs(names, reference, methods, top_k=10, align=True, chunk_size=1 << 18):
+    """
+    Summary statistics of the orientation errors over all pairs of named poses.
+
+    Like distance_errors.evaluate_all_pairs, blocks of pairs are streamed into
+    running sums and a top-k buffer of the geodesic error. With align, a first
+    pass fits the fixed body-frame rotation between reference and each method.
+
+    Returns {label: {"count", "offset", metric: {"mean", "std", "rms", "max"},
+                     "worst_pairs"}} with metrics in degrees.
+    """
+    with instrumentation.stage("orientation_evaluation"):
+        results = _evaluate_orientation_pairs(names, reference, methods, top_k, align, chunk_size)
+    instrumentation.count("orientation_pairs_evaluated", len(reference) * (len(reference) - 1) // 2 * len(methods))
+    return results
+
+
+def _evaluate_orientation_pairs(names, reference, methods, top_k, align, chunk_size):
+    names = list(names)
+    offsets = fit_body_offsets(reference, methods) if align else dict.fromkeys(methods)
+    # conj(p_i x) (p_j x) = X^T A X: the offset goes onto each pose, not each pair
+    aligned = {label: q if offsets[label] is None else quaternion_multiply(_unit(q), rotation_matrix_to_quaternion(offsets[label]))
+               for label, q in methods.items()}
+
+    count = 0
+    total = {label: np.zeros(len(METRICS)) for label in methods}
+    total_sq = {label: np.zeros(len(METRICS)) for label in methods}
+    highest = {label: np.zeros(len(METRICS)) for label in methods}
+    empty = (np.zeros(0), np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+    top = dict.fromkeys(methods, empty)
+
+    for i, j, B, pairs in iter_relative_rotations(reference, aligned, chunk_size):
+        count += len(i)
+        for label, (a, e) in pairs.items():
+            errors = pair_orientation_errors(B, a, e)
+            values = np.stack([errors[metric] for metric in METRICS])
+            total[label] += values.sum(axis=1)
+            total_sq[label] += np.einsum('ij,ij->i', values, values)
+            highest[label] = np.maximum(highest[label], np.abs(values).max(axis=1))
+            top[label] = _merge_top_k(top[label], errors["geodesic"], i, j, top_k)
+
+    results = {}
+    for label in methods:
+        mean = total[label] / count if count else np.full(len(METRICS), np.nan)
+        mean_sq = total_sq[label] / count if count else np.full(len(METRICS), np.nan)
+        err, i, j = top[label]
+        order = np.argsort(err)[::-1]
+        results[label] = {
+            "count": count,
+            "offset": offsets[label],
+            "worst_pairs": [(names[i[o]], names[j[o]], err[o]) for o in order],
+        }
+        for k, metric in enumerate(METRICS):
+            results[label][metric] = {
+                "mean": mean[k], "std": np.sqrt(max(mean_sq[k] - mean[k] ** 2, 0.0)),
+                "rms": np.sqrt(mean_sq[k]), "max": highest[label][k] if count else np.nan,
+            }
+    return results
+
+
+def orientation_repeatability(quaternions, pairs):
+    """Geodesic angle (degrees) between the orientations of each (a, b) row pair."""
+    q = _unit(quaternions)
+    a, b = np.asarray(pairs, dtype=np.intp).T
+    return np.degrees(quaternion_angle(quaternion_multiply(quaternion_conjugate(q[a]), q[b])))
+
+
+def _has_orientation(poses):
+    return len(poses) > 0 and not np.isnan(poses.quaternion).any()
+
+
+def evaluate_session_orientation(data, reference_key="tracker_points", top_k=10):
+    """
+    All-pairs orientation errors of every {"name", "pose"} list with quaternions.
+
+    When reference_key carries no orientation (tracker points of a marker), the
+    first list that does becomes the reference. Returns (reference key, results),
+    or (None, {}) when fewer than two lists carry orientation.
+    """
+    sets = {key: PoseSet.from_entries(value) for key, value in data.items()
+            if isinstance(value, (list, StoreTable)) and value and "pose" in value[0]}
+    oriented = [key for key, poses in sets.items() if _has_orientation(poses)]
+    if reference_key not in oriented:
+        reference_key = oriented[0] if oriented else None
+    methods = [key for key in oriented if key != reference_key]
+    if reference_key is None or not methods:
+        return None, {}
+
+    reference = sets[reference_key]
+    names = reference.common_names(*(sets[key] for key in methods))
+    return reference_key, evaluate_orientation_pairs(
+        names, reference.quaternions(names), {key: sets[key].quaternions(names) for key in methods}, top_k)
+
+
+def print_orientation_summary(results, reference_key=None):
+    """Print the per-method orientation statistics (degrees) and worst pairs."""
+    if reference_key:
+        print(f"\nOrientation errors against {reference_key} [deg]:")
+    print(f"\n{'Method':<30} {'Pairs':>8} {'Geodesic':>10} {'Geo max':>10} {'Magnitude':>10} {'Axis':>10} "
+          f"{'x rms':>8} {'y rms':>8} {'z rms':>8}")
+    for label, r in results.items():
+        print(f"{label:<30} {r['count']:>8} {r['geodesic']['mean']:>10.5f} {r['geodesic']['max']:>10.5f} "
+              f"{r['magnitude']['mean']:>10.5f} {r['axis']['mean']:>10.5f} "
+              f"{r['x']['rms']:>8.5f} {r['y']['rms']:>8.5f} {r['z']['rms']:>8.5f}")
+
+    for label, r in results.items():
+        print(f"\nWorst pairs (geodesic), {label}:")
+        for name_i, name_j, err in r["worst_pairs"]:
+            print(f"  {name_i}-{name_j}: {err:.5f}")
+
+
+def main(data_file, reference_key="tracker_points"):
+    data = load_data(data_file)
+    reference_key, results = evaluate_session_orientation(data, reference_key)
+    if not results:
+        print("Fewer than two pose lists carry orientation")
+        return
+    print_orientation_summary(results, reference_key)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python orientation_errors.py <json_file> [reference_key]")
+        sys.exit(1)
+
+    main(*sys.argv[1:])
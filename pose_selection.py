@@ -0,0 +1,135 @@
+import json
+import sys
+import numpy as np
+from solve_aT3_6p import build_design_matrices
+from pose_set import PoseSet
+
+# Unknowns whose predicted standard deviation decides the target accuracy:
+# 6p and the translation column of 3Ta (x = [p, 3Ta rows])
+ACCURACY_INDICES = [0, 1, 2, 6, 10, 14]
+
+
+def predicted_markers(Link3TEnds, aT3, p6):
+    """Tracker points a candidate pose would give under a prior aT3 (4, 4) and 6p (3,)."""
+    end_points = Link3TEnds[..., :3, :3] @ np.asarray(p6, dtype=float).ravel() + Link3TEnds[..., :3, 3]
+    return end_points @ aT3[:3, :3].T + aT3[:3, 3]
+
+
+def candidate_rows(Link3TEnds, marker_points):
+    """(M, 3, 15) design-matrix rows each candidate pose adds to the system."""
+    A, _ = build_design_matrices(Link3TEnds[None], marker_points[None])
+    return A.reshape(len(Link3TEnds), 3, 15)
+
+
+def condition_numbers(rows, groups):
+    """Condition number of the stacked design matrix of each group of candidate indices."""
+    return np.array([np.linalg.cond(rows[list(group)].reshape(-1, 15)) for group in groups])
+
+
+def select_poses(rows, max_poses=30, criterion="D", sigma=None, target=None, min_poses=5, prior=1e-6):
+    """
+    Greedy optimal design over candidate poses.
+
+    Each step adds the candidate that maximizes
+      D: det(M + A_i^T A_i), scored for every candidate at once through the
+         determinant lemma det(I_3 + A_i M^-1 A_i^T), or
+      E: the smallest eigenvalue of M + A_i^T A_i (batched 15 x 15 eigvalsh),
+    where M is the information matrix of the poses chosen so far (plus a small
+    prior so that it starts invertible). M^-1 follows by a Woodbury update with
+    the chosen rows. With sigma (tracker noise) and target given, selection
+    stops once the predicted standard deviation of 6p and the 3Ta translation
+    is at most target.
+
+    Returns (chosen indices, predicted std after each pose or None).
+    """
+    rows = np.asarray(rows, dtype=float)
+    M = prior * np.eye(15)
+    Minv = np.eye(15) / prior
+    available = np.ones(len(rows), dtype=bool)
+    chosen, predicted = [], []
+
+    while len(chosen) < min(max_poses, len(rows)):
+        idx = np.flatnonzero(available)
+        A = rows[idx]
+        B = A @ Minv                                        # (m, 3, 15)
+        S = np.eye(3) + B @ A.swapaxes(1, 2)                # (m, 3, 3)
+        if criterion == "D":
+            score = np.linalg.slogdet(S)[1]
+        else:
+            score = np.linalg.eigvalsh(M + A.swapaxes(1, 2) @ A)[:, 0]
+        best = int(np.argmax(score))
+        k = idx[best]
+
+        Minv = Minv - B[best].T @ np.linalg.solve(S[best], B[best])
+        M = M + rows[k].T @ rows[k]
+        available[k] = False
+        chosen.append(int(k))
+
+        if sigma is not None:
+            std = sigma * np.sqrt(np.clip(np.diag(Minv)[ACCURACY_INDICES], 0, None))
+            predicted.append(float(std.max()))
+            if target is not None and len(chosen) >= min_poses and predicted[-1] <= target:
+                break
+
+    return chosen, (predicted if sigma is not None else None)
+
+
+def predicted_std(rows, sigma):
+    """Predicted std of 6p and the 3Ta translation for one set of rows (no prior)."""
+    A = rows.reshape(-1, 15)
+    cov = sigma ** 2 * np.linalg.inv(A.T @ A)
+    return float(np.sqrt(np.diag(cov)[ACCURACY_INDICES]).max())
+
+
+def main(candidates_file, prior_file, plan_file, sigma=5e-5, target=1e-4, max_poses=30, criterion="D"):
+    from calibration_cache import calibrate
+    from pose_store import load_data
+    from solve_aT3_6p_json_refactor import GROUPS
+
+    # Prior aT3 / 6p from an earlier calibration session
+    prior = load_data(prior_file)
+    aT3, p6 = calibrate(prior["tracker_points"], prior["link_transforms"])[0]
+
+    candidates = PoseSet.from_link_transforms(load_data(candidates_file)["link_transforms"])
+    Link3TEnds = candidates.matrix
+    rows = candidate_rows(Link3TEnds, predicted_markers(Link3TEnds, aT3, p6))
+
+    chosen, predicted = select_poses(rows, max_poses, criterion, sigma, target)
+    names = candidates.names[chosen].tolist()
+    plan = {
+        "criterion": criterion, "sigma": sigma, "target": target,
+        "condition_number": float(np.linalg.cond(rows[chosen].reshape(-1, 15))),
+        "predicted_std": predicted,
+        "link_transforms": [{"name": name, "Translation": candidates.position[k].tolist(),
+                             "Rotation": candidates.quaternion[k].tolist()} for name, k in zip(names, chosen)],
+    }
+    with open(plan_file, 'w') as file:
+        json.dump(plan, file, indent=1)
+
+    print(f"{len(chosen)} of {len(rows)} candidate poses, predicted std {predicted[-1]:.2e} "
+          f"(target {target:.2e}), condition number {plan['condition_number']:.3g}")
+    print("Capture order: " + ", ".join(names))
+
+    # The fixed five-point groups, for comparison, where the candidates hold them
+    fixed = [group for group in GROUPS if all(name in candidates for name in group)]
+    for group in fixed:
+        group_rows = rows[candidates.rows(group)]
+        print(f"Fixed group {group[0]}..{group[-1]}: condition number {np.linalg.cond(group_rows.reshape(-1, 15)):.3g}, "
+              f"predicted std {predicted_std(group_rows, sigma):.2e}")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {"--sigma": "5e-5", "--target": "1e-4", "--max-poses": "30", "--criterion": "D"}
+    for flag in list(options):
+        if flag in args:
+            idx = args.index(flag)
+            options[flag] = args[idx + 1]
+            del args[idx:idx + 2]
+    if len(args) != 3:
+        print("Usage: python pose_selection.py <candidates.json> <prior_calibration.json> <plan_out.json> "
+              "[--sigma 5e-5] [--target 1e-4] [--max-poses 30] [--criterion D|E]")
+        sys.exit(1)
+
+    main(args[0], args[1], args[2], float(options["--sigma"]), float(options["--target"]),
+         int(options["--max-poses"]), options["--criterion"])
@@ -0,0 +1,89 @@
+import numpy as np
+from transforms import make_transforms
+
+
+class PoseSet:
+    """
+    Named poses held as contiguous arrays with a name -> row hash index.
+
+    position: (N, 3), quaternion: (N, 4) scalar-last (NaN where unknown),
+    matrix: (N, 4, 4) homogeneous transforms, built once on first use.
+    """
+
+    def __init__(self, names, position, quaternion=None, matrix=None):
+        self.names = np.asarray(names, dtype=str)
+        self.position = np.asarray(position, dtype=float).reshape(-1, 3)
+        n = len(self.names)
+        assert len(self.position) == n
+        if quaternion is None:
+            quaternion = np.full((n, 4), np.nan)
+        self.quaternion = np.asarray(quaternion, dtype=float).reshape(n, 4)
+        self._matrix = matrix
+        self.index = {name: row for row, name in enumerate(self.names.tolist())}
+        assert len(self.index) == n, "duplicate point names"
+
+    @classmethod
+    def from_entries(cls, entries):
+        """From a list of {"name", "pose"} dicts, pose = [x, y, z] or [x, y, z, qx, qy, qz, qw]."""
+        if hasattr(entries, "pose_set"):
+            # A pose_store table: straight from its columns
+            return entries.pose_set()
+        names = [entry["name"] for entry in entries]
+        poses = [list(entry["pose"]) for entry in entries]
+        position = np.array([pose[:3] for pose in poses], dtype=float)
+        quaternion = np.array([pose[3:7] if len(pose) >= 7 else [np.nan] * 4 for pose in poses], dtype=float)
+        return cls(names, position, quaternion)
+
+    @classmethod
+    def from_link_transforms(cls, entries):
+        """From a list of {"name", "Translation", "Rotation"} dicts."""
+        if hasattr(entries, "pose_set"):
+            return entries.pose_set()
+        names = [entry["name"] for entry in entries]
+        position = np.array([entry["Translation"] for entry in entries], dtype=float)
+        quaternion = np.array([entry["Rotation"] for entry in entries], dtype=float)
+        return cls(names, position, quaternion)
+
+    @classmethod
+    def from_store(cls, columns):
+        """From one table of pose_store.open_store, sharing the memory-mapped columns."""
+        return cls(columns["name"], columns["position"], columns["quaternion"], columns["matrix"])
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            # NaN quaternions propagate to NaN rotation blocks
+            self._matrix = make_transforms(self.position, self.quaternion)
+        return self._matrix
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def rows(self, names):
+        """Row indices of names; any nesting of lists gives the same array shape."""
+        names = np.asarray(names, dtype=str)
+        return np.array([self.index[name] for name in names.ravel().tolist()], dtype=np.intp).reshape(names.shape)
+
+    def positions(self, names):
+        """(..., 3) positions of names, e.g. (G, n, 3) for G groups of n names."""
+        return self.position[self.rows(names)]
+
+    def quaternions(self, names):
+        return self.quaternion[self.rows(names)]
+
+    def matrices(self, names):
+        """(..., 4, 4) transforms of names."""
+        return self.matrix[self.rows(names)]
+
+    def select(self, names):
+        """A new PoseSet holding only names, in the given order."""
+        rows = self.rows(names).ravel()
+        matrix = self._matrix[rows] if self._matrix is not None else None
+        return PoseSet(self.names[rows], self.position[rows], self.quaternion[rows], matrix)
+
+    def common_names(self, *others):
+        """Names of this set that every other set also holds, in this set's order."""
+        return [name for name in self.names.tolist() if all(name in other for other in others)]
@@ -0,0 +1,329 @@
+import json
+import os
+import re
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+import numpy as np
+import instrumentation
+from pose_set import PoseSet
+from transforms import make_transforms
+
+# Stored positions are always in metres
+UNIT_SCALE = {"m": 1.0, "mm": 1e-3}
+
+NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+# Recently loaded sessions, keyed by (path, mtime, unit); off unless a
+# long-lived process turns it on with set_cache_size. Service handler threads
+# share it, so every access holds _cache_lock.
+_cache = OrderedDict()
+_cache_size = 0
+_cache_lock = threading.Lock()
+
+
+class _TableBuilder:
+    """Accumulates one table row by row in compact float buffers."""
+
+    def __init__(self):
+        self.names = []
+        self.position = array('d')
+        self.quaternion = array('d')
+
+    def append(self, name, position, quaternion=None):
+        self.names.append(name)
+        self.position.extend(position[:3])
+        self.quaternion.extend(quaternion if quaternion is not None else (np.nan,) * 4)
+
+
+def _parse_json(path, tables, unit):
+    """data.json-style files: lists of {"name", "pose"} or {"name", "Translation", "Rotation"}."""
+    with open(path, 'r') as file:
+        data = json.load(file)
+    unit = data.get("unit", unit)
+    scale = UNIT_SCALE[unit]
+
+    for key, entries in data.items():
+        if not isinstance(entries, list):
+            continue
+        table = tables.setdefault(key, _TableBuilder())
+        for entry in entries:
+            if "pose" in entry:
+                pose = entry["pose"]
+                quaternion = pose[3:7] if len(pose) >= 7 else None
+            else:
+                pose = entry["Translation"]
+                quaternion = entry["Rotation"]
+            table.append(entry["name"], [v * scale for v in pose[:3]], quaternion)
+    return unit
+
+
+def _parse_blocks(path, tables, unit):
+    """
+    Link3TEndsTransform.csv / Link6Poses.csv style text: a point name on its own
+    line followed by labelled "Translation"/"Rotation" or "<frame> pose" lines.
+    """
+    scale = UNIT_SCALE[unit]
+    name = None
+    translation = None
+    with open(path, 'r') as file:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            values = [float(v) for v in NUMBER.findall(line.split('[', 1)[1])] if '[' in line else []
+
+            if not values:
+                name = line
+                translation = None
+                continue
+            if name is None:
+                raise ValueError(f"{path}:{number}: values before any point name")
+            if "Translation" in line:
+                translation = values
+            elif "Rotation" in line:
+                if translation is None:
+                    raise ValueError(f"{path}:{number}: Rotation of {name} without a Translation line before it")
+                tables.setdefault("link_transforms", _TableBuilder()).append(
+                    name, [v * scale for v in translation], values)
+                translation = None
+            elif " pose" in line:
+                frame = line.split(" pose", 1)[0].strip()
+                table = "wrist3_Link_poses" if frame == "wrist3_Link" else f"{frame}_poses"
+                tables.setdefault(table, _TableBuilder()).append(
+                    name, [v * scale for v in values[:3]], values[3:7] if len(values) >= 7 else None)
+    return unit
+
+
+def _parse_tracker_table(path, tables, unit):
+    """Tab-separated tracker export (tracker_ps.csv) with an optional "(mm)" unit row."""
+    scale = UNIT_SCALE[unit]
+    table = tables.setdefault("tracker_points", _TableBuilder())
+    with open(path, 'r') as file:
+        for line in file:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0].startswith('(') or fields[0] == "name":
+                if "(mm)" in fields:
+                    unit = "mm"
+                    scale = UNIT_SCALE[unit]
+                continue
+            table.append(fields[0], [float(v) * scale for v in fields[1:4]])
+    return unit
+
+
+def _detect_format(path):
+    if path.endswith(".json"):
+        return _parse_json
+    with open(path, 'r') as file:
+        head = file.read(4096)
+    if not head.strip():
+        raise ValueError(f"{path} is empty")
+    if '\t' in head.lstrip('\n').splitlines()[0]:
+        return _parse_tracker_table
+    return _parse_blocks
+
+
+def _write_table(table_dir, table, chunk=1 << 16):
+    os.makedirs(table_dir, exist_ok=True)
+    n = len(table.names)
+    position = np.frombuffer(table.position, dtype=np.float64).reshape(n, 3)
+    quaternion = np.frombuffer(table.quaternion, dtype=np.float64).reshape(n, 4)
+
+    np.save(os.path.join(table_dir, "name.npy"), np.array(table.names, dtype=str))
+    np.save(os.path.join(table_dir, "position.npy"), position)
+    np.save(os.path.join(table_dir, "quaternion.npy"), quaternion)
+
+    # Homogeneous matrix column, NaN rotation where no quaternion was recorded
+    matrix = np.lib.format.open_memmap(os.path.join(table_dir, "matrix.npy"), mode='w+', dtype=np.float64, shape=(n, 4, 4))
+    for start in range(0, n, chunk):
+        stop = min(start + chunk, n)
+        matrix[start:stop] = make_transforms(position[start:stop], quaternion[start:stop])
+    matrix.flush()
+
+
+def ingest(sources, out_dir, unit="m"):
+    """
+    Parse tracker/robot exports once and write them as a columnar store.
+
+    sources: JSON files or text exports; rows of tables with the same key are
+             appended in source order
+    unit: length unit of sources that do not declare one themselves; the
+          store holds metres and is loaded back in this unit by default
+
+    Every source is converted to metres here, whatever unit it declares, so
+    the tables of one store always agree; meta.json keeps each source's unit.
+    """
+    tables = {}
+    source_units = []
+    for path in sources:
+        source_units.append(_detect_format(path)(path, tables, unit))
+
+    os.makedirs(out_dir, exist_ok=True)
+    for key, table in tables.items():
+        _write_table(os.path.join(out_dir, key), table)
+
+    meta = {"unit": "m", "source_unit": unit,
+            "sources": [{"path": os.path.abspath(p), "unit": u} for p, u in zip(sources, source_units)],
+            "tables": {key: len(table.names) for key, table in tables.items()}}
+    with open(os.path.join(out_dir, "meta.json"), 'w') as file:
+        json.dump(meta, file, indent=2)
+
+    return meta
+
+
+def read_meta(store_dir):
+    with open(os.path.join(store_dir, "meta.json"), 'r') as file:
+        return json.load(file)
+
+
+def store_scale(meta, unit=None):
+    """Factor from the stored metres to unit, by default the ingest unit of undeclared sources."""
+    # Stores written before the source unit was recorded came from metre sources
+    return 1.0 / UNIT_SCALE[unit or meta.get("source_unit", "m")]
+
+
+def open_store(store_dir):
+    """Memory-map every table column: {table: {"name", "position", "quaternion", "matrix"}}."""
+    meta = read_meta(store_dir)
+    return {key: {column: np.load(os.path.join(store_dir, key, column + ".npy"), mmap_mode='r')
+                  for column in ("name", "position", "quaternion", "matrix")}
+            for key in meta["tables"]}
+
+
+class StoreTable(Sequence):
+    """
+    One store table seen as the JSON entry list it was ingested from.
+
+    Nothing is built per row up front: PoseSet.from_entries and
+    from_link_transforms take the memory-mapped columns as they are, and an
+    entry dict is only made when a script indexes or iterates the table.
+    """
+
+    def __init__(self, columns, scale=1.0, link=False):
+        self.columns = columns
+        self.scale = scale
+        self.link = link
+        self._position = None
+        self._has_rotation = None
+
+    @property
+    def position(self):
+        if self._position is None:
+            position = self.columns["position"]
+            self._position = position if self.scale == 1.0 else position * self.scale
+        return self._position
+
+    def pose_set(self):
+        """PoseSet sharing the columns; the stored matrices only hold when no rescale is needed."""
+        matrix = self.columns["matrix"] if self.scale == 1.0 else None
+        return PoseSet(self.columns["name"], self.position, self.columns["quaternion"], matrix)
+
+    def __len__(self):
+        return len(self.columns["name"])
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[i] for i in range(*k.indices(len(self)))]
+        name, t, q = str(self.columns["name"][k]), self.position[k], self.columns["quaternion"][k]
+        if self.link:
+            return {"name": name, "Translation": t, "Rotation": q}
+        if self._has_rotation is None:
+            self._has_rotation = not np.isnan(self.columns["quaternion"]).any()
+        return {"name": name, "pose": np.concatenate((t, q)) if self._has_rotation else t}
+
+
+def set_cache_size(size):
+    """Keep up to size loaded sessions in memory; 0 disables and clears the cache."""
+    global _cache_size
+    with _cache_lock:
+        _cache_size = size
+        while len(_cache) > size:
+            _cache.popitem(last=False)
+
+
+def load_data(path, unit=None):
+    """
+    Load a session either from a JSON file or from a pose store directory.
+
+    A store is returned in the JSON layout the scripts already walk: each table
+    is a StoreTable over the memory-mapped columns, which PoseSet takes without
+    building per-row entries.
+
+    Both paths return positions in the unit of the source by default, so a
+    store reads back exactly like the JSON it was ingested from. unit asks for
+    another unit; a JSON file can only be converted when it declares its own
+    top-level "unit".
+
+    With the cache on, a session whose file (or store meta.json) has not changed
+    is returned from memory; callers must treat it as read-only.
+    """
+    if not _cache_size:
+        with instrumentation.stage("load"):
+            return _load_data(path, unit)
+
+    stamp_path = os.path.join(path, "meta.json") if os.path.isdir(path) else path
+    key = (os.path.abspath(path), os.stat(stamp_path).st_mtime_ns, unit)
+    with _cache_lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+    if data is not None:
+        instrumentation.count("load_cache_hits")
+        return data
+
+    # Loaded outside the lock; evicting an entry only drops the cache's
+    # reference, threads already holding that session keep using it
+    with instrumentation.stage("load"):
+        data = _load_data(path, unit)
+    with _cache_lock:
+        _cache[key] = data
+        while len(_cache) > _cache_size:
+            _cache.popitem(last=False)
+    return data
+
+
+def _load_data(path, unit):
+    if not os.path.isdir(path):
+        with open(path, 'r') as file:
+            data = json.load(file)
+        return convert_units(data, unit) if unit else data
+
+    scale = store_scale(read_meta(path), unit)
+    return {key: StoreTable(columns, scale, link=key == "link_transforms")
+            for key, columns in open_store(path).items()}
+
+
+def convert_units(data, unit):
+    """Positions of a JSON session that declares its "unit", converted to unit."""
+    if "unit" not in data:
+        raise ValueError(f"JSON session does not declare its unit, cannot convert it to {unit}")
+    scale = UNIT_SCALE[data["unit"]] / UNIT_SCALE[unit]
+    for entries in data.values():
+        if not isinstance(entries, list):
+            continue
+        for entry in entries:
+            key = "pose" if "pose" in entry else "Translation"
+            entry[key] = [v * scale for v in entry[key][:3]] + list(entry[key][3:])
+    data["unit"] = unit
+    return data
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    unit = "m"
+    if "--unit" in args:
+        idx = args.index("--unit")
+        unit = args[idx + 1]
+        del args[idx:idx + 2]
+
+    if len(args) < 2:
+        print("Usage: python pose_store.py <store_dir> <source> [<source> ...] [--unit m|mm]")
+        sys.exit(1)
+
+    meta = ingest(args[1:], args[0], unit)
+    for key, count in meta["tables"].items():
+        print(f"{key}: {count} rows")
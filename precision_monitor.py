@@ -0,0 +1,310 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+import numpy as np
+from tf_recorder import MAGIC, read_recording
+
+# Alert thresholds in metres, like the offline distance errors
+DEFAULT_THRESHOLDS = {"max": 2e-3, "rms": 1e-3, "drift": 5e-4}
+
+
+class PrecisionMonitor:
+    """
+    Rolling distance-error statistics over paired tracker / robot positions.
+
+    Samples of the two streams are paired by nearest stamp within tolerance.
+    Each pair is compared with every pair still in the window, using the metric
+    of evaluate_precision_by_distance: | |t_i - t_j| - |r_i - r_j| |. Sums over
+    all window pairs are kept per row, so one sample costs O(window) and no
+    sums are ever subtracted.
+
+    Per sample the monitor reports the largest error of the new pair, the
+    rolling mean / rms over the window and the drift: an exponentially
+    weighted mean of the per-sample error minus its value when the window
+    first filled. Alerts fire from add() itself, before it returns.
+    """
+
+    def __init__(self, window=256, tolerance=5e-3, thresholds=None, on_alert=None, smoothing=0.02,
+                 pending=64):
+        self.window = window
+        self.tolerance = tolerance
+        self.thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+        self.on_alert = on_alert
+        self.smoothing = smoothing
+
+        # Unpaired samples waiting for the other stream
+        self.pending = {"tracker": deque(maxlen=pending), "robot": deque(maxlen=pending)}
+
+        # Window of paired samples, a ring over fixed arrays
+        self.stamps = np.zeros(window)
+        self.tracker = np.zeros((window, 3))
+        self.robot = np.zeros((window, 3))
+        self.size = 0
+        self.head = 0
+
+        self.row_sum = np.zeros(window)
+        self.row_sq = np.zeros(window)
+        self.ewma = None
+        self.baseline = None
+
+        self.counters = {"samples": 0, "pairs": 0, "unpaired": 0, "alerts": 0, "latency_max": 0.0}
+        self.last = {}
+
+    def _errors(self, tracker, robot, rows):
+        """Distance errors between one pair and the window rows."""
+        d_tracker = np.linalg.norm(self.tracker[rows] - tracker, axis=1)
+        d_robot = np.linalg.norm(self.robot[rows] - robot, axis=1)
+        return np.abs(d_tracker - d_robot)
+
+    def add(self, stream, stamp, position):
+        """
+        Feed one sample of stream "tracker" or "robot" (stamp in seconds,
+        position (3,) in metres). Returns the alerts it raised, if any.
+        """
+        start = time.perf_counter()
+        self.counters["samples"] += 1
+        other = self.pending["robot" if stream == "tracker" else "tracker"]
+
+        match = None
+        for k, (other_stamp, _) in enumerate(other):
+            dt = abs(other_stamp - stamp)
+            if dt <= self.tolerance and (match is None or dt < abs(other[match][0] - stamp)):
+                match = k
+        if match is None:
+            if len(self.pending[stream]) == self.pending[stream].maxlen:
+                self.counters["unpaired"] += 1
+            self.pending[stream].append((stamp, np.asarray(position, dtype=float)))
+            return []
+
+        other_stamp, other_position = other[match]
+        # Older samples of the other stream can no longer be paired
+        for _ in range(match + 1):
+            other.popleft()
+        self.counters["unpaired"] += match
+        position = np.asarray(position, dtype=float)
+        tracker, robot = (position, other_position) if stream == "tracker" else (other_position, position)
+        alerts = self._add_pair(max(stamp, other_stamp), tracker, robot)
+
+        latency = time.perf_counter() - start
+        self.counters["latency_max"] = max(self.counters["latency_max"], latency)
+        for alert in alerts:
+            alert["latency"] = latency
+            if self.on_alert:
+                self.on_alert(alert)
+        return alerts
+
+    def _add_pair(self, stamp, tracker, robot):
+        self.counters["pairs"] += 1
+        # Each window pair is booked on its older row; the oldest row only has
+        # pairs with newer ones, so it leaves by dropping its row sums
+        rows = np.arange(self.size)
+        if self.size == self.window:
+            rows = rows[rows != self.head]
+        errors = self._errors(tracker, robot, rows)
+        self.row_sum[rows] += errors
+        self.row_sq[rows] += errors ** 2
+
+        self.stamps[self.head] = stamp
+        self.tracker[self.head] = tracker
+        self.robot[self.head] = robot
+        self.row_sum[self.head] = 0.0
+        self.row_sq[self.head] = 0.0
+        self.head = (self.head + 1) % self.window
+        self.size = min(self.size + 1, self.window)
+
+        if not len(errors):
+            return []
+        sample_mean = errors.mean()
+        self.ewma = sample_mean if self.ewma is None else self.ewma + self.smoothing * (sample_mean - self.ewma)
+        if self.baseline is None and self.size == self.window:
+            self.baseline = self.ewma
+
+        pair_count = self.size * (self.size - 1) / 2
+        self.last = {
+            "stamp": stamp,
+            "max": errors.max(),
+            "mean": self.row_sum[:self.size].sum() / pair_count,
+            "rms": np.sqrt(self.row_sq[:self.size].sum() / pair_count),
+            "drift": self.ewma - self.baseline if self.baseline is not None else 0.0,
+        }
+        alerts = [{"metric": metric, "value": self.last[metric], "threshold": limit, "stamp": stamp}
+                  for metric, limit in self.thresholds.items()
+                  if limit is not None and abs(self.last[metric]) > limit]
+        self.counters["alerts"] += len(alerts)
+        return alerts
+
+    def stats(self):
+        return dict(self.counters, window=self.size, **self.last)
+
+
+def _header_written(path):
+    """Whether the recording's magic, header size and JSON header are all on disk."""
+    if not os.path.exists(path) or os.path.getsize(path) < len(MAGIC) + 4:
+        return False
+    with open(path, 'rb') as file:
+        file.seek(len(MAGIC))
+        return os.path.getsize(path) >= len(MAGIC) + 4 + int.from_bytes(file.read(4), 'little')
+
+
+async def tail_recording(path, streams, poll=1e-3):
+    """
+    Follow a TfRecorder file as it grows: yields (stream, stamp, position) for
+    records of the frame pairs in streams, {pair index: "tracker" | "robot"}.
+    """
+    while not _header_written(path):
+        await asyncio.sleep(poll)
+    records, _ = read_recording(path)
+    dtype = records.dtype
+    with open(path, 'rb') as file:
+        file.seek(len(MAGIC))
+        file.seek(int.from_bytes(file.read(4), 'little'), 1)
+        buffered = b""
+        while True:
+            data = file.read()
+            if not data:
+                await asyncio.sleep(poll)
+                continue
+            buffered += data
+            whole = len(buffered) // dtype.itemsize * dtype.itemsize
+            chunk = np.frombuffer(buffered[:whole], dtype=dtype)
+            buffered = buffered[whole:]
+            for record in chunk:
+                stream = streams.get(int(record["pair"]))
+                if stream:
+                    yield stream, float(record["stamp"]), record["translation"]
+
+
+async def tail_lines(path, poll=1e-3):
+    """Follow a text file of "<stream> <stamp> <x> <y> <z>" lines."""
+    while not os.path.exists(path):
+        await asyncio.sleep(poll)
+    with open(path, 'r') as file:
+        partial = ""
+        while True:
+            line = file.readline()
+            if not line:
+                await asyncio.sleep(poll)
+                continue
+            line = partial + line
+            if not line.endswith("\n"):
+                partial = line
+                continue
+            partial = ""
+            fields = line.split()
+            if len(fields) >= 5:
+                yield fields[0], float(fields[1]), np.array(fields[2:5], dtype=float)
+
+
+async def serve_socket(socket_path, monitor):
+    """
+    Local stand-in for live streams: clients send newline-delimited JSON
+    {"stream", "stamp", "position"} samples and get the alerts back per line.
+    """
+    async def handle(reader, writer):
+        try:
+            while line := await reader.readline():
+                sample = json.loads(line)
+                alerts = monitor.add(sample["stream"], sample["stamp"], sample["position"])
+                writer.write(json.dumps({"alerts": alerts}, default=float).encode() + b"\n")
+                await writer.drain()
+        except asyncio.CancelledError:
+            # The monitor is shutting down; the client just sees the connection close
+            pass
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        os.unlink(socket_path)
+
+
+async def consume(monitor, source, stopped=None):
+    async for stream, stamp, position in source:
+        monitor.add(stream, stamp, position)
+        # Sources only yield to the loop when they run dry, so check here
+        if stopped is not None and stopped.is_set():
+            break
+
+
+def _print_alert(alert):
+    print(f"ALERT {alert['metric']}={alert['value']:.6f} > {alert['threshold']} at stamp {alert['stamp']:.6f} "
+          f"({alert['latency']*1e3:.2f} ms after the sample arrived)", file=sys.stderr, flush=True)
+
+
+async def _run(argv, monitor, report, stop=False):
+    """Run the source and the periodic report; with stop, return on the first alert. Returns the exit status."""
+    stopped = asyncio.Event()
+    if stop:
+        print_alert = monitor.on_alert
+
+        def on_alert(alert):
+            print_alert(alert)
+            stopped.set()
+        monitor.on_alert = on_alert
+
+    source = argv[0]
+    if source == "recording":
+        task = consume(monitor, tail_recording(argv[1], {int(argv[2]): "tracker", int(argv[3]): "robot"}), stopped)
+    elif source == "lines":
+        task = consume(monitor, tail_lines(argv[1]), stopped)
+    else:
+        task = serve_socket(argv[1], monitor)
+
+    async def report_loop():
+        while True:
+            await asyncio.sleep(report)
+            stats = monitor.stats()
+            if "rms" in stats:
+                print(f"pairs={stats['pairs']} window={stats['window']} mean={stats['mean']:.6f} "
+                      f"rms={stats['rms']:.6f} drift={stats['drift']:.6f} alerts={stats['alerts']} "
+                      f"latency max={stats['latency_max']*1e3:.3f} ms", flush=True)
+
+    # Cancelling the tasks closes the socket server and the followed files on the way out
+    tasks = [asyncio.ensure_future(task), asyncio.ensure_future(report_loop()), asyncio.ensure_future(stopped.wait())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for pending in tasks:
+            pending.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for finished in done:
+        if finished is not tasks[2]:
+            finished.result()
+    return 2 if stopped.is_set() else 0
+
+
+def main(argv):
+    thresholds = {}
+    stop = "--stop" in argv
+    argv = [arg for arg in argv if arg != "--stop"]
+    for metric in list(DEFAULT_THRESHOLDS):
+        flag = f"--{metric}"
+        if flag in argv:
+            idx = argv.index(flag)
+            thresholds[metric] = float(argv[idx + 1])
+            del argv[idx:idx + 2]
+
+    if not ((len(argv) == 4 and argv[0] == "recording") or (len(argv) == 2 and argv[0] in ("lines", "socket"))):
+        print("Usage: python precision_monitor.py recording <tf_recording> <tracker_pair> <robot_pair> [options]\n"
+              "       python precision_monitor.py lines <file> [options]\n"
+              "       python precision_monitor.py socket <socket_path> [options]\n"
+              "Options: --max <m> --rms <m> --drift <m> --stop (exit with status 2 on the first alert)")
+        sys.exit(1)
+
+    monitor = PrecisionMonitor(thresholds=thresholds, on_alert=_print_alert)
+    try:
+        return asyncio.run(_run(argv, monitor, report=1.0, stop=stop))
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
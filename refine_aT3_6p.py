@@ -0,0 +1,169 @@
+import sys
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+from solve_aT3_6p import solve_aT3_6p_batch
+from pose_store import load_data
+from solve_aT3_6p_json_refactor import GROUPS
+from pose_set import PoseSet
+
+
+def project_to_so3(M):
+    """Nearest rotation(s) to (..., 3, 3) matrices in the Frobenius sense."""
+    U, _, Vt = np.linalg.svd(M)
+    D = np.ones(M.shape[:-1])
+    D[..., -1] = np.sign(np.linalg.det(U @ Vt))
+    return (U * D[..., None, :]) @ Vt
+
+
+def skew(v):
+    """(..., 3) vectors -> (..., 3, 3) cross-product matrices."""
+    S = np.zeros(v.shape + (3,))
+    S[..., 0, 1], S[..., 0, 2] = -v[..., 2], v[..., 1]
+    S[..., 1, 0], S[..., 1, 2] = v[..., 2], -v[..., 0]
+    S[..., 2, 0], S[..., 2, 1] = -v[..., 1], v[..., 0]
+    return S
+
+
+def _group_sum(values, starts):
+    """Sum consecutive rows of values per group; samples are sorted by group, no group is empty."""
+    return np.add.reduceat(values, starts, axis=0)
+
+
+def refine_aT3_6p(Link3TEnds, marker_points, group_ids, aT3_init, p_init, shared_6p=True,
+                  max_iterations=50, tolerance=1e-12, damping=1e-3):
+    """
+    Levenberg-Marquardt refinement of aT3 (on SO(3) x R^3) and 6p.
+
+    Residual of sample i in group g: r_i = Rg (Ri p + ti) + tg - q_i, with the
+    rotation updated as Rg <- exp([dtheta]x) Rg. The Jacobian blocks are
+    analytic: dr/dtheta = -[Rg y]x, dr/dtg = I, dr/dp = Rg Ri.
+
+    With shared_6p the normal matrix is block-arrow shaped (6x6 per group plus
+    a 3x3 coupling block for p); it is solved through the Schur complement on p,
+    so the cost stays linear in the number of groups. Otherwise every group is
+    an independent 9x9 problem, solved as one batch.
+
+    Link3TEnds: (N, 3, 4) or (N, 4, 4), marker_points: (N, 3), group_ids: (N,) in 0..G-1
+    aT3_init: (G, 4, 4), p_init: (3,) if shared_6p else (G, 3)
+
+    Returns aT3 (G, 4, 4), 6p (3,) or (G, 3), and {"cost", "rms", "iterations"}.
+    """
+    group_ids = np.asarray(group_ids)
+    order = np.argsort(group_ids, kind='stable')
+    Li = np.asarray(Link3TEnds, dtype=float)[order]
+    q = np.asarray(marker_points, dtype=float)[order, :3]
+    gid = group_ids[order]
+    G = len(aT3_init)
+    # reduceat needs every group to own a run of samples; an empty group would
+    # also leave its normal-equation block singular
+    counts = np.bincount(gid, minlength=G)
+    if len(counts) > G or not counts.all():
+        raise ValueError(f"group_ids must cover every group 0..{G - 1} with at least one sample")
+    starts = np.searchsorted(gid, np.arange(G))
+    Ri, ti = Li[:, :3, :3], Li[:, :3, 3]
+
+    Rg = project_to_so3(np.asarray(aT3_init, dtype=float)[:, :3, :3])
+    tg = np.array(aT3_init, dtype=float)[:, :3, 3]
+    p = np.array(p_init, dtype=float).reshape((3,) if shared_6p else (G, 3))
+
+    def residuals(Rg, tg, p):
+        y = (Ri @ p if shared_6p else np.einsum('nij,nj->ni', Ri, p[gid])) + ti
+        Ry = np.einsum('nij,nj->ni', Rg[gid], y)
+        return Ry + tg[gid] - q, Ry
+
+    r, Ry = residuals(Rg, tg, p)
+    cost = np.sum(r ** 2)
+    lam = damping
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        # Per-sample Jacobian blocks, (N, 3, 6) for the group pose and (N, 3, 3) for p
+        Jg = np.concatenate((-skew(Ry), np.broadcast_to(np.eye(3), Ry.shape + (3,))), axis=2)
+        Jp = Rg[gid] @ Ri
+
+        Hgg = _group_sum(Jg.swapaxes(1, 2) @ Jg, starts)
+        Hgp = _group_sum(Jg.swapaxes(1, 2) @ Jp, starts)
+        Hpp_g = _group_sum(Jp.swapaxes(1, 2) @ Jp, starts)
+        bg = _group_sum(np.einsum('nki,nk->ni', Jg, r), starts)
+        bp_g = _group_sum(np.einsum('nki,nk->ni', Jp, r), starts)
+
+        while True:
+            Hgg_d = Hgg + lam * Hgg * np.eye(6)
+            if shared_6p:
+                Hpp = Hpp_g.sum(axis=0)
+                Hpp = Hpp + lam * Hpp * np.eye(3)
+                Hgg_inv_Hgp = np.linalg.solve(Hgg_d, Hgp)
+                Hgg_inv_bg = np.linalg.solve(Hgg_d, bg[..., None])[..., 0]
+                S = Hpp - np.einsum('gki,gkj->ij', Hgp, Hgg_inv_Hgp)
+                rhs = -bp_g.sum(axis=0) + np.einsum('gki,gk->i', Hgp, Hgg_inv_bg)
+                dp = np.linalg.solve(S, rhs)
+                dg = -Hgg_inv_bg - Hgg_inv_Hgp @ dp
+            else:
+                H = np.zeros((G, 9, 9))
+                H[:, :6, :6] = Hgg_d
+                H[:, :6, 6:] = Hgp
+                H[:, 6:, :6] = Hgp.swapaxes(1, 2)
+                H[:, 6:, 6:] = Hpp_g + lam * Hpp_g * np.eye(3)
+                d = np.linalg.solve(H, -np.concatenate((bg, bp_g), axis=1)[..., None])[..., 0]
+                dg, dp = d[:, :6], d[:, 6:]
+
+            Rg_new = R.from_rotvec(dg[:, :3]).as_matrix() @ Rg
+            tg_new = tg + dg[:, 3:]
+            p_new = p + dp
+            r_new, Ry_new = residuals(Rg_new, tg_new, p_new)
+            cost_new = np.sum(r_new ** 2)
+            if cost_new < cost or lam > 1e12:
+                break
+            lam *= 10
+
+        if cost_new >= cost:
+            break
+        converged = cost - cost_new <= tolerance * max(cost, 1e-300)
+        Rg, tg, p, r, Ry, cost = Rg_new, tg_new, p_new, r_new, Ry_new, cost_new
+        lam = max(lam / 10, 1e-12)
+        if converged:
+            break
+
+    aT3 = np.zeros((G, 4, 4))
+    aT3[:, :3, :3] = Rg
+    aT3[:, :3, 3] = tg
+    aT3[:, 3, 3] = 1
+
+    return aT3, p, {"cost": cost, "rms": np.sqrt(cost / (3 * len(q))), "iterations": iteration}
+
+
+def refine_groups(Link3TEnds, marker_points, shared_6p=True, **options):
+    """Linear solve followed by refinement for stacked (G, n, ...) groups."""
+    Link3TEnds = np.asarray(Link3TEnds, dtype=float)
+    marker_points = np.asarray(marker_points, dtype=float)
+    G, n = marker_points.shape[:2]
+
+    aT3_init, p_init = solve_aT3_6p_batch(Link3TEnds[..., :3, :], marker_points)
+    if shared_6p:
+        p_init = p_init.mean(axis=0)
+
+    group_ids = np.repeat(np.arange(G), n)
+    return refine_aT3_6p(Link3TEnds.reshape(G * n, *Link3TEnds.shape[2:]), marker_points.reshape(G * n, -1),
+                         group_ids, aT3_init, p_init, shared_6p, **options)
+
+
+def main(json_file):
+    data = load_data(json_file)
+
+    tracker = PoseSet.from_entries(data["tracker_points"])
+    links = PoseSet.from_link_transforms(data["link_transforms"])
+
+    est_aT3, est_6p, info = refine_groups(links.matrices(GROUPS), tracker.positions(GROUPS))
+
+    for idx, aT3 in enumerate(est_aT3):
+        print(f"Group {idx+1}: est_aT3 =\n{aT3}\n")
+    print(f"Shared est_6p = {est_6p}")
+    print(f"rms = {info['rms']*1000:.4f} mm after {info['iterations']} iterations")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python refine_aT3_6p.py <json_file>")
+        sys.exit(1)
+
+    json_file = sys.argv[1]
+    main(json_file)
@@ -0,0 +1,271 @@
+import json
+import os
+import sys
+import numpy as np
+from pose_store import convert_units, open_store, read_meta, store_scale
+from transforms import quaternion_conjugate, quaternion_multiply, quaternion_to_rotvec
+
+# Plan of the 16w repeatability runs: the robot alternates between two targets 500 mm apart
+DEFAULT_PLAN = {"sequence": ["A", "B"], "distances": {"A-B": 500.0}}
+
+
+def load_plan(plan_file):
+    """
+    Task plan JSON:
+      "sequence":  commanded targets in cycle order, used to label readings
+                   that do not carry a "target" themselves
+      "targets":   optional {target: [x, y, z, ...]} commanded poses
+      "distances": optional {"A-B": planned distance}, overriding the target poses
+    """
+    with open(plan_file, 'r') as file:
+        return json.load(file)
+
+
+def planned_distance(plan, a, b):
+    """Planned distance between two targets; NaN when the plan does not give one."""
+    distances = plan.get("distances", {})
+    for key in (f"{a}-{b}", f"{b}-{a}"):
+        if key in distances:
+            return float(distances[key])
+    targets = plan.get("targets", {})
+    if a in targets and b in targets:
+        return float(np.linalg.norm(np.subtract(targets[a][:3], targets[b][:3])))
+    return np.nan
+
+
+def sequence_targets(plan, start, count):
+    """Targets of readings start .. start + count when readings follow the plan sequence cyclically."""
+    sequence = np.asarray(plan["sequence"], dtype=str)
+    return sequence[np.arange(start, start + count) % len(sequence)]
+
+
+class _Moments:
+    """Per-key count, mean and sum of squared deviations, merged chunk by chunk (Welford/Chan)."""
+
+    def __init__(self, dim):
+        self.count = np.zeros(0)
+        self.mean = np.zeros((0, dim))
+        self.m2 = np.zeros((0, dim))
+
+    def _grow(self, size):
+        extra = size - len(self.count)
+        if extra > 0:
+            self.count = np.concatenate((self.count, np.zeros(extra)))
+            self.mean = np.concatenate((self.mean, np.zeros((extra, self.mean.shape[1]))))
+            self.m2 = np.concatenate((self.m2, np.zeros((extra, self.m2.shape[1]))))
+
+    def update(self, index, values):
+        """index: (m,) key of each row, values: (m, dim)."""
+        if len(index) == 0:
+            return
+        self._grow(index.max() + 1)
+        size = len(self.count)
+        n_b = np.bincount(index, minlength=size).astype(float)
+        sum_b = np.stack([np.bincount(index, values[:, d], minlength=size) for d in range(values.shape[1])], axis=1)
+        mean_b = sum_b / np.maximum(n_b, 1)[:, None]
+        dev = values - mean_b[index]
+        m2_b = np.stack([np.bincount(index, dev[:, d] ** 2, minlength=size) for d in range(values.shape[1])], axis=1)
+
+        n = self.count + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * (n_b / np.maximum(n, 1))[:, None]
+        self.m2 += m2_b + delta ** 2 * (self.count * n_b / np.maximum(n, 1))[:, None]
+        self.count = n
+
+    def std(self):
+        """Sample standard deviation (n - 1), NaN below two samples."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(self.m2 / (self.count - 1)[:, None])
+
+
+class RepeatabilityEngine:
+    """
+    ISO 9283-style pose repeatability and distance accuracy over any number of cycles.
+
+    Readings are fed once, in chunks, to accumulate(); every statistic is a
+    Welford/Chan moment merged chunk by chunk:
+      positions:    barycentre and the sum of squared distances l_j^2 to it
+      l_j:          mean distance to the barycentre merged so far (exact while a
+                    target's readings fit in one chunk); l_std follows from it and
+                    the exact sum of squares
+      orientations: deviation angles from the target's first recorded orientation,
+                    whose spread equals that about the mean orientation to first order
+      legs:         distance between consecutive readings, carried across chunks
+    Memory depends on the number of targets and legs, not on the number of cycles.
+    """
+
+    def __init__(self, plan=None):
+        self.plan = plan or DEFAULT_PLAN
+        self.targets = []
+        self.index = {}
+        for target in list(self.plan.get("targets", {})) + list(self.plan.get("sequence", [])):
+            self._target_index(target)
+        self.legs = []
+        self.leg_index = {}
+
+        self.position = _Moments(3)
+        self.deviation = _Moments(1)
+        self.angles = _Moments(3)
+        self.reference = np.full((len(self.targets), 4), np.nan)
+        self.leg_distance = _Moments(1)
+        self._last = None
+
+    def _target_index(self, target):
+        if target not in self.index:
+            self.index[target] = len(self.targets)
+            self.targets.append(target)
+        return self.index[target]
+
+    def _indices(self, targets):
+        labels, inverse = np.unique(np.asarray(targets, dtype=str), return_inverse=True)
+        return np.array([self._target_index(label) for label in labels.tolist()], dtype=np.intp)[inverse.ravel()]
+
+    def accumulate(self, targets, position, quaternion=None):
+        """One chunk: (m,) target labels, (m, 3) positions, optional (m, 4) quaternions."""
+        index = self._indices(targets)
+        position = np.asarray(position, dtype=float).reshape(-1, 3)
+        self.position.update(index, position)
+        l = np.linalg.norm(position - self.position.mean[index], axis=1)
+        self.deviation.update(index, l[:, None])
+
+        if quaternion is not None:
+            self._accumulate_orientation(index, np.asarray(quaternion, dtype=float).reshape(-1, 4))
+
+        # Legs between consecutive readings, carried across chunk boundaries
+        if self._last is not None:
+            prev_index = np.concatenate(([self._last[0]], index[:-1]))
+            prev_position = np.concatenate((self._last[1][None], position[:-1]))
+        else:
+            prev_index, prev_position = index[:-1], position[:-1]
+        cur_index, cur_position = index[len(index) - len(prev_index):], position[len(index) - len(prev_index):]
+        self._last = (index[-1], position[-1])
+
+        moved = prev_index != cur_index
+        if moved.any():
+            a, b = prev_index[moved], cur_index[moved]
+            codes, inverse = np.unique(a * len(self.targets) + b, return_inverse=True)
+            legs = []
+            for code in codes.tolist():
+                leg = (self.targets[code // len(self.targets)], self.targets[code % len(self.targets)])
+                if leg not in self.leg_index:
+                    self.leg_index[leg] = len(self.legs)
+                    self.legs.append(leg)
+                legs.append(self.leg_index[leg])
+            distances = np.linalg.norm(cur_position[moved] - prev_position[moved], axis=1)
+            self.leg_distance.update(np.array(legs, dtype=np.intp)[inverse.ravel()], distances[:, None])
+
+    def _accumulate_orientation(self, index, quaternion):
+        valid = ~np.isnan(quaternion).any(axis=1)
+        if not valid.any():
+            return
+        index = index[valid]
+        q = quaternion[valid] / np.linalg.norm(quaternion[valid], axis=1, keepdims=True)
+        if len(self.reference) < len(self.targets):
+            self.reference = np.concatenate((self.reference, np.full((len(self.targets) - len(self.reference), 4), np.nan)))
+
+        # The first orientation seen of each target is its reference frame
+        new = np.isnan(self.reference[index, 0])
+        first = np.unique(index[new], return_index=True)
+        self.reference[first[0]] = q[new][first[1]]
+
+        # Small rotation from the reference, as angles about the reference frame's axes
+        delta = quaternion_multiply(quaternion_conjugate(self.reference[index]), q)
+        self.angles.update(index, np.degrees(quaternion_to_rotvec(delta)))
+
+    def barycentres(self):
+        return self.position.mean
+
+    def results(self):
+        """
+        Per target: barycentre, l_mean, l_std, RP = l_mean + 3 l_std and
+        RPa/RPb/RPc = 3 std of the orientation deviations (degrees).
+        Per leg: planned distance, AD = mean distance - planned and RD = 3 std.
+        """
+        # sum_j l_j^2 is the trace of the position scatter about the barycentre
+        count = self.position.count
+        l_mean = self.deviation.mean[:, 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            l_std = np.sqrt(np.maximum(self.position.m2.sum(axis=1) - count * l_mean ** 2, 0) / (count - 1))
+        angle_std = self.angles.std() if len(self.angles.count) else np.zeros((0, 3))
+        targets = []
+        for k, target in enumerate(self.targets):
+            if k >= len(count) or not count[k]:
+                continue
+            result = {"target": target, "count": int(count[k]),
+                      "barycentre": self.position.mean[k],
+                      "l_mean": l_mean[k], "l_std": l_std[k],
+                      "RP": l_mean[k] + 3 * l_std[k]}
+            if k < len(angle_std) and self.angles.count[k]:
+                result.update(RPa=3 * angle_std[k, 0], RPb=3 * angle_std[k, 1], RPc=3 * angle_std[k, 2])
+            targets.append(result)
+
+        leg_std = self.leg_distance.std()[:, 0]
+        legs = []
+        for k, (a, b) in enumerate(self.legs):
+            planned = planned_distance(self.plan, a, b)
+            legs.append({"from": a, "to": b, "count": int(self.leg_distance.count[k]), "planned": planned,
+                         "mean": self.leg_distance.mean[k, 0],
+                         "AD": self.leg_distance.mean[k, 0] - planned, "RD": 3 * leg_std[k]})
+        return {"targets": targets, "legs": legs}
+
+
+def iter_session_chunks(path, plan, unit=None, table="tracker_points", chunk_size=1 << 16):
+    """
+    (targets, position, quaternion) chunks of one session, in the unit of its
+    source unless unit asks for another (as in pose_store.load_data).
+
+    A pose store is read slice by slice from its memory-mapped columns; a JSON
+    session is loaded whole. Readings carry their own "target" when present,
+    otherwise they are labelled by cycling through the plan sequence.
+    """
+    if os.path.isdir(path):
+        columns = open_store(path)[table]
+        scale = store_scale(read_meta(path), unit)
+        n = len(columns["name"])
+        for start in range(0, n, chunk_size):
+            stop = min(start + chunk_size, n)
+            yield (sequence_targets(plan, start, stop - start), columns["position"][start:stop] * scale,
+                   columns["quaternion"][start:stop])
+        return
+
+    with open(path, 'r') as file:
+        data = json.load(file)
+    entries = (convert_units(data, unit) if unit else data)[table]
+    for start in range(0, len(entries), chunk_size):
+        chunk = entries[start:start + chunk_size]
+        poses = [entry["pose"] for entry in chunk]
+        if all("target" in entry for entry in chunk):
+            targets = [entry["target"] for entry in chunk]
+        else:
+            targets = sequence_targets(plan, start, len(chunk))
+        position = np.array([pose[:3] for pose in poses], dtype=float)
+        quaternion = np.array([pose[3:7] if len(pose) >= 7 else [np.nan] * 4 for pose in poses], dtype=float)
+        yield targets, position, quaternion
+
+
+def evaluate_stream(chunks, plan=None):
+    """Results of one pass over an iterable of (targets, position, quaternion) chunks."""
+    engine = RepeatabilityEngine(plan)
+    for chunk in chunks:
+        engine.accumulate(*chunk)
+    return engine.results()
+
+
+def print_results(results, unit="mm"):
+    print(f"{'Target':<8} {'n':>8} {'l_mean':>10} {'l_std':>10} {'RP':>10} {'RPa':>8} {'RPb':>8} {'RPc':>8}  [{unit}, deg]")
+    for r in results["targets"]:
+        angles = " ".join(f"{r[key]:>8.4f}" if key in r else f"{'-':>8}" for key in ("RPa", "RPb", "RPc"))
+        print(f"{r['target']:<8} {r['count']:>8} {r['l_mean']:>10.5f} {r['l_std']:>10.5f} {r['RP']:>10.5f} {angles}")
+    print(f"\n{'Leg':<12} {'n':>8} {'planned':>10} {'mean':>12} {'AD':>10} {'RD':>10}  [{unit}]")
+    for r in results["legs"]:
+        print(f"{r['from'] + '-' + r['to']:<12} {r['count']:>8} {r['planned']:>10.3f} {r['mean']:>12.5f} {r['AD']:>10.5f} {r['RD']:>10.5f}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python repeatability.py <json_file|store_dir> [plan.json]")
+        sys.exit(1)
+
+    plan = load_plan(sys.argv[2]) if len(sys.argv) == 3 else DEFAULT_PLAN
+    results = evaluate_stream(iter_session_chunks(sys.argv[1], plan), plan)
+    print_results(results)
@@ -0,0 +1,258 @@
+import html
+import io
+import os
+import sys
+import time
+from multiprocessing import Pool
+import numpy as np
+
+# PNG is rasterized only when asked for; the SVG is rendered once for .svg and .html
+FORMATS = ("svg", "html")
+
+# Up to this many pairs the per-pair bar chart is still readable
+MAX_BARS = 30
+
+
+def summarize(errors, labels=None, bins=50, points=512):
+    """
+    Compact, plot-ready summary of per-pair errors {method: (P,)}.
+
+    However many pairs there are, the summary holds a shared-edge histogram,
+    the CDF at points quantile levels, box-plot statistics and a stats table
+    per method; the raw per-pair errors are only kept (for bars) up to
+    MAX_BARS pairs.
+    """
+    errors = {method: np.abs(np.asarray(values, dtype=float)) for method, values in errors.items()}
+    highest = max((values.max() for values in errors.values() if len(values)), default=1.0) or 1.0
+    edges = np.linspace(0.0, highest, bins + 1)
+    levels = np.linspace(0.0, 1.0, points)
+    count = max((len(values) for values in errors.values()), default=0)
+
+    methods = {}
+    for method, values in errors.items():
+        if not len(values):
+            continue
+        q1, median, q3, p95 = np.quantile(values, [0.25, 0.5, 0.75, 0.95])
+        iqr = q3 - q1
+        methods[method] = {
+            "hist": np.histogram(values, edges)[0],
+            "cdf": np.quantile(values, levels),
+            "box": {"label": method, "med": median, "q1": q1, "q3": q3, "mean": values.mean(), "fliers": [],
+                    "whislo": values[values >= q1 - 1.5 * iqr].min(), "whishi": values[values <= q3 + 1.5 * iqr].max()},
+            "stats": {"count": len(values), "mean": values.mean(), "std": values.std(),
+                      "rms": np.sqrt(np.mean(values ** 2)), "p95": p95, "max": values.max()},
+            "bars": values if count <= MAX_BARS else None,
+        }
+    return {"edges": edges, "levels": levels, "methods": methods,
+            "labels": list(labels) if labels is not None and count <= MAX_BARS else None}
+
+
+def _pyplot():
+    """matplotlib.pyplot on the Agg backend, selected before pyplot is first imported."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def _figure(summary, title, unit):
+    """Histogram, CDF and box plots (plus per-pair bars for few pairs) on the Agg backend."""
+    plt = _pyplot()
+    methods = summary["methods"]
+    bars = summary["labels"] is not None
+    fig, axes = plt.subplots(2, 2, figsize=(12, 8))
+    axes = axes.ravel()
+    if not bars:
+        axes[3].remove()
+    ax_hist, ax_cdf, ax_box = axes[:3]
+
+    edges = summary["edges"]
+    for method, m in methods.items():
+        ax_hist.stairs(m["hist"], edges, label=method)
+        ax_cdf.plot(m["cdf"], summary["levels"], label=method)
+    ax_hist.set_xlabel(f"Error [{unit}]")
+    ax_hist.set_ylabel("Pairs")
+    ax_hist.set_title("Histogram")
+    ax_hist.legend(fontsize="small")
+    ax_cdf.set_xlabel(f"Error [{unit}]")
+    ax_cdf.set_ylabel("Fraction of pairs")
+    ax_cdf.set_title("CDF")
+    ax_cdf.grid(True, alpha=0.3)
+
+    ax_box.bxp([m["box"] for m in methods.values()], showmeans=True, showfliers=False)
+    ax_box.set_xticks(range(1, len(methods) + 1), [f"M{k + 1}" for k in range(len(methods))])
+    ax_box.set_ylabel(f"Error [{unit}]")
+    ax_box.set_title("Per method (" + ", ".join(f"M{k + 1}: {method}" for k, method in enumerate(methods)) + ")",
+                     fontsize="small")
+
+    if bars:
+        # The former interactive chart: one group of bars per pair
+        ax_bar = axes[3]
+        x = np.arange(len(summary["labels"]))
+        width = 0.8 / max(len(methods), 1)
+        for k, (method, m) in enumerate(methods.items()):
+            ax_bar.bar(x + (k - (len(methods) - 1) / 2) * width, m["bars"], width, label=method)
+        ax_bar.set_xlabel("Point pairs")
+        ax_bar.set_ylabel(f"Error [{unit}]")
+        ax_bar.set_title("Comparison of Errors Across Methods")
+        ax_bar.set_xticks(x, summary["labels"], rotation=90 if len(x) > 10 else 0)
+
+    fig.suptitle(title)
+    fig.tight_layout()
+    return fig
+
+
+def _html(summary, title, unit, svg):
+    rows = "".join(
+        f"<tr><td>{html.escape(method)}</td>" + "".join(
+            f"<td>{m['stats'][key]:.6g}</td>" for key in ("count", "mean", "std", "rms", "p95", "max")) + "</tr>"
+        for method, m in summary["methods"].items())
+    return (f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title>"
+            "<style>body{font-family:sans-serif}table{border-collapse:collapse}"
+            "td,th{border:1px solid #ccc;padding:4px 8px;text-align:right}td:first-child{text-align:left}</style>"
+            f"</head><body><h1>{html.escape(title)}</h1>"
+            f"<table><tr><th>Method</th><th>Pairs</th><th>Mean [{unit}]</th><th>Std</th><th>RMS</th><th>P95</th>"
+            f"<th>Max</th></tr>{rows}</table>\n{svg}\n</body></html>\n")
+
+
+def render_report(summary, prefix, title="Distance errors", unit="m", formats=FORMATS):
+    """
+    Write <prefix>.png / .svg / .html from a summary; returns the written paths,
+    none when no method has any pairs.
+    """
+    if not summary["methods"]:
+        return []
+    plt = _pyplot()
+    fig = _figure(summary, title, unit)
+    paths = []
+    try:
+        if "png" in formats:
+            fig.savefig(prefix + ".png", dpi=100)
+            paths.append(prefix + ".png")
+        if "svg" in formats or "html" in formats:
+            buffer = io.StringIO()
+            fig.savefig(buffer, format="svg")
+            svg = buffer.getvalue()
+            if "svg" in formats:
+                with open(prefix + ".svg", 'w') as file:
+                    file.write(svg)
+                paths.append(prefix + ".svg")
+            if "html" in formats:
+                # Inline SVG, without its XML prolog, keeps the page a single file
+                with open(prefix + ".html", 'w') as file:
+                    file.write(_html(summary, title, unit, svg[svg.index("<svg"):]))
+                paths.append(prefix + ".html")
+    finally:
+        plt.close(fig)
+    return paths
+
+
+def session_errors(session):
+    """
+    Per-pair distance errors of one session file or store: (labels, {method: errors}),
+    or None for files that are not sessions (e.g. aT3_results.json).
+
+    Calibration sessions with wrist3/sensor poses are evaluated as in
+    evaluate_precision_by_distance (aT3 from the calibration cache), any other
+    session as tracker points against every other pose list.
+    """
+    from distance_errors import pairwise_errors
+    from pose_store import StoreTable, load_data
+    from pose_set import PoseSet
+
+    data = load_data(session)
+    if not isinstance(data, dict) or "tracker_points" not in data:
+        return None
+    if "link_transforms" in data and "wrist3_Link_poses" in data and "sensor_poses" in data:
+        from calibration_cache import calibrate
+        from evaluate_precision_by_distance import method_points
+        aT3 = np.array([aT3 for aT3, _ in calibrate(data["tracker_points"], data["link_transforms"])])
+        names, reference, methods = method_points(data, aT3)
+    else:
+        tracker = PoseSet.from_entries(data["tracker_points"])
+        others = {key: PoseSet.from_entries(value) for key, value in data.items()
+                  if key != "tracker_points" and isinstance(value, (list, StoreTable)) and value and "pose" in value[0]}
+        names = tracker.common_names(*others.values())
+        reference = tracker.positions(names)
+        methods = {key: poses.positions(names) for key, poses in others.items()}
+    if not methods:
+        return None
+
+    i, j, errors = pairwise_errors(reference, methods)
+    labels = [f"{names[a]}-{names[b]}" for a, b in zip(i, j)] if len(i) <= MAX_BARS else None
+    return labels, errors
+
+
+def _render_session(job):
+    """Worker: one session -> (session, written paths, seconds, error)."""
+    session, prefix, formats = job
+    start = time.perf_counter()
+    try:
+        loaded = session_errors(session)
+        if loaded is None:
+            return session, [], time.perf_counter() - start, None
+        labels, errors = loaded
+        paths = render_report(summarize(errors, labels), prefix, os.path.basename(session.rstrip(os.sep)),
+                              formats=formats)
+        return session, paths, time.perf_counter() - start, None
+    except Exception as e:
+        return session, [], time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def report_names(sessions):
+    """
+    Unique report names: each session's path relative to the sessions' common
+    folder, with separators as "__", so data.json of two runs does not clash.
+    """
+    paths = [os.path.abspath(session.rstrip(os.sep)) for session in sessions]
+    root = os.path.commonpath([os.path.dirname(path) for path in paths]) if paths else ""
+    names, seen = [], {}
+    for path in paths:
+        name = os.path.splitext(os.path.relpath(path, root))[0].replace(os.sep, "__") + "_report"
+        # data.json next to a data/ store still shares a name
+        seen[name] = seen.get(name, 0) + 1
+        names.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+    return names
+
+
+def render_reports(sessions, out_dir, formats=FORMATS, processes=None):
+    """
+    Render the reports of many sessions in worker processes, one session per
+    task; yields (session, paths, seconds, error) in completion order.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(session, os.path.join(out_dir, name), tuple(formats))
+            for session, name in zip(sessions, report_names(sessions))]
+    if len(jobs) == 1 or processes == 1:
+        yield from map(_render_session, jobs)
+        return
+    with Pool(processes) as pool:
+        yield from pool.imap_unordered(_render_session, jobs)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {"--formats": ",".join(FORMATS), "--processes": None}
+    for flag in list(options):
+        if flag in args:
+            idx = args.index(flag)
+            options[flag] = args[idx + 1]
+            del args[idx:idx + 2]
+    if len(args) < 2:
+        print("Usage: python report.py <out_dir> <session|sessions_dir> [...] [--formats svg,html,png] [--processes N]")
+        sys.exit(1)
+
+    from batch_sweep import find_sessions
+    sessions = [s for path in args[1:] for s in (find_sessions(path) if os.path.isdir(path) and
+                                                 not os.path.exists(os.path.join(path, "meta.json")) else [path])]
+    processes = int(options["--processes"]) if options["--processes"] else None
+    failed = 0
+    for session, paths, seconds, error in render_reports(sessions, args[0], options["--formats"].split(","), processes):
+        if error:
+            failed += 1
+            print(f"{session}: {error}")
+        elif not paths:
+            print(f"{session}: no session errors to report, skipped")
+        else:
+            print(f"{session}: {', '.join(paths)} ({seconds:.2f} s)")
+    sys.exit(1 if failed else 0)
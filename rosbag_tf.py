@@ -0,0 +1,354 @@
+import os
+import re
+import sqlite3
+import struct
+import sys
+import time
+import numpy as np
+from association import interpolate_poses
+from tf_recorder import RECORD_DTYPE, write_header
+from transforms import compose, invert, make_transforms, rotation_matrix_to_quaternion
+
+TF_TOPICS = ("/tf", "/tf_static")
+TF_TYPE = "tf2_msgs/msg/TFMessage"
+
+# CDR encapsulation identifiers (big / little endian plain CDR)
+CDR_BE = b"\x00\x00\x00\x00"
+CDR_LE = b"\x00\x01\x00\x00"
+
+
+def _align(pos, n):
+    # CDR aligns relative to the end of the 4-byte encapsulation header
+    return pos + (-(pos - 4)) % n
+
+
+def encode_tf_message(transforms):
+    """
+    CDR (little endian) tf2_msgs/TFMessage from [(parent, child, sec, nanosec,
+    translation (3,), rotation (4,) scalar-last)], as rosbag2 stores it.
+    """
+    out = bytearray(CDR_LE)
+    out += struct.pack("<I", len(transforms))
+    for parent, child, sec, nanosec, translation, rotation in transforms:
+        out += b"\x00" * (_align(len(out), 4) - len(out))
+        out += struct.pack("<iI", sec, nanosec)
+        for name in (parent, child):
+            out += b"\x00" * (_align(len(out), 4) - len(out))
+            encoded = name.encode() + b"\x00"
+            out += struct.pack("<I", len(encoded)) + encoded
+        out += b"\x00" * (_align(len(out), 8) - len(out))
+        out += struct.pack("<7d", *translation, *rotation)
+    return bytes(out)
+
+
+def message_layout(data):
+    """
+    Walk one CDR TFMessage: (endian, [(parent, child, stamp offset, values offset)]).
+
+    The 8 stamp bytes (int32 sec, uint32 nanosec) and 56 value bytes (7 float64:
+    translation, then rotation x, y, z, w) of each transform sit at the offsets.
+    """
+    if data[:2] == CDR_LE[:2]:
+        endian = "<"
+    elif data[:2] == CDR_BE[:2]:
+        endian = ">"
+    else:
+        raise ValueError(f"unsupported encapsulation {data[:4].hex()}")
+
+    count = struct.unpack_from(endian + "I", data, 4)[0]
+    pos = 8
+    layout = []
+    for _ in range(count):
+        pos = _align(pos, 4)
+        stamp = pos
+        pos += 8
+        names = []
+        for _ in range(2):
+            pos = _align(pos, 4)
+            size = struct.unpack_from(endian + "I", data, pos)[0]
+            names.append(bytes(data[pos + 4:pos + 4 + size]).rstrip(b"\x00").decode())
+            pos += 4 + size
+        pos = _align(pos, 8)
+        layout.append((names[0], names[1], stamp, pos))
+        pos += 56
+    return endian, layout
+
+
+def decode_tf_message(data):
+    """One CDR TFMessage -> [(parent, child, stamp seconds, translation, rotation)], for single messages."""
+    endian, layout = message_layout(data)
+    decoded = []
+    for parent, child, stamp, values in layout:
+        sec, nanosec = struct.unpack_from(endian + "iI", data, stamp)
+        v = struct.unpack_from(endian + "7d", data, values)
+        decoded.append((parent, child, sec + nanosec * 1e-9, np.array(v[:3]), np.array(v[3:])))
+    return decoded
+
+
+def _columns(buf, offset, size, dtype):
+    """(m, size) byte columns of a (m, L) uint8 batch reinterpreted as dtype."""
+    return np.ascontiguousarray(buf[:, offset:offset + size]).view(dtype)
+
+
+def decode_batch(blobs):
+    """
+    Decode many CDR TFMessages at once.
+
+    Messages of one publisher repeat the same frame names, so they share one
+    byte layout and differ only in stamps and values. The batch is grouped by
+    message length into (m, L) byte arrays; the first unmatched row of a group
+    is walked with struct as a template, every row whose remaining bytes equal
+    the template's is decoded by slicing columns, and the rest goes round again.
+
+    Returns [(parent, child, rows (k,), stamps (k,), values (k, 7))], rows
+    indexing blobs.
+    """
+    lengths = np.fromiter(map(len, blobs), dtype=np.int64, count=len(blobs))
+    out = []
+    for length in np.unique(lengths):
+        group = np.flatnonzero(lengths == length)
+        buf = np.frombuffer(b"".join([blobs[k] for k in group]), dtype=np.uint8).reshape(len(group), length)
+        pending = np.arange(len(group))
+        while len(pending):
+            template = buf[pending[0]]
+            endian, layout = message_layout(template.tobytes())
+            fixed = np.ones(length, dtype=bool)
+            for _, _, stamp, values in layout:
+                fixed[stamp:stamp + 8] = False
+                fixed[values:values + 56] = False
+            match = (buf[np.ix_(pending, fixed)] == template[fixed]).all(axis=1)
+            rows = pending[match]
+            pending = pending[~match]
+
+            block = buf[rows]
+            for parent, child, stamp, values in layout:
+                sec = _columns(block, stamp, 4, endian + "i4")[:, 0]
+                nanosec = _columns(block, stamp + 4, 4, endian + "u4")[:, 0]
+                out.append((parent, child, group[rows], sec + nanosec * 1e-9,
+                            _columns(block, values, 56, endian + "f8")))
+    return out
+
+
+def bag_files(path):
+    """The .db3 files of a bag directory in split order, or the file itself."""
+    if not os.path.isdir(path):
+        return [path]
+    files = [name for name in os.listdir(path) if name.endswith(".db3")]
+    split = lambda name: [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+    return [os.path.join(path, name) for name in sorted(files, key=split)]
+
+
+def read_tf(bag, batch=1 << 14, bag_stamps=False):
+    """
+    All /tf and /tf_static transforms of a rosbag2 sqlite bag, bulk-selected and batch-decoded.
+
+    Returns (dynamic, static): dynamic maps (parent, child) to (stamps, translation,
+    rotation) arrays sorted by stamp; static maps (parent, child) to the last
+    (translation, rotation). Stamps are the transforms' header stamps, or the
+    bag's receive timestamps with bag_stamps, in seconds.
+    """
+    parts = {}
+    static = {}
+    for path in bag_files(bag):
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            connection.execute("PRAGMA mmap_size=268435456")
+            topics = {topic_id: name for topic_id, name, kind, serialization in connection.execute(
+                "SELECT id, name, type, serialization_format FROM topics")
+                if name in TF_TOPICS and kind == TF_TYPE and serialization == "cdr"}
+            if not topics:
+                continue
+            cursor = connection.execute(
+                f"SELECT topic_id, timestamp, data FROM messages WHERE topic_id IN ({','.join('?' * len(topics))})",
+                list(topics))
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    break
+                topic_ids, received, blobs = zip(*rows)
+                topic_ids = np.array(topic_ids)
+                received = np.array(received, dtype=np.int64) * 1e-9 if bag_stamps else None
+                for topic_id, name in topics.items():
+                    selected = np.flatnonzero(topic_ids == topic_id)
+                    if not len(selected):
+                        continue
+                    for parent, child, index, stamps, values in decode_batch([blobs[k] for k in selected]):
+                        if name == "/tf_static":
+                            static[(parent, child)] = (values[-1, :3].copy(), values[-1, 3:].copy())
+                        else:
+                            parts.setdefault((parent, child), []).append(
+                                (received[selected[index]] if bag_stamps else stamps, values))
+        finally:
+            connection.close()
+
+    dynamic = {}
+    for edge, chunks in parts.items():
+        stamps = np.concatenate([s for s, _ in chunks])
+        values = np.concatenate([v for _, v in chunks])
+        order = np.argsort(stamps, kind='stable')
+        dynamic[edge] = (stamps[order], values[order, :3], values[order, 3:])
+    return dynamic, static
+
+
+def _path_to_root(parents, frame):
+    path = [frame]
+    while path[-1] in parents:
+        path.append(parents[path[-1]])
+        if len(path) > len(parents) + 1:
+            raise ValueError(f"TF cycle through {frame}")
+    return path
+
+
+def frame_chain(edges, target, source):
+    """
+    Edges from target down to source through their common ancestor:
+    ([(parent, child) going up from target], [(parent, child) going down to source]).
+    """
+    parents = {child: parent for parent, child in edges}
+    up = _path_to_root(parents, target)
+    down = _path_to_root(parents, source)
+    common = next((frame for frame in up if frame in set(down)), None)
+    if common is None:
+        raise LookupError(f"{target} and {source} are not connected")
+    up = up[:up.index(common) + 1]
+    down = down[:down.index(common) + 1]
+    return ([(up[k + 1], up[k]) for k in range(len(up) - 1)],
+            [(down[k + 1], down[k]) for k in range(len(down) - 1)][::-1])
+
+
+def lookup_stream(dynamic, static, target, source, max_gap=np.inf):
+    """
+    (stamps, translation, rotation) of source in target over the bag.
+
+    Samples come at the stamps of the busiest dynamic edge of the chain; the
+    other dynamic edges are interpolated there (linear / SLERP, no sample
+    where a neighbour gap exceeds max_gap) and static edges are constant. An
+    all-static chain gives one sample stamped 0.
+    """
+    up, down = frame_chain(list(dynamic) + list(static), target, source)
+    chain = [e for e in up + down if e in dynamic]
+    stamps = max((dynamic[e][0] for e in chain), key=len) if chain else np.zeros(1)
+    valid = np.ones(len(stamps), dtype=bool)
+
+    def edge_transforms(edge):
+        nonlocal valid
+        if edge in dynamic:
+            edge_stamps, translation, rotation = dynamic[edge]
+            translation, rotation, ok = interpolate_poses(edge_stamps, translation, rotation, stamps, max_gap)
+            valid &= ok
+            return make_transforms(translation, rotation)
+        return make_transforms(*static[edge])
+
+    # T_common_target, T_common_source as products down each branch
+    T_up = np.eye(4)
+    for edge in up[::-1]:
+        T_up = compose(T_up, edge_transforms(edge))
+    T_down = np.eye(4)
+    for edge in down:
+        T_down = compose(T_down, edge_transforms(edge))
+    T = np.broadcast_to(compose(invert(T_up), T_down), (len(stamps), 4, 4))[valid]
+    return stamps[valid], T[:, :3, 3], rotation_matrix_to_quaternion(T[:, :3, :3])
+
+
+def write_recording(path, streams):
+    """Write {(target, source): (stamps, translation, rotation)} as a TfRecorder file, merged by stamp."""
+    frame_pairs = [list(pair) for pair in streams]
+    records = np.zeros(sum(len(s[0]) for s in streams.values()), dtype=RECORD_DTYPE)
+    start = 0
+    for idx, (stamps, translation, rotation) in enumerate(streams.values()):
+        rows = slice(start, start + len(stamps))
+        records["stamp"][rows], records["pair"][rows] = stamps, idx
+        records["translation"][rows], records["rotation"][rows] = translation, rotation
+        start += len(stamps)
+    records = records[np.argsort(records["stamp"], kind='stable')]
+    with open(path, 'wb') as file:
+        write_header(file, frame_pairs)
+        file.write(records.tobytes())
+
+
+def write_bag(path, messages):
+    """
+    A minimal rosbag2 sqlite3 file from [(topic, receive time ns, [transforms])],
+    transforms as for encode_tf_message; for tests and benchmarks without ROS.
+    """
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.executescript("""
+            CREATE TABLE schema(schema_version INTEGER PRIMARY KEY, ros_distro TEXT NOT NULL);
+            CREATE TABLE metadata(id INTEGER PRIMARY KEY, metadata_version INTEGER NOT NULL, metadata TEXT NOT NULL);
+            CREATE TABLE topics(id INTEGER PRIMARY KEY, name TEXT NOT NULL, type TEXT NOT NULL,
+                                serialization_format TEXT NOT NULL, offered_qos_profiles TEXT NOT NULL);
+            CREATE TABLE messages(id INTEGER PRIMARY KEY, topic_id INTEGER NOT NULL, timestamp INTEGER NOT NULL,
+                                  data BLOB NOT NULL);
+            CREATE INDEX timestamp_idx ON messages (timestamp ASC);
+        """)
+        connection.execute("INSERT INTO schema VALUES (3, 'humble')")
+        topic_ids = {topic: k + 1 for k, topic in enumerate(sorted({m[0] for m in messages}))}
+        connection.executemany("INSERT INTO topics VALUES (?, ?, ?, 'cdr', '')",
+                               [(k, topic, TF_TYPE) for topic, k in topic_ids.items()])
+        connection.executemany("INSERT INTO messages (topic_id, timestamp, data) VALUES (?, ?, ?)",
+                               ((topic_ids[topic], stamp, encode_tf_message(transforms))
+                                for topic, stamp, transforms in messages))
+    connection.close()
+
+
+def synthetic_messages(count, rate=1000.0, seed=0):
+    """
+    /tf traffic of a robot and a tracker: static world -> base_link and
+    world -> tracker, dynamic base_link -> wrist3_Link and tracker -> marker
+    (the marker rigidly on the flange), alternating at rate.
+    """
+    rng = np.random.default_rng(seed)
+    identity = ([0.0, 0.0, 0.0], [0.0, 0.0, 0.0, 1.0])
+    tracker = ([2.0, 0.5, 0.0], [0.0, 0.0, np.sin(0.4), np.cos(0.4)])
+    messages = [("/tf_static", 0, [("world", "base_link", 0, 0, *identity), ("world", "tracker", 0, 0, *tracker)])]
+    T_tracker = make_transforms(*tracker)
+    for k in range(count):
+        t = k / rate
+        angle = 0.2 * t
+        translation = [0.5 * np.cos(angle), 0.5 * np.sin(angle), 0.4 + 0.01 * rng.standard_normal()]
+        rotation = [0.0, 0.0, np.sin(angle / 2), np.cos(angle / 2)]
+        sec, nanosec = int(t), int(round((t - int(t)) * 1e9))
+        if k % 2 == 0:
+            messages.append(("/tf", int(t * 1e9), [("base_link", "wrist3_Link", sec, nanosec, translation, rotation)]))
+        else:
+            marker = compose(invert(T_tracker), make_transforms(translation, rotation))
+            messages.append(("/tf", int(t * 1e9), [("tracker", "marker", sec, nanosec, marker[:3, 3].tolist(),
+                                                    rotation_matrix_to_quaternion(marker[:3, :3]).tolist())]))
+    return messages
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) == 3 and args[0] == "--generate":
+        # python rosbag_tf.py --generate <bag.db3> <messages>
+        write_bag(args[1], synthetic_messages(int(args[2])))
+        sys.exit(0)
+
+    bag_stamps = "--bag-stamps" in args
+    args = [arg for arg in args if arg != "--bag-stamps"]
+    max_gap = np.inf
+    if "--max-gap" in args:
+        idx = args.index("--max-gap")
+        max_gap = float(args[idx + 1])
+        del args[idx:idx + 2]
+    if len(args) < 3 or any(":" not in pair for pair in args[2:]):
+        print("Usage: python rosbag_tf.py <bag.db3|bag_dir> <output_recording> <target:source> [...] "
+              "[--bag-stamps] [--max-gap seconds]\n"
+              "       python rosbag_tf.py --generate <bag.db3> <messages>")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    dynamic, static = read_tf(args[0], bag_stamps=bag_stamps)
+    read = time.perf_counter() - start
+    size = sum(os.path.getsize(path) for path in bag_files(args[0]))
+    print(f"{sum(len(s) for s, _, _ in dynamic.values())} transforms on {len(dynamic)} dynamic and {len(static)} "
+          f"static edges in {read:.2f} s ({size / 2**20 / max(read, 1e-9):.0f} MB/s)")
+
+    streams = {}
+    for pair in args[2:]:
+        target, source = pair.split(":", 1)
+        streams[(target, source)] = lookup_stream(dynamic, static, target, source, max_gap)
+        print(f"  {target} -> {source}: {len(streams[(target, source)][0])} samples")
+    write_recording(args[1], streams)
+    print(f"Recording written to {args[1]}")
@@ -1,66 +1,114 @@
 import os
 import numpy as np
+import instrumentation
 
-def solve_aT3_6p(Link3TEnds, marker_points):
+## solve aT3 = [r1, r2, r3, t1]     6^p = [p1, p2, p3]
+##             [r4, r5, r6, t2]
+##             [r7, r8, r9, t3]
+##             [0, 0, 0, 1]
+##  Formulate  Ax = b   A is 3n*15, x is 15*1, b is 3n*1 
+##    where x = [p1, p2, p3, r1, r2, r3, t1, r4, r5, r6, t2, r7, r8, r9, t3]^T
 
-    ## solve aT3 = [r1, r2, r3, t1]     6^p = [p1, p2, p3]
-    ##             [r4, r5, r6, t2]
-    ##             [r7, r8, r9, t3]
-    ##             [0, 0, 0, 1]
-    ##  Formulate  Ax = b   A is 3n*15, x is 15*1, b is 3n*1 
-    ##    where x = [p1, p2, p3, r1, r2, r3, t1, r4, r5, r6, t2, r7, r8, r9, t3]^T
 
-    assert len(marker_points) == len(Link3TEnds)
-    n = len(marker_points)
-    assert n >= 5
+def build_design_matrices(Link3TEnds, marker_points):
+    """
+    Build the stacked design matrices for a batch of groups.
 
-    A = np.zeros((3*n, 15))
-    b = np.zeros((3*n, 1))
+    Link3TEnds: (G, n, 3, 4) or (G, n, 4, 4) Link3->End transforms
+    marker_points: (G, n, 3) tracker points
+    Returns A (G, 3n, 15) and b (G, 3n, 1).
+    """
+    Link3TEnds = np.asarray(Link3TEnds, dtype=float)
+    marker_points = np.asarray(marker_points, dtype=float)[..., :3]
+    G, n = marker_points.shape[:2]
+    assert Link3TEnds.shape[:2] == (G, n)
 
-    for i in range(n):
-        marker_point = [x for x in marker_points[i]]
-        
-        Link3TEnd_i = Link3TEnds[i]
+    A = np.zeros((G, n, 3, 15))
+    A[..., :3] = Link3TEnds[:, :, :3, :3]                        # a1 .. a9, one row of 3T6 per equation
+    for k in range(3):
+        A[:, :, k, 3 + 4*k:6 + 4*k] = -marker_points             # -q1, -q2, -q3
+        A[:, :, k, 6 + 4*k] = -1
+    b = -Link3TEnds[:, :, :3, 3]                                 # -b1, -b2, -b3
 
-        ## [a1, a2, a3, b1]    
-        ## [a4, a5, a6, b2] 
-        ## [a7, a8, a9, b3] 
-        ## [0, 0, 0, 1] 
+    return A.reshape(G, 3*n, 15), b.reshape(G, 3*n, 1)
 
-        b[3*i, 0] = -Link3TEnd_i[0][3]        # -b1
-        b[3*i+1, 0] = -Link3TEnd_i[1][3]      # -b2
-        b[3*i+2, 0] = -Link3TEnd_i[2][3]      # -b3
-        
-        
-        A[3*i][:3] = [ Link3TEnd_i[0][0], Link3TEnd_i[0][1], Link3TEnd_i[0][2] ]             # a1  a2  a3
-        A[3*i][3:6] = [ -marker_point[0], -marker_point[1], -marker_point[2]]                # -q1, -q2, -q3
-        A[3*i][6] = -1 
 
+def lstsq_batch(A, b, rcond=None):
+    """
+    Least-squares solve of a stack of systems A[g] x[g] = b[g] via one batched SVD.
 
-        A[3*i + 1][:3] = [ Link3TEnd_i[1][0], Link3TEnd_i[1][1], Link3TEnd_i[1][2] ]         # a4  a5  a6
-        A[3*i + 1][7:10] = [ -marker_point[0], -marker_point[1], -marker_point[2]]           # -q1, -q2, -q3
-        A[3*i + 1][10] = -1 
+    Mirrors np.linalg.lstsq: singular values below rcond * s_max are treated as zero
+    (rcond=None uses eps * max(M, N)). Returns x, residuals, rank, s.
+    """
+    M, N = A.shape[-2:]
+    if rcond is None:
+        rcond = np.finfo(A.dtype).eps * max(M, N)
 
+    U, s, Vt = np.linalg.svd(A, full_matrices=False)
+    keep = s > rcond * s[..., :1]
+    s_inv = np.where(keep, 1.0 / np.where(keep, s, 1.0), 0.0)
 
-        A[3*i + 2][:3] =  [ Link3TEnd_i[2][0], Link3TEnd_i[2][1], Link3TEnd_i[2][2] ]         # a7  a8  a9
-        A[3*i + 2][11:14] = [ -marker_point[0], -marker_point[1], -marker_point[2]]           # -q1, -q2, -q3
-        A[3*i + 2][14] = -1
+    x = Vt.swapaxes(-1, -2) @ (s_inv[..., None] * (U.swapaxes(-1, -2) @ b))
+    residuals = np.sum((A @ x - b) ** 2, axis=-2)
+    rank = keep.sum(axis=-1)
 
-    
+    return x, residuals, rank, s
 
-    
-    x = np.linalg.lstsq(A, b, rcond=0)[0]
 
-    est_3Ta = np.array([x[3:7, 0],
-                        x[7:11, 0],
-                        x[11:, 0],
-                        [0, 0, 0, 1]])
-    
-    est_6p = np.array([x[:3, 0]])
+def unpack_solution(x):
+    """Turn (G, 15, 1) solutions into (G, 4, 4) aT3 and (G, 3) 6p."""
+    G = x.shape[0]
+    est_3Ta = np.zeros((G, 4, 4))
+    est_3Ta[:, :3, :] = x[:, 3:, 0].reshape(G, 3, 4)
+    est_3Ta[:, 3, 3] = 1
+
+    est_6p = x[:, :3, 0]
 
     return np.linalg.inv(est_3Ta), est_6p
 
 
+def solve_aT3_6p_batch(Link3TEnds, marker_points, rcond=None):
+    """
+    Solve every group in one call.
+
+    Link3TEnds: (G, n, 3, 4) stacked Link3->End transforms, n >= 5
+    marker_points: (G, n, 3) stacked tracker points
+    Returns (G, 4, 4) aT3 and (G, 3) 6p.
+    """
+    with instrumentation.stage("design_matrix"):
+        A, b = build_design_matrices(Link3TEnds, marker_points)
+    assert A.shape[1] >= 15
+
+    with instrumentation.stage("solve"):
+        x, residuals, rank, s = lstsq_batch(A, b, rcond)
+        result = unpack_solution(x)
+
+    if instrumentation.enabled():
+        G, n = A.shape[0], A.shape[1] // 3
+        instrumentation.count("groups_solved", G)
+        instrumentation.count("samples_solved", G * n)
+        instrumentation.record("rank", rank)
+        instrumentation.record("singular_values", s)
+        # Infinite for rank-deficient groups instead of a division by zero
+        instrumentation.record("condition_number",
+                               np.divide(s[:, 0], s[:, -1], out=np.full_like(s[:, 0], np.inf), where=s[:, -1] > 0))
+        # Per-sample residual: distance between the predicted and given Link3->End point
+        instrumentation.record("residuals", np.linalg.norm((A @ x - b).reshape(G, n, 3), axis=-1))
+
+    return result
+
+
+def solve_aT3_6p(Link3TEnds, marker_points):
+
+    assert len(marker_points) == len(Link3TEnds)
+    n = len(marker_points)
+    assert n >= 5
+
+    est_aT3, est_6p = solve_aT3_6p_batch(np.asarray(Link3TEnds)[None], np.asarray(marker_points)[None], rcond=0)
+
+    return est_aT3[0], est_6p[:1]
+
+
 
 if __name__ == '__main__':
 
@@ -71,4 +119,4 @@ if __name__ == '__main__':
     marker_points = []
 
 
-    est_aT3, est_6p = solve_aT3_6p(Link3TEnds, marker_points)
\ No newline at end of file
+    est_aT3, est_6p = solve_aT3_6p(Link3TEnds, marker_points)
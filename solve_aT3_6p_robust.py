@@ -0,0 +1,130 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from solve_aT3_6p import build_design_matrices, lstsq_batch, unpack_solution
+from pose_store import load_data
+from solve_aT3_6p_json_refactor import GROUPS
+from pose_set import PoseSet
+
+# 15 unknowns, 3 equations per sample
+MIN_SAMPLES = 5
+
+_A = None
+_b = None
+
+
+def _draw_subsets(rng, n, count):
+    """(count, 5) sample indices without repeats inside a row."""
+    subsets = rng.integers(0, n, size=(count, MIN_SAMPLES))
+    while True:
+        ordered = np.sort(subsets, axis=1)
+        repeated = (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+        if not repeated.any():
+            return subsets
+        subsets[repeated] = rng.integers(0, n, size=(repeated.sum(), MIN_SAMPLES))
+
+
+def sample_errors(A, b, X):
+    """
+    Per-sample residual norms of every hypothesis in one pass.
+
+    A: (3n, 15), b: (3n,), X: (H, 15) -> (H, n) point mismatch in the Link3 frame.
+    """
+    r = (A @ X.T).T - b
+    return np.sqrt(np.sum(r.reshape(len(X), -1, 3) ** 2, axis=2))
+
+
+def _score(errors, method, threshold):
+    """Higher is better: inlier count for RANSAC, minus the median squared error for LMedS."""
+    if method == "ransac":
+        inliers = errors < threshold
+        # Break ties between equal inlier counts by the inliers' squared error
+        return inliers.sum(axis=1) - np.sum(np.where(inliers, errors, 0) ** 2, axis=1) / (threshold ** 2 * errors.shape[1])
+    return -np.median(errors ** 2, axis=1)
+
+
+def _best_of_batch(A, b, subsets, method, threshold):
+    """Solve a batch of minimal subsets, score them against all samples, return the best."""
+    A3 = A.reshape(-1, 3, 15)
+    b3 = b.reshape(-1, 3)
+    X = lstsq_batch(A3[subsets].reshape(len(subsets), -1, 15), b3[subsets].reshape(len(subsets), -1, 1))[0][..., 0]
+    scores = _score(sample_errors(A, b, X), method, threshold)
+    best = np.argmax(scores)
+    return scores[best], X[best]
+
+
+def _init_worker(A, b):
+    global _A, _b
+    _A, _b = A, b
+
+
+def _worker_batch(args):
+    seed, count, method, threshold = args
+    rng = np.random.default_rng(seed)
+    return _best_of_batch(_A, _b, _draw_subsets(rng, len(_b) // 3, count), method, threshold)
+
+
+def solve_aT3_6p_robust(Link3TEnds, marker_points, method="ransac", threshold=2e-3, hypotheses=2000,
+                        batch_size=500, processes=None, seed=None):
+    """
+    Robust aT3/6p for one group of samples.
+
+    Minimal 5-sample subsets are solved as batches and each batch of hypotheses
+    is scored against every sample with one matrix product. The best
+    hypothesis decides the inliers, which are then re-solved by least squares.
+
+    method: "ransac" (inliers are residuals below threshold, in metres) or
+            "lmeds" (least median of squares, threshold derived from the median)
+    processes: spread hypothesis batches over this many worker processes
+
+    Returns est_aT3 (4, 4), est_6p (1, 3) and the (n,) inlier mask.
+    """
+    assert method in ("ransac", "lmeds")
+    A, b = build_design_matrices(np.asarray(Link3TEnds)[None], np.asarray(marker_points)[None])
+    A, b = A[0], b[0, :, 0]
+    n = len(b) // 3
+    assert n >= MIN_SAMPLES
+
+    rng = np.random.default_rng(seed)
+    counts = [min(batch_size, hypotheses - start) for start in range(0, hypotheses, batch_size)]
+    if processes:
+        seeds = rng.integers(0, 2 ** 63, size=len(counts))
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(A, b)) as pool:
+            best = list(pool.map(_worker_batch, [(s, c, method, threshold) for s, c in zip(seeds, counts)]))
+    else:
+        best = [_best_of_batch(A, b, _draw_subsets(rng, n, c), method, threshold) for c in counts]
+
+    x = max(best, key=lambda item: item[0])[1]
+    errors = sample_errors(A, b, x[None])[0]
+    if method == "lmeds":
+        # Rousseeuw's robust scale estimate from the median residual
+        sigma = 1.4826 * (1 + 5.0 / max(n - MIN_SAMPLES, 1)) * np.sqrt(np.median(errors ** 2))
+        threshold = 2.5 * sigma
+    inliers = errors < threshold
+    if inliers.sum() < MIN_SAMPLES:
+        inliers = np.argsort(errors) < MIN_SAMPLES
+
+    rows = np.repeat(inliers, 3)
+    x = lstsq_batch(A[rows][None], b[rows][None, :, None])[0]
+    est_aT3, est_6p = unpack_solution(x)
+
+    return est_aT3[0], est_6p, inliers
+
+
+def main(json_file, method="ransac"):
+    data = load_data(json_file)
+
+    tracker = PoseSet.from_entries(data["tracker_points"])
+    links = PoseSet.from_link_transforms(data["link_transforms"])
+
+    for idx, group in enumerate(GROUPS):
+        est_aT3, est_6p, inliers = solve_aT3_6p_robust(links.matrices(group)[:, :3, :], tracker.positions(group), method)
+        print(f"Group {idx+1} ({inliers.sum()}/{len(group)} inliers): est_aT3 =\n{est_aT3}\n est_6p =\n{est_6p}\n")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python solve_aT3_6p_robust.py <json_file> [ransac|lmeds]")
+        sys.exit(1)
+
+    main(*sys.argv[1:])
@@ -0,0 +1,87 @@
+import sys
+import numpy as np
+from solve_aT3_6p import build_design_matrices, unpack_solution
+from transforms import quaternion_to_rotation_matrix
+from pose_store import load_data
+from solve_aT3_6p_json_refactor import GROUPS
+
+
+class StreamingAT3Calibrator:
+    """
+    Recursive least-squares form of solve_aT3_6p.
+
+    Keeps an updatable QR factor of the 3n x 15 system: the 15x15 triangular R,
+    Q^T b and the accumulated squared residual. Memory stays flat however many
+    samples are streamed in, and each sample is an O(1) update of R.
+    """
+
+    def __init__(self):
+        self.R = np.zeros((15, 15))
+        self.qtb = np.zeros(15)
+        self.ssr = 0.0
+        self.count = 0
+        self._x = None
+
+    def add(self, Link3TEnd, marker_point):
+        """Add one sample: a 3x4 (or 4x4) Link3->End transform and its tracker point."""
+        self.add_chunk(np.asarray(Link3TEnd)[None], np.asarray(marker_point)[None])
+
+    def add_chunk(self, Link3TEnds, marker_points):
+        """Add k samples at once: (k, 3, 4) transforms and (k, 3) tracker points."""
+        A, b = build_design_matrices(np.asarray(Link3TEnds)[None], np.asarray(marker_points)[None])
+
+        stacked_b = np.concatenate((self.qtb, b[0, :, 0]))
+        Q, self.R = np.linalg.qr(np.vstack((self.R, A[0])))
+        self.qtb = Q.T @ stacked_b
+        # The part of b that Q cannot reach is residual for good
+        self.ssr += max(stacked_b @ stacked_b - self.qtb @ self.qtb, 0.0)
+        self.count += len(marker_points)
+        self._x = None
+
+    def solution(self):
+        """Current 15-vector x, cached until the next sample arrives."""
+        assert self.count >= 5
+        if self._x is None:
+            self._x = np.linalg.lstsq(self.R, self.qtb, rcond=None)[0]
+        return self._x
+
+    def estimate(self):
+        """Current (aT3, 6p) estimate, shaped as solve_aT3_6p returns them."""
+        est_aT3, est_6p = unpack_solution(self.solution()[None, :, None])
+        return est_aT3[0], est_6p
+
+    def residual(self):
+        """Sum of squared residuals |Ax - b|^2 of the current estimate."""
+        x = self.solution()
+        return self.ssr + np.sum((self.R @ x - self.qtb) ** 2)
+
+    def rms(self):
+        """Root-mean-square residual per equation (3 per sample)."""
+        return np.sqrt(self.residual() / (3 * self.count))
+
+
+def main(json_file):
+    data = load_data(json_file)
+
+    tracker_points = {p["name"]: p["pose"] for p in data["tracker_points"]}
+    link_transforms = {t["name"]: t for t in data["link_transforms"]}
+
+    for idx, group in enumerate(GROUPS):
+        calibrator = StreamingAT3Calibrator()
+        for name in group:
+            link_transform = link_transforms[name]
+            r = quaternion_to_rotation_matrix(link_transform["Rotation"])
+            t = np.array(link_transform["Translation"]).reshape(3, 1)
+            calibrator.add(np.hstack((r, t)), tracker_points[name])
+
+        est_aT3, est_6p = calibrator.estimate()
+        print(f"Group {idx+1} ({calibrator.count} samples, rms={calibrator.rms():.6g}): est_aT3 =\n{est_aT3}\n est_6p =\n{est_6p}\n")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python solve_aT3_6p_streaming.py <json_file>")
+        sys.exit(1)
+
+    json_file = sys.argv[1]
+    main(json_file)
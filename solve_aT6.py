@@ -1,47 +1,52 @@
 import numpy as np
-from solve_aT3_6p_json_refactor import solve_aT3_6p  # Import the solve_aT3_6p function
+import instrumentation
+from solve_aT3_6p_json_refactor import GROUPS
+from calibration_cache import calibrate
+from pose_set import PoseSet
+from transforms import compose
 
 
-def quaternion_to_rotation_matrix(q):
-    """Convert quaternion to rotation matrix."""
-    from scipy.spatial.transform import Rotation as R
-    r = R.from_quat([q[0], q[1], q[2], q[3]])  # scalar-last order (x, y, z, w)
-    return r.as_matrix()
-
-
-def calculate_link6_transform(json_data):
+def calculate_link6_transforms(json_data, groups=GROUPS):
     """
-    Solve for aT6 using aT3 results from solve_aT3_6p and link transforms.
+    Solve for aT6 at every point of every group: (G, n, 4, 4) in groups order.
     """
     # Extract necessary data from JSON
     tracker_points = json_data["tracker_points"]
     link_transforms = json_data["link_transforms"]
 
-    # Solve for aT3 using solve_aT3_6p
-    aT3_results = solve_aT3_6p(tracker_points, link_transforms)
+    # aT3 from the calibration cache, solved only if these inputs are new
+    aT3_results = calibrate(tracker_points, link_transforms, groups)
 
-    # Compute aT6 for each group
-    aT6_results = []
-    for idx, (aT3, _) in enumerate(aT3_results):
-        group_name = f"P{idx * 5 + 1}"  # Starting point for each group (P1, P6, P11, etc.)
-        link_transform = next(item for item in link_transforms if item["name"] == group_name)
+    # Compute aT6 = aT3 * 3T6, each group's aT3 broadcast over its points
+    with instrumentation.stage("aT6_composition"):
+        links = PoseSet.from_link_transforms(link_transforms)
+        aT3 = np.array([aT3 for aT3, _ in aT3_results])
+        return compose(aT3[:, None], links.matrices(groups))
 
-        # Extract rotation and translation for 3T6
-        r = quaternion_to_rotation_matrix(link_transform["Rotation"])
-        t = np.array(link_transform["Translation"]).reshape(3, 1)
 
-        # Construct 3T6 matrix
-        link3ToLink6 = np.vstack((np.hstack((r, t)), [0, 0, 0, 1]))
+def calculate_link6_transform(json_data):
+    """
+    Solve for aT6 using aT3 results from solve_aT3_6p and link transforms.
+    """
+    # aT6 of each group's first point (P1, P6, P11, etc.)
+    return list(calculate_link6_transforms(json_data)[:, 0])
 
-        # Calculate aT6 = aT3 * 3T6
-        aT6 = np.dot(aT3, link3ToLink6)
-        aT6_results.append(aT6)
 
-    return aT6_results
+def main(json_file):
+    from pose_store import load_data
+
+    data = load_data(json_file)
+
+    # Calculate aT6 for every point of all groups
+    aT6_results = calculate_link6_transforms(data)
+
+    # Print the results
+    for idx, (group, aT6_group) in enumerate(zip(GROUPS, aT6_results)):
+        for name, aT6 in zip(group, aT6_group):
+            print(f"Group {idx + 1} {name}: aT6 =\n{aT6}\n")
 
 
 if __name__ == "__main__":
-    import json
     import sys
 
     if len(sys.argv) != 2:
@@ -49,12 +54,4 @@ if __name__ == "__main__":
         sys.exit(1)
 
     json_file = sys.argv[1]
-    with open(json_file, "r") as file:
-        data = json.load(file)
-
-    # Calculate aT6 for all groups
-    aT6_results = calculate_link6_transform(data)
-
-    # Print the results
-    for idx, aT6 in enumerate(aT6_results):
-        print(f"Group {idx + 1}: aT6 =\n{aT6}\n")
\ No newline at end of file
+    main(json_file)
\ No newline at end of file
@@ -0,0 +1,201 @@
+import json
+import struct
+import sys
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+
+# One record per successful lookup; pair indexes the recorder's frame_pairs
+RECORD_DTYPE = np.dtype([
+    ("stamp", np.float64),
+    ("pair", np.uint16),
+    ("translation", np.float64, 3),
+    ("rotation", np.float64, 4),   # quaternion, scalar-last (x, y, z, w)
+])
+
+MAGIC = b"TFREC1\n"
+
+
+def write_header(file, frame_pairs):
+    """Magic, then a length-prefixed JSON header naming the dtype and frame pairs."""
+    header = json.dumps({"dtype": RECORD_DTYPE.descr, "frame_pairs": frame_pairs}).encode()
+    file.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+
+def read_recording(path):
+    """Memory-map a recording: returns (records, frame_pairs)."""
+    with open(path, 'rb') as file:
+        assert file.read(len(MAGIC)) == MAGIC, "not a TF recording"
+        size = struct.unpack("<I", file.read(4))[0]
+        header = json.loads(file.read(size))
+        offset = file.tell()
+
+    dtype = np.dtype([tuple(field) for field in header["dtype"]])
+    # A recording still being written can end in a partial record; map whole records only
+    count = _payload_size(path, offset) // dtype.itemsize
+    records = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,)) if count else np.zeros(0, dtype)
+    return records, [tuple(pair) for pair in header["frame_pairs"]]
+
+
+def _payload_size(path, offset):
+    with open(path, 'rb') as file:
+        file.seek(0, 2)
+        return file.tell() - offset
+
+
+class TfRecorder:
+    """
+    Records (stamp, translation, quaternion) of several frame pairs.
+
+    poll() looks every pair up once and stores the results in a preallocated
+    ring buffer; a background thread appends the ring to a binary file in
+    chunks, so the polling side never touches the disk or the logger. When the
+    writer falls behind by a full ring, new samples are dropped and counted.
+
+    tf_buffer: anything with lookup_transform(target, source, time), e.g. a
+               tf2_ros.Buffer or FakeTfBuffer
+    frame_pairs: [(target_frame, source_frame), ...]
+    latest: the time argument meaning "latest available" (rclpy.time.Time())
+    """
+
+    def __init__(self, tf_buffer, frame_pairs, path, capacity=1 << 16, chunk=1 << 12,
+                 flush_interval=0.5, latest=None):
+        self.tf_buffer = tf_buffer
+        self.frame_pairs = [tuple(pair) for pair in frame_pairs]
+        self.latest = latest
+        self.ring = np.zeros(capacity, dtype=RECORD_DTYPE)
+        self.capacity = capacity
+        self.chunk = chunk
+        self.flush_interval = flush_interval
+
+        # head is only advanced by the polling side, tail only by the writer
+        self.head = 0
+        self.tail = 0
+        self.last_stamp = [None] * len(self.frame_pairs)
+
+        self.counters = {"lookups": 0, "recorded": 0, "failed": 0, "duplicates": 0, "overruns": 0,
+                         "written": 0, "latency_sum": 0.0, "latency_max": 0.0}
+
+        self.file = open(path, 'wb')
+        write_header(self.file, self.frame_pairs)
+        self._wake = threading.Condition()
+        self._stop = False
+        self._writer = threading.Thread(target=self._write_loop, name="tf_recorder_writer", daemon=True)
+        self._writer.start()
+
+    def poll(self):
+        """Look every frame pair up once; new transforms go into the ring."""
+        for idx, (target, source) in enumerate(self.frame_pairs):
+            start = time.perf_counter()
+            try:
+                transform = self.tf_buffer.lookup_transform(target, source, self.latest)
+            except Exception:
+                self.counters["failed"] += 1
+                continue
+            finally:
+                latency = time.perf_counter() - start
+                self.counters["lookups"] += 1
+                self.counters["latency_sum"] += latency
+                self.counters["latency_max"] = max(self.counters["latency_max"], latency)
+
+            stamp = transform.header.stamp.sec + transform.header.stamp.nanosec * 1e-9
+            if stamp == self.last_stamp[idx]:
+                # Polling faster than the source publishes
+                self.counters["duplicates"] += 1
+                continue
+            self.last_stamp[idx] = stamp
+
+            if self.head - self.tail >= self.capacity:
+                self.counters["overruns"] += 1
+                continue
+
+            t = transform.transform.translation
+            r = transform.transform.rotation
+            self.ring[self.head % self.capacity] = (stamp, idx, (t.x, t.y, t.z), (r.x, r.y, r.z, r.w))
+            self.head += 1
+            self.counters["recorded"] += 1
+
+            if self.head - self.tail >= self.chunk:
+                with self._wake:
+                    self._wake.notify()
+
+    def _flush(self):
+        head = self.head
+        while self.tail < head:
+            start = self.tail % self.capacity
+            stop = min(start + head - self.tail, self.capacity)
+            self.file.write(self.ring[start:stop].tobytes())
+            self.tail += stop - start
+            self.counters["written"] += stop - start
+        self.file.flush()
+
+    def _write_loop(self):
+        while True:
+            with self._wake:
+                self._wake.wait(self.flush_interval)
+            self._flush()
+            if self._stop:
+                return
+
+    def stats(self):
+        """Counters plus mean lookup latency and current ring fill."""
+        stats = dict(self.counters)
+        stats["latency_mean"] = stats["latency_sum"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["dropped"] = stats["failed"] + stats["overruns"]
+        stats["pending"] = self.head - self.tail
+        return stats
+
+    def close(self):
+        """Stop the writer after a final flush and close the file."""
+        self._stop = True
+        with self._wake:
+            self._wake.notify()
+        self._writer.join()
+        self.file.close()
+
+
+class FakeTfBuffer:
+    """
+    Stand-in for tf2_ros.Buffer: every lookup returns a new, slowly moving
+    transform stamped with the wall clock, or raises for unknown frames.
+    """
+
+    def __init__(self, frames, period=1e-4):
+        self.frames = set(frames)
+        self.period = period
+
+    def lookup_transform(self, target, source, when=None):
+        if target not in self.frames or source not in self.frames:
+            raise LookupError(f"{target} -> {source} does not exist")
+        now = time.time()
+        now -= now % self.period
+        angle = 0.1 * now
+        sec = int(now)
+        return SimpleNamespace(
+            header=SimpleNamespace(stamp=SimpleNamespace(sec=sec, nanosec=int(round((now - sec) * 1e9)))),
+            transform=SimpleNamespace(
+                translation=SimpleNamespace(x=np.cos(angle), y=np.sin(angle), z=0.5),
+                rotation=SimpleNamespace(x=0.0, y=0.0, z=np.sin(angle / 2), w=np.cos(angle / 2))))
+
+
+if __name__ == '__main__':
+    # Record from the fake buffer for a few seconds and report the counters
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python tf_recorder.py <output_file> [seconds]")
+        sys.exit(1)
+
+    seconds = float(sys.argv[2]) if len(sys.argv) == 3 else 2.0
+    recorder = TfRecorder(FakeTfBuffer(["world", "tracker", "wrist3_Link"]),
+                          [("world", "tracker"), ("world", "wrist3_Link"), ("world", "missing")], sys.argv[1])
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        recorder.poll()
+    recorder.close()
+
+    records, frame_pairs = read_recording(sys.argv[1])
+    stats = recorder.stats()
+    print(f"{len(records)} records of {frame_pairs}")
+    print(f"{stats['recorded'] / seconds:.0f} samples/s, dropped={stats['dropped']} "
+          f"(failed={stats['failed']}, overruns={stats['overruns']}), duplicates={stats['duplicates']}, "
+          f"latency mean={stats['latency_mean']*1e6:.1f} us max={stats['latency_max']*1e6:.1f} us")
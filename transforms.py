@@ -0,0 +1,147 @@
+import numpy as np
+
+
+def quaternion_to_rotation_matrix(q):
+    """
+    (..., 4) scalar-last quaternions (x, y, z, w) -> (..., 3, 3) rotation matrices.
+
+    Quaternions are normalized first, as scipy's Rotation.from_quat does; a
+    single quaternion gives a single 3x3 matrix.
+    """
+    q = np.asarray(q, dtype=float)
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    x, y, z, w = np.moveaxis(q, -1, 0)
+
+    xx, yy, zz = x * x, y * y, z * z
+    xy, xz, yz = x * y, x * z, y * z
+    wx, wy, wz = w * x, w * y, w * z
+
+    m = np.empty(q.shape[:-1] + (3, 3))
+    m[..., 0, 0] = 1 - 2 * (yy + zz)
+    m[..., 0, 1] = 2 * (xy - wz)
+    m[..., 0, 2] = 2 * (xz + wy)
+    m[..., 1, 0] = 2 * (xy + wz)
+    m[..., 1, 1] = 1 - 2 * (xx + zz)
+    m[..., 1, 2] = 2 * (yz - wx)
+    m[..., 2, 0] = 2 * (xz - wy)
+    m[..., 2, 1] = 2 * (yz + wx)
+    m[..., 2, 2] = 1 - 2 * (xx + yy)
+    return m
+
+
+def make_transforms(translation, quaternion):
+    """(..., 3) translations and (..., 4) quaternions -> (..., 4, 4) homogeneous transforms."""
+    translation = np.asarray(translation, dtype=float)
+    T = np.zeros(translation.shape[:-1] + (4, 4))
+    T[..., :3, :3] = quaternion_to_rotation_matrix(quaternion)
+    T[..., :3, 3] = translation
+    T[..., 3, 3] = 1
+    return T
+
+
+def compose(A, B):
+    """A @ B for broadcastable (..., 4, 4) stacks, skipping the constant bottom row."""
+    A = np.asarray(A, dtype=float)
+    B = np.asarray(B, dtype=float)
+    shape = np.broadcast_shapes(A.shape, B.shape)
+    T = np.zeros(shape)
+    T[..., :3, :3] = A[..., :3, :3] @ B[..., :3, :3]
+    T[..., :3, 3] = apply(A, B[..., :3, 3])
+    T[..., 3, 3] = 1
+    return T
+
+
+def invert(T):
+    """Inverse of rigid (..., 4, 4) transforms: [R^T, -R^T t]."""
+    T = np.asarray(T, dtype=float)
+    Rt = T[..., :3, :3].swapaxes(-1, -2)
+    inv = np.zeros(T.shape)
+    inv[..., :3, :3] = Rt
+    inv[..., :3, 3] = -(Rt @ T[..., :3, 3, None])[..., 0]
+    inv[..., 3, 3] = 1
+    return inv
+
+
+def apply(T, points):
+    """Transform (..., 3) points by broadcastable (..., 4, 4) transforms."""
+    T = np.asarray(T, dtype=float)
+    points = np.asarray(points, dtype=float)
+    return (T[..., :3, :3] @ points[..., None])[..., 0] + T[..., :3, 3]
+
+
+def positions(T):
+    """(..., 3) translation part of (..., 4, 4) transforms."""
+    return np.asarray(T)[..., :3, 3]
+
+
+def rotation_matrix_to_quaternion(R):
+    """(..., 3, 3) rotation matrices -> (..., 4) unit scalar-last quaternions with w >= 0."""
+    R = np.asarray(R, dtype=float)
+    m00, m11, m22 = R[..., 0, 0], R[..., 1, 1], R[..., 2, 2]
+    # Largest of 4w^2, 4x^2, 4y^2, 4z^2 picks the well-conditioned formula per matrix
+    diag = np.stack([1 + m00 + m11 + m22, 1 + m00 - m11 - m22, 1 - m00 + m11 - m22, 1 - m00 - m11 + m22], axis=-1)
+    k = np.argmax(diag, axis=-1)
+    q = np.empty(R.shape[:-2] + (4,))
+    w = np.stack([diag[..., 0], R[..., 2, 1] - R[..., 1, 2], R[..., 0, 2] - R[..., 2, 0], R[..., 1, 0] - R[..., 0, 1]], -1)
+    x = np.stack([R[..., 2, 1] - R[..., 1, 2], diag[..., 1], R[..., 0, 1] + R[..., 1, 0], R[..., 0, 2] + R[..., 2, 0]], -1)
+    y = np.stack([R[..., 0, 2] - R[..., 2, 0], R[..., 0, 1] + R[..., 1, 0], diag[..., 2], R[..., 1, 2] + R[..., 2, 1]], -1)
+    z = np.stack([R[..., 1, 0] - R[..., 0, 1], R[..., 0, 2] + R[..., 2, 0], R[..., 1, 2] + R[..., 2, 1], diag[..., 3]], -1)
+    # Columns are (w, x, y, z) scaled by 4 * the chosen component
+    wxyz = np.choose(k[..., None], [w, x, y, z])
+    q[..., :3] = wxyz[..., 1:]
+    q[..., 3] = wxyz[..., 0]
+    q /= np.linalg.norm(q, axis=-1, keepdims=True)
+    return np.where(q[..., 3:] < 0, -q, q)
+
+
+def quaternion_multiply(q1, q2):
+    """Hamilton product of broadcastable (..., 4) scalar-last quaternions."""
+    q1 = np.asarray(q1, dtype=float)
+    q2 = np.asarray(q2, dtype=float)
+    x1, y1, z1, w1 = np.moveaxis(q1, -1, 0)
+    x2, y2, z2, w2 = np.moveaxis(q2, -1, 0)
+    return np.stack([
+        w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+        w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+        w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+        w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+    ], axis=-1)
+
+
+def quaternion_conjugate(q):
+    """Inverse rotation of (..., 4) unit scalar-last quaternions."""
+    q = np.array(q, dtype=float)
+    q[..., :3] *= -1
+    return q
+
+
+def quaternion_to_rotvec(q):
+    """(..., 4) unit scalar-last quaternions -> (..., 3) rotation vectors (radians), angle in [0, pi]."""
+    q = np.asarray(q, dtype=float)
+    q = np.where(q[..., 3:] < 0, -q, q)
+    norm = np.linalg.norm(q[..., :3], axis=-1)
+    angle = 2 * np.arctan2(norm, q[..., 3])
+    # angle / sin(angle / 2), with its limit 2 for small angles
+    scale = np.where(norm > 1e-12, angle / np.where(norm > 1e-12, norm, 1.0), 2.0)
+    return q[..., :3] * scale[..., None]
+
+
+def quaternion_angle(q):
+    """(...) geodesic rotation angle (radians, in [0, pi]) of (..., 4) unit quaternions."""
+    q = np.asarray(q, dtype=float)
+    return 2 * np.arctan2(np.linalg.norm(q[..., :3], axis=-1), np.abs(q[..., 3]))
+
+
+def quaternion_left_maps(q):
+    """(N, 4, 4) matrices L with L[k] @ b = conj(q_k) b for any quaternion b."""
+    return quaternion_multiply(quaternion_conjugate(q)[:, None, :], np.eye(4)[None]).swapaxes(1, 2)
+
+
+def quaternion_block_products(maps, i0, i1, right):
+    """
+    (i1 - i0, N - i0, 4) products maps[i] @ right[j] for rows i0..i1 and
+    columns i0..N, as one matmul; with quaternion_left_maps these are the
+    relative rotations conj(q_i) p_j of a block of pose pairs.
+    """
+    r = i1 - i0
+    return (maps[i0:i1].reshape(r * 4, 4) @ right[i0:].T).reshape(r, 4, -1).swapaxes(1, 2)
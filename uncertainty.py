@@ -0,0 +1,230 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+from solve_aT3_6p import build_design_matrices, solve_aT3_6p_batch
+from pose_store import load_data
+from solve_aT3_6p_json_refactor import GROUPS
+from pose_set import PoseSet
+
+# Default 1-sigma noise: tracker points, kinematic translations (m) and rotations (rad)
+TRACKER_SIGMA = 2.5e-5
+TRANSLATION_SIGMA = 1e-4
+ROTATION_SIGMA = 1e-4
+
+# A group's 15 unknowns need 5 distinct samples (3 equations each); with fewer
+# than twice that, the full-rank resamples are little more than permutations
+# of the original set and the bootstrap says nothing
+BOOTSTRAP_MIN_SAMPLES = 10
+
+_inputs = None
+
+
+def perturb_points(rng, points, sigma):
+    """Isotropic Gaussian noise on (..., 3) points."""
+    return points + rng.normal(0.0, sigma, points.shape) if sigma else points
+
+
+def perturb_transforms(rng, transforms, translation_sigma, rotation_sigma):
+    """Left-multiply (..., 3|4, 4) transforms by small random rotations and shift their translations."""
+    out = np.array(transforms, dtype=float)
+    if rotation_sigma:
+        shape = out.shape[:-2]
+        noise = R.from_rotvec(rng.normal(0.0, rotation_sigma, (int(np.prod(shape)), 3))).as_matrix()
+        out[..., :3, :3] = noise.reshape(shape + (3, 3)) @ out[..., :3, :3]
+    if translation_sigma:
+        out[..., :3, 3] += rng.normal(0.0, translation_sigma, out.shape[:-2] + (3,))
+    return out
+
+
+def _resample(rng, L, q):
+    """
+    Resample the samples of every group with replacement, drawing again for
+    any group whose resample leaves the 15 unknowns rank deficient.
+    """
+    count, G, n = q.shape[:3]
+    pick = rng.integers(0, n, size=(count, G, n))
+    redraw = np.ones((count, G), dtype=bool)
+    while redraw.any():
+        pick[redraw] = rng.integers(0, n, size=(redraw.sum(), n))
+        A, _ = build_design_matrices(np.take_along_axis(L[redraw], pick[redraw][..., None, None], axis=1),
+                                     np.take_along_axis(q[redraw], pick[redraw][..., None], axis=1))
+        redraw[redraw] = np.linalg.matrix_rank(A) < A.shape[-1]
+    return np.take_along_axis(L, pick[..., None, None], axis=2), np.take_along_axis(q, pick[..., None], axis=2)
+
+
+def replicate_chunk(inputs, count, rng):
+    """
+    Run count replicates of calibration, aT6 composition and distance evaluation as stacked arrays.
+
+    Every measurement gets one noise draw per replicate: evaluation points that
+    are also calibration samples reuse their sample's perturbed transform and
+    tracker point, so the fitted aT3 and the evaluated points stay correlated.
+
+    Returns (count, M, pairs) distance errors, M = 1 + number of other methods
+    (the calibrated aT6 is method 0), and (count, G, 3) 6p estimates.
+    """
+    Link3TEnds = inputs["Link3TEnds"]            # (G, n, 3, 4)
+    marker_points = inputs["marker_points"]      # (G, n, 3)
+    G, n = marker_points.shape[:2]
+    noise = inputs["noise"]
+
+    L = perturb_transforms(rng, np.broadcast_to(Link3TEnds, (count,) + Link3TEnds.shape),
+                           noise["translation_sigma"], noise["rotation_sigma"])
+    q = perturb_points(rng, np.broadcast_to(marker_points, (count,) + marker_points.shape), noise["tracker_sigma"])
+    L_fit, q_fit = _resample(rng, L, q) if inputs["bootstrap"] else (L, q)
+
+    est_aT3, est_6p = solve_aT3_6p_batch(L_fit.reshape(count * G, n, 3, 4), q_fit.reshape(count * G, n, 3))
+    est_aT3 = est_aT3.reshape(count, G, 4, 4)
+
+    # aT6 = aT3 * 3T6 for every evaluation point, with its group's aT3
+    groups, samples = inputs["eval_groups"], inputs["eval_samples"]
+    shared = samples >= 0
+    link3ToLink6 = perturb_transforms(rng, np.broadcast_to(inputs["eval_links"], (count,) + inputs["eval_links"].shape),
+                                      noise["translation_sigma"], noise["rotation_sigma"])
+    link3ToLink6[:, shared] = L[:, groups[shared], samples[shared]]
+    aT3 = est_aT3[:, groups]
+    calibrated = np.einsum('rpij,rpj->rpi', aT3[..., :3, :3], link3ToLink6[..., :3, 3]) + aT3[..., :3, 3]
+
+    reference = perturb_points(rng, np.broadcast_to(inputs["reference"], calibrated.shape), noise["tracker_sigma"])
+    reference[:, shared] = q[:, groups[shared], samples[shared]]
+    methods = [calibrated] + [perturb_points(rng, np.broadcast_to(points, calibrated.shape), noise["translation_sigma"])
+                              for points in inputs["methods"]]
+
+    i, j = np.triu_indices(calibrated.shape[1], 1)
+    ref_dist = np.linalg.norm(reference[:, i] - reference[:, j], axis=2)
+    errors = np.stack([np.abs(ref_dist - np.linalg.norm(points[:, i] - points[:, j], axis=2)) for points in methods], axis=1)
+
+    return errors, est_6p.reshape(count, G, 3)
+
+
+def _init_worker(inputs):
+    global _inputs
+    _inputs = inputs
+
+
+def _worker_chunk(args):
+    start, stop, seed, errors_name, p_name, errors_shape, p_shape = args
+    errors_shm = shared_memory.SharedMemory(name=errors_name)
+    p_shm = shared_memory.SharedMemory(name=p_name)
+    try:
+        errors, est_6p = replicate_chunk(_inputs, stop - start, np.random.default_rng(seed))
+        np.ndarray(errors_shape, dtype=np.float64, buffer=errors_shm.buf)[start:stop] = errors
+        np.ndarray(p_shape, dtype=np.float64, buffer=p_shm.buf)[start:stop] = est_6p
+    finally:
+        errors_shm.close()
+        p_shm.close()
+
+
+def run_replicates(inputs, replicates=2000, chunk=250, processes=None, seed=None):
+    """
+    All replicates, chunked; with processes, chunks run in worker processes that
+    write straight into shared-memory result arrays.
+
+    Returns errors (replicates, M, pairs) and 6p (replicates, G, 3).
+    """
+    rng = np.random.default_rng(seed)
+    bounds = [(start, min(start + chunk, replicates)) for start in range(0, replicates, chunk)]
+    seeds = rng.integers(0, 2 ** 63, size=len(bounds))
+
+    if not processes:
+        results = [replicate_chunk(inputs, stop - start, np.random.default_rng(s)) for (start, stop), s in zip(bounds, seeds)]
+        return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+    P = len(inputs["reference"])
+    errors_shape = (replicates, 1 + len(inputs["methods"]), P * (P - 1) // 2)
+    p_shape = (replicates, inputs["marker_points"].shape[0], 3)
+    errors_shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(errors_shape)) * 8, 1))
+    p_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(p_shape)) * 8)
+    try:
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(inputs,)) as pool:
+            list(pool.map(_worker_chunk, [(start, stop, s, errors_shm.name, p_shm.name, errors_shape, p_shape)
+                                          for (start, stop), s in zip(bounds, seeds)]))
+        errors = np.ndarray(errors_shape, dtype=np.float64, buffer=errors_shm.buf).copy()
+        est_6p = np.ndarray(p_shape, dtype=np.float64, buffer=p_shm.buf).copy()
+    finally:
+        errors_shm.close()
+        errors_shm.unlink()
+        p_shm.close()
+        p_shm.unlink()
+
+    return errors, est_6p
+
+
+def make_inputs(Link3TEnds, marker_points, eval_groups, eval_links, reference, methods, bootstrap=False,
+                tracker_sigma=TRACKER_SIGMA, translation_sigma=TRANSLATION_SIGMA, rotation_sigma=ROTATION_SIGMA,
+                eval_samples=None):
+    """
+    Bundle one session for run_replicates.
+
+    Link3TEnds (G, n, 3|4, 4) and marker_points (G, n, 3) are the calibration groups;
+    eval_groups (P,) names the group whose aT3 each of the P evaluation points
+    uses, eval_links (P, 3|4, 4) their 3T6, reference (P, 3) the tracker ground
+    truth and methods a list of (P, 3) positions from the other methods.
+    eval_samples (P,) is the index of each evaluation point within its group's
+    samples when it is the same measurement, -1 otherwise.
+    """
+    n = np.shape(marker_points)[1]
+    if bootstrap and n < BOOTSTRAP_MIN_SAMPLES:
+        raise ValueError(f"bootstrap needs at least {BOOTSTRAP_MIN_SAMPLES} samples per group, got {n}")
+    eval_samples = np.full(len(eval_groups), -1) if eval_samples is None else eval_samples
+    return {
+        "Link3TEnds": np.asarray(Link3TEnds, dtype=float)[..., :3, :],
+        "marker_points": np.asarray(marker_points, dtype=float)[..., :3],
+        "eval_groups": np.asarray(eval_groups, dtype=np.intp),
+        "eval_samples": np.asarray(eval_samples, dtype=np.intp),
+        "eval_links": np.asarray(eval_links, dtype=float)[..., :3, :],
+        "reference": np.asarray(reference, dtype=float)[..., :3],
+        "methods": [np.asarray(points, dtype=float)[..., :3] for points in methods],
+        "bootstrap": bootstrap,
+        "noise": {"tracker_sigma": tracker_sigma, "translation_sigma": translation_sigma, "rotation_sigma": rotation_sigma},
+    }
+
+
+def main(data_file, replicates=2000, processes=None, bootstrap=False):
+    data = load_data(data_file)
+
+    tracker = PoseSet.from_entries(data["tracker_points"])
+    links = PoseSet.from_link_transforms(data["link_transforms"])
+    wrist3_Link_poses = PoseSet.from_entries(data["wrist3_Link_poses"])
+    sensor_poses = PoseSet.from_entries(data["sensor_poses"])
+
+    names = ["P1", "P6", "P11"]
+    labels = ["Method 2 (calib_link3+last3_kinematics)", "Method 3 (aubo_kinematics)", "Method 4 (handeye)"]
+
+    eval_groups = [next(g for g, group in enumerate(GROUPS) if name in group) for name in names]
+    eval_samples = [GROUPS[g].index(name) for g, name in zip(eval_groups, names)]
+    try:
+        inputs = make_inputs(links.matrices(GROUPS), tracker.positions(GROUPS), eval_groups, links.matrices(names),
+                             tracker.positions(names), [wrist3_Link_poses.positions(names), sensor_poses.positions(names)],
+                             bootstrap=bootstrap, eval_samples=eval_samples)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    errors, est_6p = run_replicates(inputs, int(replicates), processes=int(processes) if processes else None)
+
+    i, j = np.triu_indices(len(names), 1)
+    bands = np.percentile(errors, [2.5, 50, 97.5], axis=0)
+    print(f"Distance errors over {len(errors)} replicates [2.5%, 50%, 97.5%]:")
+    for m, label in enumerate(labels):
+        print(label)
+        for k in range(len(i)):
+            print(f"  {names[i[k]]}-{names[j[k]]}: {bands[0, m, k]:.6f} {bands[1, m, k]:.6f} {bands[2, m, k]:.6f}")
+        mean_bands = np.percentile(errors[:, m].mean(axis=1), [2.5, 50, 97.5])
+        print(f"  mean: {mean_bands[0]:.6f} {mean_bands[1]:.6f} {mean_bands[2]:.6f}")
+
+    p_bands = np.percentile(est_6p, [2.5, 50, 97.5], axis=0)
+    for g in range(len(GROUPS)):
+        print(f"Group {g+1} est_6p [2.5%, 50%, 97.5%]:\n{p_bands[:, g]}")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    bootstrap = "--bootstrap" in args
+    args = [arg for arg in args if arg != "--bootstrap"]
+    if len(args) not in (1, 2, 3):
+        print("Usage: python uncertainty.py <json_file> [replicates] [processes] [--bootstrap]")
+        sys.exit(1)
+
+    main(*args, bootstrap=bootstrap)